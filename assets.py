@@ -0,0 +1,204 @@
+"""
+Fingerprinted, precompressed static assets.
+
+build_assets() copies every file in static/ to static/dist/ under a name
+carrying a hash of its content (main.css -> dist/main.1a2b3c4d5e6f.css),
+writes gzip and, when the brotli package is installed, brotli variants of
+text assets next to it, and records the mapping in static/dist/manifest.json.
+url_for("static", ...) then points at the fingerprinted names, so a changed
+file always gets a new URL and every asset can be cached forever.
+
+StaticAssets serves the current build straight from memory before the
+request reaches Flask, picking the best encoding the client accepts. In
+production a front server can do the same with no Python at all, e.g.
+nginx with gzip_static/brotli_static on and, for /static/dist/,
+add_header Cache-Control "public, max-age=31536000, immutable".
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DIST = "dist"
+MANIFEST = "manifest.json"
+COMPRESSIBLE = (".css", ".js", ".svg", ".html", ".json", ".txt", ".map")
+MAX_AGE = 31536000
+# url(...) references in stylesheets that may point at other static files
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+
+def fingerprint(name, data):
+    """
+    Returns the content-addressed name of a file
+    """
+    base, ext = os.path.splitext(name)
+    return "%s.%s%s" % (base, hashlib.sha256(data).hexdigest()[:12], ext)
+
+
+def rewrite_css(name, data, manifest):
+    """
+    Points url() references to other static files at their fingerprinted
+    names, relative to the stylesheet
+    """
+    directory = os.path.dirname(name)
+
+    def replace(match):
+        url = match.group(2)
+        if "://" in url or url.startswith(("data:", "/", "#")):
+            return match.group(0)
+        path, _, suffix = url.partition("?")
+        target = os.path.normpath(os.path.join(directory, path)).replace(os.sep, "/")
+        hashed = manifest.get(target)
+        if hashed is None:
+            return match.group(0)
+        relative = os.path.relpath(hashed, os.path.join(DIST, directory))
+        return "url(%s%s%s)" % (
+            match.group(1),
+            relative.replace(os.sep, "/") + ("?" + suffix if suffix else ""),
+            match.group(1),
+        )
+
+    return CSS_URL.sub(replace, data.decode("utf-8")).encode("utf-8")
+
+
+def compressed_variants(data):
+    """
+    Returns {suffix: bytes} for the encodings that make the file smaller
+    """
+    variants = {".gz": gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = brotli.compress(data, quality=11)
+    return {k: v for k, v in variants.items() if len(v) < len(data)}
+
+
+def negotiate(accept_encoding, encodings):
+    """
+    Returns the encoding the Accept-Encoding header rates highest among the
+    available ones, given best first with None for the identity encoding.
+    Encodings with q=0 are never picked, identity is acceptable unless it
+    or * is refused explicitly.
+    """
+    accepted = parse_accept_header(accept_encoding)
+    listed = {value.lower() for value, _ in accepted}
+    best, best_quality = None, 0
+    for encoding in encodings:
+        if encoding is None and not listed & {"identity", "*"}:
+            quality = 1
+        else:
+            quality = accepted.quality(encoding or "identity")
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build_assets(static_dir):
+    """
+    Builds static/dist and its manifest, returns {source name: dist name}.
+    Files of earlier builds are kept for pages that still reference them.
+    """
+    names = []
+    for root, dirs, files in os.walk(static_dir):
+        if root == static_dir and DIST in dirs:
+            dirs.remove(DIST)
+        for file in files:
+            path = os.path.relpath(os.path.join(root, file), static_dir)
+            names.append(path.replace(os.sep, "/"))
+    # stylesheets last so they can refer to the fingerprinted images
+    names.sort(key=lambda n: (n.endswith(".css"), n))
+
+    manifest = {}
+    for name in names:
+        with open(os.path.join(static_dir, name), "rb") as f:
+            data = f.read()
+        if name.endswith(".css"):
+            data = rewrite_css(name, data, manifest)
+        hashed = "%s/%s" % (DIST, fingerprint(name, data))
+        target = os.path.join(static_dir, hashed)
+        write_file(target, data)
+        if name.endswith(COMPRESSIBLE):
+            for suffix, variant in compressed_variants(data).items():
+                write_file(target + suffix, variant)
+        manifest[name] = hashed
+
+    write_file(
+        os.path.join(static_dir, DIST, MANIFEST),
+        json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"),
+    )
+    return manifest
+
+
+def load_manifest(static_dir):
+    """
+    Returns the manifest of the last build, empty when assets were not built
+    """
+    try:
+        with open(os.path.join(static_dir, DIST, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+class StaticAssets:
+    """
+    WSGI middleware answering requests for the built assets from memory,
+    with immutable caching and precompressed bodies. Anything else, including
+    files of older builds, is passed on to the app.
+    """
+
+    def __init__(self, app, static_dir, manifest, url_path="/static"):
+        self.app = app
+        self.files = {}
+        for hashed in manifest.values():
+            path = os.path.join(static_dir, hashed)
+            content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            if content_type.startswith("text/"):
+                content_type += "; charset=utf-8"
+            variants = {}
+            for encoding, suffix in (("br", ".br"), ("gzip", ".gz"), (None, "")):
+                if os.path.exists(path + suffix):
+                    with open(path + suffix, "rb") as f:
+                        variants[encoding] = f.read()
+            self.files["%s/%s" % (url_path, hashed)] = (
+                content_type,
+                '"%s"' % os.path.basename(hashed),
+                variants,
+            )
+
+    def __call__(self, environ, start_response):
+        entry = self.files.get(environ.get("PATH_INFO"))
+        if entry is None or environ["REQUEST_METHOD"] not in ("GET", "HEAD"):
+            return self.app(environ, start_response)
+        content_type, etag, variants = entry
+        headers = [
+            ("Content-Type", content_type),
+            ("Cache-Control", "public, max-age=%d, immutable" % MAX_AGE),
+            ("ETag", etag),
+            ("Vary", "Accept-Encoding"),
+        ]
+        if environ.get("HTTP_IF_NONE_MATCH") == etag:
+            start_response("304 Not Modified", headers)
+            return [b""]
+        encoding = negotiate(environ.get("HTTP_ACCEPT_ENCODING", ""), variants)
+        body = variants[encoding]
+        if encoding is not None:
+            headers.append(("Content-Encoding", encoding))
+        headers.append(("Content-Length", str(len(body))))
+        start_response("200 OK", headers)
+        return [b"" if environ["REQUEST_METHOD"] == "HEAD" else body]
@@ -0,0 +1,119 @@
+"""
+In-memory prefix index for product name and SKU suggestions.
+
+Terms are kept in one sorted list, a prefix lookup is a binary search followed
+by a short forward scan, so suggestions never touch Typesense or Firebase.
+A new catalog snapshot is indexed on a background thread, lookups keep using
+the previous entries until the new ones are swapped in. Products changed in
+the snapshot overlay in between are patched in place of their old entries.
+"""
+import threading
+from bisect import bisect_left
+
+
+class Autocomplete:
+    def __init__(self):
+        self.generation = None  # catalog version the entries are at
+        self.base = None  # snapshot generation they were built from
+        self._applied = {}  # overlay products already in the entries
+        self._entries = []  # (normalized term, text, product id, kind)
+        self._building = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def terms(product):
+        """
+        Yields the entries a product is findable by: its full name, every
+        later word of the name, and its sku
+        """
+        name = str(product["name"])
+        words = name.split()
+        for i in range(len(words)):
+            yield " ".join(words[i:]).lower(), name, product["id"], "name"
+        sku = str(product["sku"])
+        yield sku.lower(), sku, product["id"], "sku"
+
+    def rebuild(self, products, generation=None, base=None, overlay=None):
+        """
+        Replaces the entries with those of products, which include the given
+        overlay of the snapshot generation base
+        """
+        entries = sorted(
+            set(entry for product in products for entry in self.terms(product))
+        )
+        with self._lock:
+            self._entries = entries
+            self.generation = generation
+            self.base = base
+            self._applied = dict(overlay or {})
+
+    def rebuild_async(self, load):
+        """
+        Rebuilds from load() -> rebuild() arguments on a background thread,
+        unless a rebuild is already running. Returns True if one was started.
+        """
+        with self._lock:
+            if self._building:
+                return False
+            self._building = True
+
+        def run():
+            try:
+                self.rebuild(*load())
+            except Exception as e:
+                print(e)
+            finally:
+                with self._lock:
+                    self._building = False
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def update(self, overlay, published, generation):
+        """
+        Brings the entries up to the overlay {id: product} of the same base
+        snapshot, replacing the entries of every changed product. published
+        returns a product as it is in the snapshot, for products the overlay
+        changes for the first time.
+        """
+        with self._lock:
+            entries = list(self._entries)
+            for product_id, product in overlay.items():
+                old = self._applied.get(product_id)
+                if old == product:
+                    continue
+                if old is None:
+                    old = published(product_id)
+                for entry in set(self.terms(old)) if old else ():
+                    i = bisect_left(entries, entry)
+                    if i < len(entries) and entries[i] == entry:
+                        del entries[i]
+                for entry in set(self.terms(product)):
+                    i = bisect_left(entries, entry)
+                    if i == len(entries) or entries[i] != entry:
+                        entries.insert(i, entry)
+                self._applied[product_id] = product
+            self._entries = entries
+            self.generation = generation
+
+    def suggest(self, prefix, k=10):
+        """
+        Returns up to k suggestions starting with prefix, each text once
+        """
+        prefix = prefix.strip().lower()
+        if not prefix or k < 1:
+            return []
+        entries = self._entries
+        output = []
+        seen = set()
+        for i in range(bisect_left(entries, (prefix,)), len(entries)):
+            term, text, product_id, kind = entries[i]
+            if not term.startswith(prefix):
+                break
+            if (text, kind) in seen:
+                continue
+            seen.add((text, kind))
+            output.append({"text": text, "id": product_id, "kind": kind})
+            if len(output) >= k:
+                break
+        return output
@@ -0,0 +1,90 @@
+"""
+Runs several API calls in one HTTP request.
+
+Every sub-request is dispatched through the normal Flask routing, hooks and
+views in its own request context on a worker thread, so independent backend
+fetches overlap. The contexts share the session that was decoded for the
+batch instead of decoding the cookie again, and get the batch's admin token
+header. Only read-only endpoints may be batched, which keeps the shared
+session safe to use from several threads.
+"""
+from urllib.parse import urlsplit
+
+from flask import request
+from flask.sessions import SecureCookieSessionInterface
+from werkzeug.test import EnvironBuilder
+
+# WSGI environ key carrying the batch's session into its sub-requests
+SESSION_KEY = "shop.batch_session"
+
+
+class BatchSessionInterface(SecureCookieSessionInterface):
+    """
+    Cookie sessions, except that sub-requests of a batch reuse the session
+    of the batch request
+    """
+
+    def open_session(self, app, request):
+        shared = request.environ.get(SESSION_KEY)
+        if shared is not None:
+            return shared
+        return super().open_session(app, request)
+
+    def save_session(self, app, session, response):
+        # the batch request itself saves the shared session
+        if SESSION_KEY not in request.environ:
+            super().save_session(app, session, response)
+
+
+def parse_batch(body, max_requests):
+    """
+    Validates {"requests": [{"path": ..., "method": "GET"}, ...]}, returns
+    (sub-requests, error)
+    """
+    items = body.get("requests") if isinstance(body, dict) else None
+    if not isinstance(items, list) or not items:
+        return None, "Missing data"
+    if len(items) > max_requests:
+        return None, "At most %d requests per batch" % max_requests
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get("path"), str):
+            return None, "Every request needs a path"
+        if (item.get("method") or "GET").upper() != "GET":
+            return None, "Only GET requests can be batched"
+    return items, None
+
+
+def run_subrequest(app, session, item, endpoints, environ_base=None, headers=None):
+    """
+    Dispatches one sub-request with the shared session and the given headers
+    of the batch request, returns its result as {"path", "status", "body"}.
+    The app must use BatchSessionInterface.
+    """
+    url = urlsplit(item["path"])
+    result = {"path": item["path"]}
+    builder = EnvironBuilder(
+        path=url.path,
+        query_string=url.query,
+        method="GET",
+        headers=headers,
+        environ_base=dict(environ_base or {}, **{SESSION_KEY: session}),
+    )
+    try:
+        with app.request_context(builder.get_environ()) as ctx:
+            rule = ctx.request.url_rule
+            if rule is None or rule.endpoint not in endpoints:
+                result.update(status=400, body={"error": "Request cannot be batched"})
+                return result
+            try:
+                response = app.full_dispatch_request()
+            except Exception as e:
+                # fails this sub-request only, as a 500 like any other request
+                response = app.handle_exception(e)
+            result["status"] = response.status_code
+            if response.is_json:
+                result["body"] = response.get_json()
+            else:
+                result["body"] = response.get_data(as_text=True)
+    finally:
+        builder.close()
+    return result
@@ -0,0 +1,120 @@
+"""
+Concurrency benchmark for inventory reservations on a single hot product.
+
+Many threads run add-to-cart (reserve) and checkout (commit) against one
+product with limited stock, more checkouts than there is stock. The run
+fails unless exactly the stock was sold, every other checkout was turned
+away and no stock or reservation was left behind.
+
+    python benchmark_stock.py --threads 64 --stock 2000 --shards 8
+    python benchmark_stock.py --firebase --threads 32 --stock 500
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from inventory import Inventory, OutOfStock
+from storage import SqliteStorage, push_id
+
+
+def checkout_worker(inventory, product_id, checkouts, quantity, results, lock):
+    counts = Counter()
+    latencies = []
+    for i in range(checkouts):
+        started = time.perf_counter()
+        try:
+            reservation_id = inventory.reserve(product_id, quantity, "bench@example.com")
+            inventory.commit({product_id: quantity}, [reservation_id])
+            counts["sold"] += 1
+        except OutOfStock:
+            counts["out_of_stock"] += 1
+        except Exception as e:
+            print(e)
+            counts["errors"] += 1
+        latencies.append(time.perf_counter() - started)
+    with lock:
+        results["counts"].update(counts)
+        results["latencies"].extend(latencies)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--stock", type=int, default=1000)
+    parser.add_argument("--shards", type=int, default=8)
+    parser.add_argument("--quantity", type=int, default=1)
+    parser.add_argument(
+        "--oversubscribe",
+        type=float,
+        default=1.5,
+        help="checkouts attempted per unit of stock",
+    )
+    parser.add_argument("--sqlite", help="SQLite database, a temporary one by default")
+    parser.add_argument(
+        "--firebase", action="store_true", help="run against the Realtime Database"
+    )
+    args = parser.parse_args()
+
+    if args.firebase:
+        from generate_data import firebase_storage
+
+        storage = firebase_storage()
+    else:
+        path = args.sqlite or os.path.join(tempfile.mkdtemp(), "stock.db")
+        storage = SqliteStorage(path)
+    inventory = Inventory(storage.stock, shards=args.shards)
+    product_id = push_id()
+    inventory.set_stock(product_id, args.stock)
+
+    attempts = int(args.stock / args.quantity * args.oversubscribe)
+    per_thread = -(-attempts // args.threads)
+    results = {"counts": Counter(), "latencies": []}
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(
+            target=checkout_worker,
+            args=(inventory, product_id, per_thread, args.quantity, results, lock),
+        )
+        for _ in range(args.threads)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duration = time.perf_counter() - started
+
+    counts = results["counts"]
+    left = inventory.available(product_id)
+    pending = len(inventory.stock.expired_reservations(float("inf")))
+    print(
+        "%d checkouts on %d threads in %.2fs: %.0f/s, p50 %.1fms, p99 %.1fms"
+        % (
+            per_thread * args.threads,
+            args.threads,
+            duration,
+            per_thread * args.threads / duration,
+            percentile(results["latencies"], 0.5) * 1000,
+            percentile(results["latencies"], 0.99) * 1000,
+        )
+    )
+    print(
+        "sold %d, out of stock %d, errors %d, stock left %d, reservations left %d"
+        % (counts["sold"], counts["out_of_stock"], counts["errors"], left, pending)
+    )
+    expected = args.stock // args.quantity
+    if counts["sold"] != expected or left != args.stock % args.quantity or pending:
+        raise SystemExit("FAILED: stock was oversold, undersold or leaked")
+    print("OK: no lost updates")
+
+
+if __name__ == "__main__":
+    main()
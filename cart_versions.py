@@ -0,0 +1,35 @@
+"""
+Cart versions kept in the session.
+
+Every cart change bumps the version and logs the ids of the line items it
+touched, so a client that already has an older version of the cart is sent
+only those line items. The log is bounded, a client that is further behind
+gets the whole cart.
+"""
+
+
+def record_change(cart, ids, log_size=20):
+    """
+    Bumps the version of the cart (the session) and remembers which line
+    items changed in it, returns the new version
+    """
+    version = cart.get("cart_version", 0) + 1
+    changes = cart.get("cart_changes", [])[-(log_size - 1) :]
+    changes.append([version, sorted(ids)])
+    cart["cart_version"] = version
+    cart["cart_changes"] = changes
+    return version
+
+
+def changes_since(cart, version):
+    """
+    Returns the ids of line items changed after version, None when the change
+    log no longer reaches back that far
+    """
+    current = cart.get("cart_version", 0)
+    if version == current:
+        return set()
+    changes = cart.get("cart_changes", [])
+    if version > current or not changes or changes[0][0] > version + 1:
+        return None
+    return {i for v, ids in changes if v > version for i in ids}
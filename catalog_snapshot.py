@@ -0,0 +1,472 @@
+"""
+Memory-mapped catalog snapshot shared by every worker process.
+
+One process builds the snapshot from the products tree and publishes it with
+an atomic rename, the other workers map the same file read-only so the catalog
+lives once in the page cache instead of once per worker.
+
+File layout (native byte order, the file never leaves the machine):
+
+    header      magic, format version, record count, generation, blob length,
+                created_at high-water mark, crc32 of everything after the header
+    price       count x float64
+    created_at  count x float64
+    strings     count x len(STRING_FIELDS) x (offset, length) uint32 into blob
+    sort orders len(SORT_KEYS) x count x uint32 record indexes
+    blob        utf-8 string data, identical strings stored once
+
+Records are stored ordered by id, which is the order Firebase returns pushed
+keys in, so lookups by id are a binary search over the mapped strings.
+
+The file doubles as the warm-start cache: on boot a valid snapshot is mapped
+as is and only products newer than its high-water mark are fetched.
+
+Products added or edited between two builds go to a small JSON overlay next
+to the snapshot instead of rewriting it. Readers merge the overlay by id, and
+the next snapshot build folds it in. Every overlay change has a sequence
+number, so generation + sequence is a catalog version that never goes back.
+"""
+import heapq
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from product_store import as_column, drop_indexes, filter_indexes
+
+try:
+    import fcntl
+except ImportError:  # Windows, publishing falls back to no locking
+    fcntl = None
+
+MAGIC = b"KECATSNP"
+FORMAT_VERSION = 2
+HEADER = struct.Struct("=8sIIQQdI4x")
+STRING_FIELDS = ("id", "name", "sku", "image")
+SORT_KEYS = ("name", "price", "sku", "created_at")
+
+
+def build_snapshot(products, generation):
+    """
+    Serializes a list of product dicts into the snapshot format
+    """
+    records = sorted(products, key=lambda p: p["id"])
+    count = len(records)
+
+    prices = array("d", (float(p["price"]) for p in records))
+    created_at = array("d", (float(p["created_at"]) for p in records))
+
+    refs = array("I")
+    blob = bytearray()
+    interned = {}
+    for p in records:
+        for field in STRING_FIELDS:
+            data = str(p[field]).encode("utf-8")
+            ref = interned.get(data)
+            if ref is None:
+                ref = interned[data] = (len(blob), len(data))
+                blob += data
+            refs.extend(ref)
+
+    orders = array("I")
+    for key in SORT_KEYS:
+        orders.extend(
+            sorted(range(count), key=lambda i: (records[i][key], records[i]["id"]))
+        )
+
+    body = b"".join(
+        (
+            prices.tobytes(),
+            created_at.tobytes(),
+            refs.tobytes(),
+            orders.tobytes(),
+            bytes(blob),
+        )
+    )
+    high_water = max(created_at) if count else 0.0
+    header = HEADER.pack(
+        MAGIC,
+        FORMAT_VERSION,
+        count,
+        generation,
+        len(blob),
+        high_water,
+        zlib.crc32(body),
+    )
+    return header + body
+
+
+def read_generation(path):
+    """
+    Returns the generation of the snapshot published at path, 0 if none
+    """
+    try:
+        with open(path, "rb") as f:
+            magic, version, count, generation, blob_len, high_water, crc = (
+                HEADER.unpack(f.read(HEADER.size))
+            )
+    except (OSError, struct.error):
+        return 0
+    if magic != MAGIC or version != FORMAT_VERSION:
+        return 0
+    return generation
+
+
+def publish_snapshot(path, products, generation=None):
+    """
+    Writes a new snapshot next to path and atomically swaps it in. Readers that
+    still map the previous file keep a valid view until they refresh.
+    """
+    if generation is None:
+        generation = read_generation(path) + 1
+    data = build_snapshot(products, generation)
+    tmp_path = "%s.tmp.%d" % (path, os.getpid())
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return generation
+
+
+def snapshot_record(product):
+    """
+    Returns a product the way the snapshot hands it out
+    """
+    record = {field: str(product[field]) for field in STRING_FIELDS}
+    record["price"] = float(product["price"])
+    record["created_at"] = float(product["created_at"])
+    return record
+
+
+def read_overlay(path):
+    """
+    Returns (sequence, {id: [sequence, product]}) of the overlay of the
+    snapshot at path
+    """
+    try:
+        with open(path + ".overlay") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return 0, {}
+    return data["sequence"], data["products"]
+
+
+def _write_overlay(path, sequence, entries):
+    tmp_path = "%s.overlay.tmp.%d" % (path, os.getpid())
+    with open(tmp_path, "w") as f:
+        json.dump({"sequence": sequence, "products": entries}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path + ".overlay")
+
+
+def publish_overlay(path, products):
+    """
+    Adds or replaces products on top of the snapshot at path without
+    rewriting it, in time proportional to the overlay, not the catalog.
+    Returns the new overlay sequence number.
+    """
+    with publish_lock(path + ".overlay"):
+        sequence, entries = read_overlay(path)
+        sequence += 1
+        for product in products:
+            entries[product["id"]] = [sequence, snapshot_record(product)]
+        _write_overlay(path, sequence, entries)
+    return sequence
+
+
+def fold_overlay(path, sequence):
+    """
+    Drops the overlay entries up to sequence, once a snapshot that contains
+    them is published
+    """
+    with publish_lock(path + ".overlay"):
+        current, entries = read_overlay(path)
+        remaining = {k: v for k, v in entries.items() if v[0] > sequence}
+        if len(remaining) != len(entries):
+            _write_overlay(path, current, remaining)
+
+
+@contextmanager
+def publish_lock(path, blocking=True):
+    """
+    Serializes snapshot publishing across processes. Yields False when
+    blocking is off and another process already holds the lock.
+    """
+    if fcntl is None:
+        yield True
+        return
+    with open(path + ".lock", "a") as lock_file:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock_file, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class _SnapshotView:
+    """
+    Read-only view over one mapped snapshot file. Views are never mutated, a
+    refresh swaps in a new one so concurrent readers are never disturbed.
+    """
+
+    __slots__ = (
+        "mm",
+        "generation",
+        "high_water",
+        "count",
+        "price",
+        "created_at",
+        "refs",
+        "orders",
+        "blob",
+    )
+
+    def __init__(self, mm):
+        magic, version, count, generation, blob_len, high_water, crc = (
+            HEADER.unpack_from(mm, 0)
+        )
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Unsupported catalog snapshot")
+        if zlib.crc32(memoryview(mm)[HEADER.size :]) != crc:
+            raise ValueError("Corrupt catalog snapshot")
+
+        buf = memoryview(mm)
+        offset = HEADER.size
+        columns = []
+        for itemsize, fmt, length in (
+            (8, "d", count),
+            (8, "d", count),
+            (4, "I", count * len(STRING_FIELDS) * 2),
+            (4, "I", count * len(SORT_KEYS)),
+        ):
+            columns.append(buf[offset : offset + itemsize * length].cast(fmt))
+            offset += itemsize * length
+
+        self.mm = mm
+        self.generation = generation
+        self.high_water = high_water
+        self.count = count
+        self.price, self.created_at, self.refs, self.orders = columns
+        self.blob = buf[offset : offset + blob_len]
+
+    def string(self, index, field):
+        slot = (index * len(STRING_FIELDS) + STRING_FIELDS.index(field)) * 2
+        start = self.refs[slot]
+        return str(self.blob[start : start + self.refs[slot + 1]], "utf-8")
+
+    def record(self, index):
+        return {
+            "id": self.string(index, "id"),
+            "name": self.string(index, "name"),
+            "price": self.price[index],
+            "sku": self.string(index, "sku"),
+            "image": self.string(index, "image"),
+            "created_at": self.created_at[index],
+        }
+
+    def lower_bound(self, product_id):
+        """
+        Returns the index of the first record whose id is not below product_id
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.string(middle, "id") < product_id:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, product_id):
+        index = self.lower_bound(product_id)
+        if index < self.count and self.string(index, "id") == product_id:
+            return index
+        return -1
+
+    def order(self, key):
+        start = SORT_KEYS.index(key) * self.count
+        return self.orders[start : start + self.count]
+
+
+class CatalogSnapshot:
+    """
+    Process-local handle on the published snapshot. Checks for a newer file at
+    most every check_interval seconds and remaps it when it changed.
+    """
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._view = None
+        self._ident = None
+        self._overlay = (0, {})  # (sequence, {id: product})
+        self._overlay_ident = None
+        self._checked_at = 0.0
+
+    @property
+    def generation(self):
+        view = self._view
+        return view.generation if view is not None else 0
+
+    @property
+    def high_water(self):
+        """
+        Largest created_at in the mapped snapshot
+        """
+        view = self._view
+        return view.high_water if view is not None else 0.0
+
+    @property
+    def version(self):
+        """
+        Moves with every published snapshot and every overlay change
+        """
+        return self.generation + self._overlay[0]
+
+    def pending(self):
+        """
+        Returns (sequence, {id: product}) of the overlay mapped with the
+        snapshot, the changes the next build has to fold in
+        """
+        return self._overlay
+
+    def refresh(self, force=False):
+        """
+        Maps the latest published snapshot, returns True if one is available
+        """
+        now = time.monotonic()
+        if force or now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            try:
+                st = os.stat(self.path)
+                ident = (st.st_ino, st.st_mtime_ns, st.st_size)
+                if ident != self._ident:
+                    with open(self.path, "rb") as f:
+                        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    self._view = _SnapshotView(mm)
+                    self._ident = ident
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, struct.error) as e:
+                print(e)
+            self._refresh_overlay()
+        return self._view is not None
+
+    def _refresh_overlay(self):
+        try:
+            st = os.stat(self.path + ".overlay")
+            ident = (st.st_ino, st.st_mtime_ns, st.st_size)
+            if ident != self._overlay_ident:
+                sequence, entries = read_overlay(self.path)
+                self._overlay = (sequence, {k: v[1] for k, v in entries.items()})
+                self._overlay_ident = ident
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            print(e)
+
+    def products(self):
+        view = self._view
+        overlay = self._overlay[1]
+        records = (view.record(i) for i in range(view.count))
+        if not overlay:
+            return list(records)
+        return list(
+            heapq.merge(
+                (p for p in records if p["id"] not in overlay),
+                sorted(overlay.values(), key=lambda p: p["id"]),
+                key=lambda p: p["id"],
+            )
+        )
+
+    def sorted_by(self, key):
+        if key not in SORT_KEYS:
+            raise KeyError(key)
+        view = self._view
+        overlay = self._overlay[1]
+        records = (view.record(i) for i in view.order(key))
+        if not overlay:
+            return list(records)
+
+        def sort_key(p):
+            return p[key], p["id"]
+
+        return list(
+            heapq.merge(
+                (p for p in records if p["id"] not in overlay),
+                sorted(overlay.values(), key=sort_key),
+                key=sort_key,
+            )
+        )
+
+    def get(self, product_id):
+        product = self._overlay[1].get(product_id)
+        if product is not None:
+            return product
+        return self.get_published(product_id)
+
+    def get_published(self, product_id):
+        """
+        Returns a product as it is in the snapshot file, ignoring the overlay
+        """
+        view = self._view
+        index = view.find(product_id)
+        return view.record(index) if index >= 0 else None
+
+    def filter(self, limit=100, offset=0, **bounds):
+        """
+        Returns (matching count, one page of matching products), filtering the
+        mapped price and created_at columns in place
+        """
+        view = self._view
+        overlay = self._overlay[1]
+        indexes = filter_indexes(
+            as_column(view.price), as_column(view.created_at), **bounds
+        )
+        if not overlay:
+            return len(indexes), [
+                view.record(i) for i in indexes[offset : offset + limit]
+            ]
+
+        replaced = [i for i in map(view.find, overlay) if i >= 0]
+        if replaced:
+            indexes = drop_indexes(indexes, replaced)
+        extra = sorted(overlay.values(), key=lambda p: p["id"])
+        extra = [
+            extra[i]
+            for i in filter_indexes(
+                as_column(array("d", (p["price"] for p in extra))),
+                as_column(array("d", (p["created_at"] for p in extra))),
+                **bounds
+            )
+        ]
+        # merged position of every overlay match, among the snapshot matches
+        positions = [
+            bisect_left(indexes, view.lower_bound(p["id"])) + n
+            for n, p in enumerate(extra)
+        ]
+        count = len(indexes) + len(extra)
+        page = []
+        for position in range(offset, min(offset + limit, count)):
+            n = bisect_left(positions, position)
+            if n < len(positions) and positions[n] == position:
+                page.append(extra[n])
+            else:
+                page.append(view.record(indexes[position - n]))
+        return count, page
@@ -0,0 +1,292 @@
+"""
+Server-Sent Events change feed for products and orders.
+
+One ChangeFeed per process fans events out to any number of subscribers.
+Each subscriber has a small bounded queue; a client that falls behind is not
+allowed to slow down the others or grow memory, its queue is emptied and it
+gets a single "resync" event telling it to refetch. Recent events are kept in
+a short replay buffer, so a client reconnecting with Last-Event-ID gets what
+it missed, or a resync when that is no longer known.
+
+FirebaseListener feeds the process' ChangeFeed from one Realtime Database
+stream per tree, however many clients are subscribed. Other storage backends
+append events to a log in the database that EventLogListener polls, so every
+process, feed_server.py included, sees the changes made by the others.
+
+An open feed holds its server worker for as long as the client stays
+connected. Idle clients are only cheap on a cooperative server, where each
+one is a greenlet: run feed_server.py (gevent) and route /api/changes to
+it. On thread or process workers the number of subscribers is capped.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+RESYNC = {"type": "resync"}
+
+
+def cooperative():
+    """
+    Tells whether gevent has patched threading, so blocking on a subscriber
+    queue only suspends a greenlet
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+
+class Subscriber:
+    def __init__(self, email, max_queue):
+        self.email = email
+        self.queue = queue.Queue(max_queue)
+
+    def wants(self, event):
+        return event.get("email") is None or event.get("email") == self.email
+
+    def offer(self, message):
+        """
+        Queues a message without blocking, turns an overflow into a resync
+        """
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except queue.Full:
+            pass
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.queue.put_nowait((None, RESYNC))
+        return False
+
+
+class ChangeFeed:
+    def __init__(self, max_queue=100, replay_size=1000):
+        self.max_queue = max_queue
+        # Event ids are "<token>-<sequence>", ids from another process or an
+        # older run cannot be replayed
+        self.token = os.urandom(4).hex()
+        self.sequence = 0
+        self.subscribers = set()
+        self.recent = deque(maxlen=replay_size)
+        self.counters = {"published": 0, "delivered": 0, "overflows": 0}
+        self._lock = threading.Lock()
+
+    def publish(self, event):
+        """
+        Sends an event to every interested subscriber. Events with an email
+        only go to that user's subscribers.
+        """
+        with self._lock:
+            self.sequence += 1
+            message = ("%s-%d" % (self.token, self.sequence), event)
+            self.recent.append(message)
+            self.counters["published"] += 1
+            for subscriber in self.subscribers:
+                if subscriber.wants(event):
+                    self.counters["delivered"] += 1
+                    if not subscriber.offer(message):
+                        self.counters["overflows"] += 1
+
+    def subscribe(self, email, last_event_id=None, limit=None):
+        """
+        Registers a subscriber, queueing the events it missed since
+        last_event_id, or a resync when they are no longer known. Returns
+        None when limit subscribers are already connected.
+        """
+        subscriber = Subscriber(email, self.max_queue)
+        with self._lock:
+            if limit is not None and len(self.subscribers) >= limit:
+                return None
+            if last_event_id:
+                missed = self._since(last_event_id)
+                if missed is None:
+                    subscriber.offer((None, RESYNC))
+                for message in missed or []:
+                    if subscriber.wants(message[1]):
+                        subscriber.offer(message)
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self.subscribers.discard(subscriber)
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.counters, subscribers=len(self.subscribers))
+
+    def _since(self, last_event_id):
+        token, _, sequence = last_event_id.partition("-")
+        if token != self.token or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        if sequence >= self.sequence:
+            return []
+        if not self.recent or sequence < self.sequence - len(self.recent):
+            return None
+        return list(self.recent)[len(self.recent) - (self.sequence - sequence) :]
+
+
+def sse_stream(feed, subscriber, heartbeat=15.0):
+    """
+    Yields the SSE frames of a subscriber, with comment heartbeats while idle
+    so proxies keep the connection open
+    """
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event_id, event = subscriber.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            frame = "event: %s\ndata: %s\n\n" % (event["type"], json.dumps(event))
+            if event_id is not None:
+                frame = "id: %s\n" % event_id + frame
+            yield frame
+    finally:
+        feed.unsubscribe(subscriber)
+
+
+def product_events(path, data):
+    """
+    Translates a products stream message into product events
+    """
+    parts = [p for p in path.split("/") if p]
+    if not parts:
+        # a multi-path update of the products tree, {"<id>/<field>": value}
+        changes = {}
+        for key, value in (data or {}).items():
+            product_id, _, field = key.partition("/")
+            if field:
+                changes.setdefault(product_id, {})[field] = value
+            else:
+                changes[product_id] = value
+        return [product_event(k, v) for k, v in changes.items()]
+    if len(parts) == 1:
+        return [product_event(parts[0], data)]
+    return [product_event(parts[0], {parts[1]: data})]
+
+
+def product_event(product_id, data):
+    if data is None:
+        return {"type": "product", "action": "deleted", "id": product_id}
+    return {"type": "product", "action": "changed", "id": product_id, "data": data}
+
+
+def order_events(path, data):
+    """
+    Translates an orders stream message into order events for their users
+    """
+    parts = [p for p in path.split("/") if p]
+    if not parts:
+        orders = (data or {}).items()
+    elif len(parts) == 1:
+        orders = [(parts[0], data)]
+    else:
+        return []
+    return [
+        {"type": "order", "id": k, "email": v["email"], "data": v}
+        for k, v in orders
+        if isinstance(v, dict) and v.get("email")
+    ]
+
+
+class FirebaseListener:
+    """
+    Streams the products and new orders from the Realtime Database into a
+    ChangeFeed. A put of the whole tree carries the current state: the first
+    one is skipped, later ones (the stream reconnected) become a resync.
+    Orders are only streamed from the time the listener started, so the
+    order history is never downloaded.
+    """
+
+    def __init__(self, db, feed):
+        self.db = db
+        self.feed = feed
+        self.streams = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.streams:
+                return
+            self.streams = [
+                self.db.child("products").stream(
+                    self._handler(product_events)
+                ),
+                self.db.child("orders")
+                .order_by_child("created_at")
+                .start_at(time.time())
+                .stream(self._handler(order_events)),
+            ]
+
+    def _handler(self, translate):
+        state = {"initial": True}
+
+        def handle(message):
+            if message["event"] not in ("put", "patch"):
+                return
+            if message["event"] == "put" and message["path"] == "/":
+                if not state["initial"]:
+                    self.feed.publish(RESYNC)
+                state["initial"] = False
+                return
+            try:
+                for event in translate(message["path"], message["data"]):
+                    self.feed.publish(event)
+            except Exception as e:
+                print(e)
+
+        return handle
+
+
+class EventLogListener:
+    """
+    Polls a storage event log (storage.events) into a ChangeFeed. Like the
+    Firebase orders stream it starts at the end of the log, events from
+    before the first subscriber are not replayed.
+    """
+
+    def __init__(self, events, feed, interval=0.5):
+        self.events = events
+        self.feed = feed
+        self.interval = interval
+        self.last_id = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.last_id is not None:
+                return
+            self.last_id = self.events.last_id()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def poll(self):
+        """
+        Publishes the events added since the last poll, returns how many
+        """
+        published = 0
+        while True:
+            batch = self.events.since(self.last_id)
+            for event_id, event in batch:
+                self.feed.publish(event)
+                self.last_id = event_id
+            published += len(batch)
+            if not batch:
+                return published
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                print(e)
+            time.sleep(self.interval)
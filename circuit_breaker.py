@@ -0,0 +1,165 @@
+"""
+Per-backend circuit breaker with stale-while-revalidate.
+
+A breaker opens after failure_threshold consecutive errors or slow calls.
+While open, calls fail fast and are answered from the last good result for
+the same key, marked as stale. Once reset_timeout has passed a single
+background probe retries the backend and closes the breaker if it answers
+within latency_threshold.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+BREAKERS = {}
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when a breaker is open and there is no stale result to serve
+    """
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name,
+        failure_threshold=5,
+        latency_threshold=1.0,
+        reset_timeout=10.0,
+        stale_size=1024,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.latency_threshold = latency_threshold
+        self.reset_timeout = reset_timeout
+        self.stale_size = stale_size
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.counters = {
+            "calls": 0,
+            "errors": 0,
+            "slow_calls": 0,
+            "short_circuits": 0,
+            "stale_served": 0,
+            "probes": 0,
+        }
+        self._stale = OrderedDict()
+        self._lock = threading.Lock()
+        BREAKERS[name] = self
+
+    def call(self, key, fn, *args, **kwargs):
+        """
+        Calls fn through the breaker, returns (result, stale)
+        """
+        if not self._allow(key, fn, args, kwargs):
+            return self._serve_stale(key)
+
+        start = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self._record_failure("errors")
+            if key in self._stale:
+                return self._serve_stale(key)
+            raise
+        if time.monotonic() - start > self.latency_threshold:
+            self._record_failure("slow_calls")
+        else:
+            self._record_success()
+        self._remember(key, result)
+        return result, False
+
+    def invalidate(self):
+        """
+        Forgets every remembered result, used when the data behind them changed
+        """
+        with self._lock:
+            self._stale.clear()
+
+    def metrics(self):
+        with self._lock:
+            return dict(
+                self.counters,
+                name=self.name,
+                state=self.state,
+                consecutive_failures=self.failures,
+                stale_entries=len(self._stale),
+            )
+
+    def _allow(self, key, fn, args, kwargs):
+        with self._lock:
+            self.counters["calls"] += 1
+            if self.state == CLOSED:
+                return True
+            self.counters["short_circuits"] += 1
+            if (
+                self.state == OPEN
+                and time.monotonic() - self.opened_at >= self.reset_timeout
+            ):
+                self.state = HALF_OPEN
+                self.counters["probes"] += 1
+                threading.Thread(
+                    target=self._probe, args=(key, fn, args, kwargs), daemon=True
+                ).start()
+            return False
+
+    def _probe(self, key, fn, args, kwargs):
+        start = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            print(e)
+            self._reopen("errors")
+            return
+        self._remember(key, result)
+        if time.monotonic() - start > self.latency_threshold:
+            # answering, but still too slow to take the traffic back
+            self._reopen("slow_calls")
+        else:
+            self._record_success()
+
+    def _serve_stale(self, key):
+        with self._lock:
+            if key not in self._stale:
+                raise CircuitOpenError("%s backend unavailable" % self.name)
+            self.counters["stale_served"] += 1
+            return self._stale[key], True
+
+    def _remember(self, key, result):
+        with self._lock:
+            self._stale[key] = result
+            self._stale.move_to_end(key)
+            while len(self._stale) > self.stale_size:
+                self._stale.popitem(last=False)
+
+    def _record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.state = CLOSED
+
+    def _record_failure(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+            self.failures += 1
+            if self.failures >= self.failure_threshold and self.state == CLOSED:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def _reopen(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+
+def breaker_metrics():
+    """
+    Returns the state and counters of every breaker
+    """
+    return [breaker.metrics() for breaker in BREAKERS.values()]
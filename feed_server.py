@@ -0,0 +1,40 @@
+"""
+Serves the app on gevent, for the /api/changes Server-Sent Events feed.
+
+Under the thread or process workers of main.py every open feed holds one of
+them for as long as the client is connected. Here threading is patched
+before the app is imported, so a waiting feed is a greenlet of a few
+kilobytes and one process holds thousands of them. Route /api/changes to
+this server at the proxy and leave the other endpoints on the main one.
+On the sqlite backend it reads the events the main server writes to the
+database, so both must use the same sqlite_path.
+Needs gevent (pip install gevent).
+
+    python feed_server.py --port 5001
+
+or, under gunicorn, a gevent worker per process:
+
+    gunicorn -k gevent --worker-connections 10000 main:app
+"""
+from gevent import monkey
+
+monkey.patch_all()
+
+import argparse  # noqa: E402
+
+from gevent.pywsgi import WSGIServer  # noqa: E402
+
+from main import app  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    args = parser.parse_args()
+    print("Serving change feed on %s:%d" % (args.host, args.port))
+    WSGIServer((args.host, args.port), app).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Generates seeded, reproducible catalogs and order histories at scale and
+loads them into a JSON file in the products.json layout, the Realtime
+Database, Typesense or a local SQLite database.
+
+Popularity is skewed: older products are bought far more often than new
+ones, and a small share of users places most of the orders. Records are
+generated lazily and written in batches, so memory use does not grow with
+the requested size.
+
+    python generate_data.py --products 100000 --orders 500000 --json data.json
+    python generate_data.py --products 1000000 --sqlite shop.db --typesense
+"""
+import argparse
+import json
+import os
+import random
+import time
+from itertools import islice
+
+from storage import SqliteStorage, FirebaseStorage, push_id
+
+ADJECTIVES = (
+    "Classic", "Compact", "Deluxe", "Eco", "Essential", "Premium", "Pro",
+    "Rugged", "Slim", "Smart", "Sport", "Travel", "Ultra", "Vintage", "Wireless",
+)
+NOUNS = (
+    "Backpack", "Bottle", "Camera", "Chair", "Headphone", "Jacket", "Keyboard",
+    "Lamp", "Luggage", "Mouse", "Shoes", "Speaker", "Tent", "Umbrella", "Watch",
+)
+DAY = 86400
+
+
+class Generator:
+    def __init__(self, seed, products, orders, users, days, now=None):
+        self.seed = seed
+        self.products = products
+        self.orders = orders
+        self.users = users
+        self.end = time.time() if now is None else now
+        self.start = self.end - days * DAY
+
+    def product(self, index):
+        """
+        Returns product number index, the same for a given seed every time
+        """
+        rng = random.Random("%d:product:%d" % (self.seed, index))
+        created_at = self.start + (self.end - self.start) * index / self.products
+        noun = rng.choice(NOUNS)
+        sku = "%s%d" % (noun[:2].upper(), index)
+        return {
+            "id": push_id(created_at, rng),
+            "name": "%s %s" % (rng.choice(ADJECTIVES), noun),
+            "price": max(1.0, round(rng.lognormvariate(3.5, 1.0), 2)),
+            "sku": sku,
+            "image": "https://example.com/images/%s.jpg" % sku,
+            "created_at": created_at,
+        }
+
+    def iter_products(self):
+        for index in range(self.products):
+            yield self.product(index)
+
+    def iter_orders(self):
+        """
+        Yields (id, order) in created_at order
+        """
+        rng = random.Random("%d:orders" % self.seed)
+        for number in range(self.orders):
+            created_at = self.start + (self.end - self.start) * (
+                number + rng.random()
+            ) / self.orders
+            # only products that already existed, the oldest are the most popular
+            available = max(
+                1,
+                int(self.products * (created_at - self.start) / (self.end - self.start)),
+            )
+            items = {}
+            for _ in range(min(5, 1 + int(rng.expovariate(1.0)))):
+                product = self.product(int(available * rng.random() ** 3))
+                quantity = rng.randint(1, 3)
+                item = items.get(product["id"])
+                if item is not None:
+                    quantity += item["quantity"]
+                items[product["id"]] = {
+                    "id": product["id"],
+                    "name": product["name"],
+                    "sku": product["sku"],
+                    "quantity": quantity,
+                    "price": product["price"],
+                    "image": product["image"],
+                    "total_price": quantity * product["price"],
+                }
+            # a few heavy buyers place most of the orders
+            user = int(self.users * rng.random() ** 4)
+            yield push_id(created_at, rng), {
+                "name": "User %d" % user,
+                "address": "%d Example Street" % (user % 1000 + 1),
+                "phone": "555%07d" % user,
+                "email": "user%d@example.com" % user,
+                "created_at": created_at,
+                "items": items,
+                "total_quantity": sum(i["quantity"] for i in items.values()),
+                "total_price": sum(i["total_price"] for i in items.values()),
+            }
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def write_json(path, generator):
+    """
+    Streams the data set into one file in the products.json layout
+    """
+    with open(path, "w") as f:
+        f.write('{\n  "products": {')
+        for i, p in enumerate(generator.iter_products()):
+            data = {k: v for k, v in p.items() if k != "id"}
+            f.write("%s\n    %s: %s" % ("," if i else "", json.dumps(p["id"]), json.dumps(data)))
+        f.write('\n  },\n  "orders": {')
+        for i, (order_id, order) in enumerate(generator.iter_orders()):
+            f.write("%s\n    %s: %s" % ("," if i else "", json.dumps(order_id), json.dumps(order)))
+        f.write("\n  }\n}\n")
+
+
+def load_storage(storage, generator, batch_size):
+    for batch in batches(generator.iter_products(), batch_size):
+        storage.products.add_many(batch)
+    for batch in batches(generator.iter_orders(), batch_size):
+        storage.orders.add_many(batch)
+
+
+def load_typesense(generator, batch_size):
+    import typesense
+    from reconcile import typesense_document
+    from typesense_cluster import parse_nodes
+
+    client = typesense.Client(
+        {
+            "api_key": os.getenv("typesense_api_key"),
+            "nodes": parse_nodes(
+                os.getenv("typesense_nodes") or os.getenv("typesense_host") or ""
+            ),
+            "connection_timeout_seconds": 30,
+        }
+    )
+    for batch in batches(generator.iter_products(), batch_size):
+        client.collections["products"].documents.import_(
+            [typesense_document(p) for p in batch], {"action": "upsert"}
+        )
+
+
+def firebase_storage():
+    import pyrebase
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    firebase = pyrebase.initialize_app(
+        {
+            "apiKey": os.getenv("firebase_apiKey"),
+            "authDomain": os.getenv("authDomain"),
+            "databaseURL": os.getenv("databaseURL"),
+            "storageBucket": os.getenv("storageBucket"),
+        }
+    )
+    return FirebaseStorage(firebase.database())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--orders", type=int, default=50000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--json", help="write the data set to this file")
+    parser.add_argument("--sqlite", help="load into this SQLite database")
+    parser.add_argument(
+        "--firebase", action="store_true", help="load into the Realtime Database"
+    )
+    parser.add_argument(
+        "--typesense", action="store_true", help="load products into Typesense"
+    )
+    args = parser.parse_args()
+
+    # a fixed end time keeps ids and timestamps reproducible for a seed
+    generator = Generator(
+        args.seed, args.products, args.orders, args.users, args.days, now=1.6e9
+    )
+    started = time.perf_counter()
+    if args.json:
+        write_json(args.json, generator)
+    if args.sqlite:
+        load_storage(SqliteStorage(args.sqlite), generator, args.batch)
+    if args.firebase:
+        load_storage(firebase_storage(), generator, args.batch)
+    if args.typesense:
+        load_typesense(generator, args.batch)
+    print(
+        "Generated %d products and %d orders in %.1fs"
+        % (args.products, args.orders, time.perf_counter() - started)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Inventory with reservations.
+
+Each tracked product's stock is split over a few shards so concurrent
+checkouts of one hot product mostly write different counters. Adding to the
+cart reserves stock right away (taking it from the shards) for a limited
+time; checkout commits the reservation, and emptying the cart or letting the
+reservation expire puts the stock back. Reservations are claimed atomically,
+so commit, release and expiry never act on the same one twice. Products
+without a stock record are not tracked and never run out.
+"""
+import random
+import time
+from collections import Counter
+
+from storage import push_id
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id):
+        super().__init__("Not enough stock for %s" % product_id)
+        self.product_id = product_id
+
+
+class Inventory:
+    def __init__(self, stock, shards=8, ttl=900):
+        self.stock = stock
+        self.shards = shards
+        self.ttl = ttl
+
+    def set_stock(self, product_id, count):
+        """
+        Sets the stock that can still be reserved, spread over the shards
+        """
+        self.stock.set(
+            product_id,
+            {
+                shard: count // self.shards + (1 if shard < count % self.shards else 0)
+                for shard in range(self.shards)
+            },
+        )
+
+    def available(self, product_id):
+        """
+        Returns the stock that can still be reserved, None when not tracked
+        """
+        shards = self.stock.shards(product_id)
+        return None if shards is None else sum(shards.values())
+
+    def reserve(self, product_id, quantity, email):
+        """
+        Holds quantity of a product for ttl seconds, returns the reservation
+        id, or None when the product is not tracked. Raises OutOfStock.
+        """
+        pieces = self._take(product_id, quantity)
+        if not pieces:
+            return None
+        reservation_id = push_id()
+        self.stock.add_reservation(
+            reservation_id,
+            {
+                "product_id": product_id,
+                "quantity": quantity,
+                "pieces": {str(shard): n for shard, n in pieces},
+                "email": email,
+                "expires_at": time.time() + self.ttl,
+            },
+        )
+        return reservation_id
+
+    def release(self, reservation_id):
+        """
+        Cancels a reservation and puts its stock back
+        """
+        reservation = self.stock.claim_reservation(reservation_id)
+        if reservation is not None:
+            self._put_back(reservation["product_id"], reservation["pieces"].items())
+
+    def commit(self, quantities, reservation_ids):
+        """
+        Turns the reservations of a cart into sold stock, reserving whatever
+        they no longer cover (they expired and were released). All or
+        nothing: raises OutOfStock after putting everything back. Returns the
+        stock taken, for refund() when the order cannot be placed after all.
+        """
+        claimed = []
+        held = Counter()
+        for reservation_id in reservation_ids:
+            reservation = self.stock.claim_reservation(reservation_id)
+            if reservation is not None:
+                claimed.append(reservation)
+                held[reservation["product_id"]] += reservation["quantity"]
+        taken = []
+        try:
+            for product_id, quantity in quantities.items():
+                if quantity > held[product_id]:
+                    pieces = self._take(product_id, quantity - held[product_id])
+                    taken.append((product_id, pieces or []))
+        except Exception:
+            self.refund(taken, claimed)
+            raise
+        return taken + [
+            (r["product_id"], [(int(k), n) for k, n in r["pieces"].items()])
+            for r in claimed
+        ]
+
+    def refund(self, taken, reservations=()):
+        """
+        Puts back stock returned by commit(), and that of claimed reservations
+        """
+        for reservation in reservations:
+            self._put_back(reservation["product_id"], reservation["pieces"].items())
+        for product_id, pieces in taken:
+            self._put_back(product_id, pieces)
+
+    def release_expired(self, now=None):
+        """
+        Puts back the stock of every expired reservation, returns how many
+        were released
+        """
+        expired = self.stock.expired_reservations(time.time() if now is None else now)
+        for reservation_id in expired:
+            self.release(reservation_id)
+        return len(expired)
+
+    def _take(self, product_id, quantity):
+        """
+        Takes quantity from the shards, starting at a random one, returns the
+        (shard, count) pieces taken, or None when the product is not tracked
+        """
+        shards = self.stock.shards(product_id)
+        if shards is None:
+            return None
+        order = [s for s, count in shards.items() if count > 0]
+        random.shuffle(order)
+        # the counts are only a hint, shards that looked empty may have refilled
+        order.extend(s for s in shards if s not in order)
+        pieces = []
+        needed = quantity
+        for shard in order:
+            taken = self.stock.take(product_id, shard, needed)
+            if taken:
+                pieces.append((shard, taken))
+                needed -= taken
+                if needed == 0:
+                    return pieces
+        self._put_back(product_id, pieces)
+        raise OutOfStock(product_id)
+
+    def _put_back(self, product_id, pieces):
+        for shard, n in pieces:
+            self.stock.put_back(product_id, int(shard), n)
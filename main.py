@@ -10,15 +10,71 @@ from flask import (
     url_for,
     Response,
     json,
+    g,
 )
 from dotenv import load_dotenv
 import os
-import typesense
+import hmac
 import time
+import cProfile
+import threading
+import click
+from concurrent.futures import ThreadPoolExecutor
+
+from catalog_snapshot import (
+    CatalogSnapshot,
+    fold_overlay,
+    publish_lock,
+    publish_overlay,
+    publish_snapshot,
+)
+from order_export import csv_rows, jsonl_rows
+from circuit_breaker import CircuitBreaker, breaker_metrics
+from product_store import ProductStore
+from product_search import MAX_PER_PAGE, build_search_params, search_response
+from autocomplete import Autocomplete
+from storage import ThreadLocalDatabase, open_storage
+from profiling import SamplingProfiler, profile_summary, save_slow_request
+from reconcile import product_fields, reconcile, typesense_document
+from product_updates import apply_product_changes, parse_product_changes
+from typesense_cluster import TypesenseCluster, parse_nodes
+from change_feed import (
+    ChangeFeed,
+    EventLogListener,
+    FirebaseListener,
+    cooperative,
+    product_event,
+    sse_stream,
+)
+from batch_requests import BatchSessionInterface, parse_batch, run_subrequest
+from cart_versions import changes_since, record_change
+from inventory import Inventory, OutOfStock
+from recommendations import CoPurchases
+from assets import StaticAssets, build_assets, load_manifest
 
 load_dotenv()  # take environment variables from .env.
 
 app = Flask(__name__)  # Initialze flask constructor
+# Lets /api/batch sub-requests share the session of the batch request
+app.session_interface = BatchSessionInterface()
+
+# Fingerprinted static assets built by build-assets are served from memory
+# with immutable caching, before requests reach Flask
+asset_manifest = load_manifest(app.static_folder)
+if asset_manifest:
+    app.wsgi_app = StaticAssets(
+        app.wsgi_app, app.static_folder, asset_manifest, app.static_url_path
+    )
+
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    """
+    Points url_for("static", filename=...) at the fingerprinted asset
+    """
+    if endpoint == "static" and values.get("filename") in asset_manifest:
+        values["filename"] = asset_manifest[values["filename"]]
+
 
 # replace with your own API key
 config = {
@@ -28,44 +84,415 @@ config = {
     "storageBucket": os.getenv("storageBucket"),
 }
 
-client = typesense.Client(
-    {
-        "api_key": os.getenv("typesense_api_key"),
-        "nodes": [
-            {"host": os.getenv("typesense_host"), "port": "443", "protocol": "https"}
-        ],
-        "connection_timeout_seconds": 2,
-    }
+# Typesense nodes as "host[:port[:protocol]],..." in typesense_nodes (or the
+# single typesense_host). Reads are spread over the healthy nodes and writes go
+# to the leader, the first node unless typesense_leader gives another index.
+cluster = TypesenseCluster(
+    os.getenv("typesense_api_key"),
+    parse_nodes(os.getenv("typesense_nodes") or os.getenv("typesense_host") or ""),
+    nearest_node=(parse_nodes(os.getenv("typesense_nearest_node") or "") or [None])[0],
+    leader=int(os.getenv("typesense_leader") or 0),
+    timeout=float(os.getenv("typesense_timeout") or 2),
+    health_interval=float(os.getenv("typesense_health_interval") or 5),
 )
+cluster.start()
 
 firebase = pyrebase.initialize_app(config)
 auth = firebase.auth()
-db = firebase.database()
+# one pyrebase database handle per thread, see ThreadLocalDatabase
+db = ThreadLocalDatabase(firebase.database)
 app.secret_key = os.getenv("secretKey") or "supersecret123"
+# Token for the admin API, kept apart from the session signing key. Admin
+# routes are disabled when it is not set.
+ADMIN_TOKEN = os.getenv("admin_token")
+
+# Products, orders, stock and sales reports go through the storage backend
+storage = open_storage(db)
+
+# Number of cart versions a client can catch up on with since_version
+CART_CHANGE_LOG = 20
+
+# Stock is reserved when a product is added to the cart and committed at
+# checkout, reservations not checked out in time are released
+inventory = Inventory(
+    storage.stock,
+    shards=int(os.getenv("stock_shards") or 8),
+    ttl=float(os.getenv("reservation_ttl") or 900),
+)
+RESERVATION_SWEEP_INTERVAL = float(os.getenv("reservation_sweep_interval") or 60)
+
+# "Frequently bought together" model, counted from the orders by one process
+# at a time into a shared file that every process reloads when it changed,
+# and meanwhile kept up to date by this process' checkouts
+co_purchases = CoPurchases(
+    max_neighbors=int(os.getenv("recommendations_neighbors") or 50)
+)
+RECOMMENDATIONS_PATH = os.getenv("recommendations_path") or "recommendations.json"
+RECOMMENDATIONS_INTERVAL = float(os.getenv("recommendations_interval") or 300)
+
+# Catalog snapshot shared by all worker processes through a memory-mapped file
+catalog = CatalogSnapshot(os.getenv("catalog_snapshot_path") or "catalog.snap")
+CATALOG_MAX_AGE = float(os.getenv("catalog_max_age") or 60)
+# Delta publishes only see new products, a full rebuild at least this often
+# bounds how long edits and deletions made directly in storage stay unseen
+CATALOG_FULL_REBUILD = float(os.getenv("catalog_full_rebuild") or 900)
+# Products added or edited through the API wait in the snapshot overlay, which
+# every read merges, the next build folds them in; a big overlay forces it
+CATALOG_OVERLAY_MAX = int(os.getenv("catalog_overlay_max") or 1000)
+
+# Name and SKU suggestions, rebuilt in the background whenever a new catalog
+# snapshot is mapped
+suggestions = Autocomplete()
+
+# Product and order events pushed to /api/changes subscribers, read by one
+# listener per process started with the first subscriber. With Firebase they
+# come from the database streams; other backends write them to the storage's
+# event log from the routes, which every process (feed_server.py too) polls.
+feed = ChangeFeed(
+    max_queue=int(os.getenv("change_feed_queue") or 100),
+    replay_size=int(os.getenv("change_feed_replay") or 1000),
+)
+if storage.events is None:
+    change_listener = FirebaseListener(db, feed)
+else:
+    change_listener = EventLogListener(
+        storage.events, feed, float(os.getenv("change_feed_poll") or 0.5)
+    )
+CHANGE_FEED_HEARTBEAT = float(os.getenv("change_feed_heartbeat") or 15)
+# Every open feed holds a worker; only under gevent (feed_server.py) is that a
+# cheap greenlet, on thread or process workers a few feeds would starve the
+# site, so they are capped
+CHANGE_FEED_MAX_SUBSCRIBERS = int(
+    os.getenv("change_feed_max_subscribers") or (10000 if cooperative() else 4)
+)
+
+# Read-only API endpoints /api/batch may combine, run on a shared pool
+BATCH_ENDPOINTS = {
+    "api_products",
+    "api_product",
+    "api_related_products",
+    "api_products_sort",
+    "api_products_filter",
+    "api_search",
+    "api_autocomplete",
+    "api_search_v2",
+    "api_cart",
+    "api_vieworder",
+    "api_report_product",
+    "api_report_daily",
+    "api_report_user",
+    "api_product_stock",
+}
+# Headers of the batch request its sub-requests get as well
+BATCH_HEADERS = ("X-Admin-Token",)
+BATCH_MAX_REQUESTS = int(os.getenv("batch_max_requests") or 10)
+batch_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("batch_workers") or 8), thread_name_prefix="batch"
+)
+
+# Catalog version this worker's caches were filled at, see follow_catalog_version
+catalog_version = None
+
+# Opt-in continuous sampling profiler, requests slower than the threshold are
+# saved with their samples
+profiler = None
+if os.getenv("profiler_enabled"):
+    profiler = SamplingProfiler(float(os.getenv("profiler_interval") or 0.01))
+    profiler.start()
+SLOW_REQUEST_THRESHOLD = float(os.getenv("slow_request_threshold") or 1.0)
+SLOW_REQUEST_DIR = os.getenv("slow_request_dir") or "slow_requests"
+
+# Fail fast and serve the last good result when a backend is slow or down
+storage_breaker = CircuitBreaker(
+    storage.name,
+    failure_threshold=int(os.getenv("breaker_failure_threshold") or 5),
+    latency_threshold=float(os.getenv("breaker_latency_threshold") or 1.0),
+    reset_timeout=float(os.getenv("breaker_reset_timeout") or 10),
+)
+typesense_breaker = CircuitBreaker(
+    "typesense",
+    failure_threshold=int(os.getenv("breaker_failure_threshold") or 5),
+    latency_threshold=float(os.getenv("breaker_latency_threshold") or 1.0),
+    reset_timeout=float(os.getenv("breaker_reset_timeout") or 10),
+)
+
+
+def publish_catalog():
+    """
+    Publishes the catalog snapshot for every worker. A valid snapshot is only
+    topped up with the overlay and the products created since its high-water
+    mark, the full products tree is downloaded when there is no usable
+    snapshot or the last full build is older than CATALOG_FULL_REBUILD, which
+    picks up edits and deletions. Only one process builds at a time, and a
+    fresh snapshot with a small overlay is not touched.
+    """
+    full_marker = catalog.path + ".full"
+    with publish_lock(catalog.path, blocking=False) as acquired:
+        if not acquired:
+            return
+        snapshot = catalog.refresh(force=True)
+        # read before the products, so changes made meanwhile stay pending
+        sequence, overlay = catalog.pending()
+        try:
+            if (
+                time.time() - os.path.getmtime(catalog.path) < CATALOG_MAX_AGE
+                and len(overlay) < CATALOG_OVERLAY_MAX
+            ):
+                return
+        except OSError:
+            pass
+        try:
+            last_full = os.path.getmtime(full_marker)
+        except OSError:
+            last_full = 0
+        try:
+            if snapshot and time.time() - last_full < CATALOG_FULL_REBUILD:
+                products = {p["id"]: p for p in catalog.products()}
+                changed = bool(overlay)
+                for product in storage.products.since(catalog.high_water):
+                    if products.get(product["id"]) != product:
+                        products[product["id"]] = product
+                        changed = True
+                if changed:
+                    publish_snapshot(catalog.path, list(products.values()))
+            else:
+                publish_snapshot(catalog.path, storage.products.all())
+                with open(full_marker, "w"):
+                    pass
+            fold_overlay(catalog.path, sequence)
+            catalog.refresh(force=True)
+        except Exception as e:
+            print(e)
+
+
+def publish_catalog_periodically():
+    """
+    Keeps the snapshot current, every CATALOG_MAX_AGE seconds
+    """
+    while True:
+        time.sleep(CATALOG_MAX_AGE)
+        publish_catalog()
+
+
+def publish_products(changed):
+    """
+    Adds or replaces products in the catalog of every worker, which bumps the
+    catalog version. Only the snapshot overlay is rewritten, the background
+    publisher folds it into the next snapshot.
+    """
+    by_id = {p["id"]: p for p in changed}
+    publish_overlay(catalog.path, list(by_id.values()))
+    catalog.refresh(force=True)
+    follow_catalog_version()
+    if storage.events is not None:
+        storage.events.add_many(
+            [product_event(product["id"], product) for product in by_id.values()]
+        )
+
+
+def follow_catalog_version():
+    """
+    Drops the cached product, listing and search results of this worker once
+    the catalog version (the snapshot generation) moved. Workers notice a new
+    version within the snapshot check interval.
+    """
+    global catalog_version
+    if catalog.refresh() and catalog.version != catalog_version:
+        if catalog_version is not None:
+            storage_breaker.invalidate()
+            typesense_breaker.invalidate()
+        catalog_version = catalog.version
+
+
+def product_list(sort_key=None):
+    """
+    Returns (products, stale), from the shared snapshot when one is published
+    and from storage otherwise
+    """
+    if catalog.refresh():
+        if sort_key is None:
+            return catalog.products(), False
+        return catalog.sorted_by(sort_key), False
+    return storage_breaker.call(("products", sort_key), storage.products.all, sort_key)
+
+
+def find_product(id):
+    """
+    Returns (product, stale), from the shared snapshot when it is there and
+    from Typesense otherwise
+    """
+    if catalog.refresh():
+        product = catalog.get(id)
+        if product is not None:
+            return product, False
+    document, stale = typesense_breaker.call(
+        ("product", id),
+        cluster.read,
+        lambda c: c.collections["products"].documents[id].retrieve(),
+    )
+    return product_fields(document), stale
+
+
+def filter_products(limit=100, offset=0, **bounds):
+    """
+    Returns (matching count, one page of products, stale) for products within
+    the given price and created_at bounds
+    """
+    if catalog.refresh():
+        count, output = catalog.filter(limit, offset, **bounds)
+        return count, output, False
+    products, stale = storage_breaker.call(("products", None), storage.products.all)
+    count, records = ProductStore(products).filter(limit, offset, **bounds)
+    return count, [r.to_dict() for r in records], stale
+
+
+def suggest_products(prefix, k=10):
+    """
+    Returns up to k name and SKU suggestions for a prefix
+    """
+    if catalog.refresh():
+        base = catalog.generation
+        sequence, overlay = catalog.pending()
+        if suggestions.generation != base + sequence:
+            if suggestions.base == base:
+                # only the overlay moved, patch the changed products in
+                suggestions.update(overlay, catalog.get_published, base + sequence)
+            else:
+                suggestions.rebuild_async(load_suggestions)
+    elif suggestions.generation is None:
+        suggestions.rebuild_async(load_suggestions)
+    return suggestions.suggest(prefix, k)
+
+
+def load_suggestions():
+    """
+    Returns the products to index for suggestions and the catalog version,
+    snapshot generation and overlay they are at. These are read first, so a
+    catalog that moves meanwhile is caught up by the next lookup.
+    """
+    if catalog.refresh():
+        base = catalog.generation
+        sequence, overlay = catalog.pending()
+        return catalog.products(), base + sequence, base, overlay
+    products, stale = storage_breaker.call(("products", None), storage.products.all)
+    return products, 0
+
+
+def search_products(params):
+    """
+    Runs a Typesense search, returns (result, stale)
+    """
+    return typesense_breaker.call(
+        ("search", json.dumps(params, sort_keys=True)),
+        cluster.read,
+        lambda c: c.collections["products"].documents.search(params),
+    )
+
+
+def update_products(changes):
+    """
+    Applies {id: {field: value}} to storage, Typesense and a new catalog
+    version, see apply_product_changes. Returns (report, error).
+    """
+    snapshot = catalog.refresh(force=True)
+
+    def find(product_id):
+        product = catalog.get(product_id) if snapshot else None
+        if product is None:
+            product = storage.products.get(product_id)
+        return product
+
+    def index(documents):
+        return cluster.write(
+            lambda c: c.collections["products"].documents.import_(
+                documents, {"action": "upsert"}
+            )
+        )
+
+    report, error = apply_product_changes(
+        changes, find, storage.products, index, publish_products
+    )
+    if report is not None:
+        report["catalog_version"] = catalog_version
+    return report, error
+
+
+def related_products(id, k=10):
+    """
+    Returns up to k products most often bought together with a product, each
+    with the number of orders they shared
+    """
+    output = []
+    snapshot = catalog.refresh()
+    for other_id, together in co_purchases.related(id, k):
+        try:
+            product = catalog.get(other_id) if snapshot else find_product(other_id)[0]
+        except Exception as e:
+            print(e)
+            continue
+        if product is not None:
+            output.append(dict(product, together=together))
+    return output
+
+
+def refresh_recommendations():
+    """
+    Catches the shared co-purchase model up with the orders created since it
+    was saved, in one process at a time, and loads it when it changed. Only
+    the first run without a saved model counts the whole order history.
+    """
+    with publish_lock(RECOMMENDATIONS_PATH, blocking=False) as acquired:
+        if acquired:
+            try:
+                model = CoPurchases(co_purchases.max_neighbors)
+                try:
+                    model.load(RECOMMENDATIONS_PATH)
+                    missing = False
+                except FileNotFoundError:
+                    missing = True
+                orders = storage.orders.iter(since=model.high_water)
+                if model.catch_up(orders) or missing:
+                    model.save(RECOMMENDATIONS_PATH)
+            except Exception as e:
+                print(e)
+    try:
+        co_purchases.load(RECOMMENDATIONS_PATH)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(e)
+
+
+def refresh_recommendations_periodically():
+    while True:
+        refresh_recommendations()
+        time.sleep(RECOMMENDATIONS_INTERVAL)
 
 
 def populate_typesense():
     """
-    This function retrieves all the data from the Firebase database
+    This function retrieves all the data from the storage backend
     and populate them into Typesense for quick searching and sorting
     """
     print("Populating collection...")
     try:
-        products = db.child("products").get()
-        for p in products.each():
-            data_typesense = {
-                "id": p.key(),
-                "name": p.val()["name"],
-                "price": p.val()["price"],
-                "sku": p.val()["sku"],
-                "image": p.val()["image"],
-                "created_at": p.val()["created_at"],
-            }
-            client.collections["products"].documents.create(data_typesense)
+        for data_typesense in storage.products.all():
+            document = typesense_document(data_typesense)
+            cluster.write(lambda c: c.collections["products"].documents.create(document))
     except Exception as e:
         print(e)
 
 
+PRODUCT_FIELDS = [
+    {"name": "id", "type": "string"},
+    {"name": "name", "type": "string", "sort": True},
+    {"name": "price", "type": "float", "facet": True},
+    {"name": "sku", "type": "string", "facet": True},
+    {"name": "image", "type": "string", "index": False, "optional": True},
+    {"name": "created_at", "type": "float"}
+]
+
+
 # Run this part during initial setup to create the typesense collection
 def create_collection():
     """
@@ -75,29 +502,112 @@ def create_collection():
     # Drop pre-existing collection if any
     print("Creating collection..")
     try:
-        client.collections["products"].delete()
+        cluster.write(lambda c: c.collections["products"].delete())
     except Exception as e:
         print(e)
 
     # Create a collection
-    create_response = client.collections.create(
-        {
-            "name": "products",
-            "fields": [
-                {"name": "id", "type": "string"},
-                {"name": "name", "type": "string"},
-                {"name": "price", "type": "float"},
-                {"name": "sku", "type": "string"},
-                {"name": "image", "type": "string"},
-                {"name": "created_at", "type": "float"}
-            ],
-            "default_sorting_field": "created_at",
-        }
+    create_response = cluster.write(
+        lambda c: c.collections.create(
+            {
+                "name": "products",
+                "fields": PRODUCT_FIELDS,
+                "default_sorting_field": "created_at",
+            }
+        )
     )
 
     populate_typesense()
 
-create_collection()
+
+def schema_key(field):
+    # Typesense sorts numeric fields by default, strings only when asked to
+    return (
+        field["name"],
+        field["type"],
+        field.get("facet", False),
+        field.get("sort", not field["type"].startswith("string")),
+    )
+
+
+def ensure_collection():
+    """
+    Creates the typesense collection unless one with the current schema
+    already exists, so restarts do not rebuild the search index
+    """
+    expected = {schema_key(f) for f in PRODUCT_FIELDS if f["name"] != "id"}
+    try:
+        existing = cluster.write(lambda c: c.collections["products"].retrieve())
+        fields = {schema_key(f) for f in existing["fields"]}
+        if expected <= fields:
+            return
+    except Exception as e:
+        print(e)
+    try:
+        create_collection()
+    except Exception as e:
+        print(e)
+
+ensure_collection()
+publish_catalog()
+threading.Thread(target=publish_catalog_periodically, daemon=True).start()
+suggestions.rebuild_async(load_suggestions)
+
+# Report of the last reconciliation between storage and Typesense
+last_reconcile = None
+RECONCILE_INTERVAL = float(os.getenv("reconcile_interval") or 0)
+
+
+def run_reconcile(dry_run=False):
+    """
+    Repairs drift between the products in storage and the Typesense index.
+    Storage is the source of truth, never a local snapshot that may lag it.
+    """
+    global last_reconcile
+    products = storage.products.all()
+    last_reconcile = reconcile(
+        products, cluster.leader.client.collections["products"], dry_run
+    )
+    print("Reconciled products: %s" % json.dumps(last_reconcile))
+    return last_reconcile
+
+
+def reconcile_periodically():
+    """
+    Runs the reconciliation every RECONCILE_INTERVAL seconds in one process
+    """
+    while True:
+        time.sleep(RECONCILE_INTERVAL)
+        with publish_lock(catalog.path + ".reconcile", blocking=False) as acquired:
+            if acquired:
+                try:
+                    run_reconcile()
+                except Exception as e:
+                    print(e)
+
+
+if RECONCILE_INTERVAL > 0:
+    threading.Thread(target=reconcile_periodically, daemon=True).start()
+
+
+def release_reservations_periodically():
+    """
+    Puts back the stock of expired reservations, in one process at a time
+    """
+    while True:
+        time.sleep(RESERVATION_SWEEP_INTERVAL)
+        with publish_lock(catalog.path + ".stock", blocking=False) as acquired:
+            if acquired:
+                try:
+                    inventory.release_expired()
+                except Exception as e:
+                    print(e)
+
+
+if RESERVATION_SWEEP_INTERVAL > 0:
+    threading.Thread(target=release_reservations_periodically, daemon=True).start()
+
+threading.Thread(target=refresh_recommendations_periodically, daemon=True).start()
 
 def authenticated():
     """
@@ -108,6 +618,218 @@ def authenticated():
     else:
         return False
 
+
+def is_admin():
+    """
+    Checks if the request carries the admin token, in the X-Admin-Token
+    header or the adminToken form field but never the URL, where it would
+    end up in logs and browser history
+    """
+    token = request.headers.get("X-Admin-Token") or request.form.get("adminToken")
+    return bool(
+        authenticated()
+        and ADMIN_TOKEN
+        and token
+        and hmac.compare_digest(token, ADMIN_TOKEN)
+    )
+
+
+def place_order(order_data, stock=()):
+    """
+    Saves an order and updates everything derived from orders, returns the
+    order number. The stock committed for it is given back when the order
+    cannot be saved.
+    """
+    try:
+        order_id = storage.orders.add(order_data)
+    except Exception:
+        inventory.refund(stock)
+        raise
+    try:
+        storage.reports.record(order_data)
+    except Exception as e:
+        print(e)
+    try:
+        co_purchases.add_order(order_data)
+    except Exception as e:
+        print(e)
+    if storage.events is not None:
+        try:
+            storage.events.add(
+                {
+                    "type": "order",
+                    "id": order_id,
+                    "email": order_data["email"],
+                    "data": order_data,
+                }
+            )
+        except Exception as e:
+            print(e)
+    return order_id
+
+
+def clear_cart():
+    """
+    Empties the session cart, keeping the signed in user and the cart version,
+    returns the ids of the removed line items
+    """
+    removed = list(session.get("cart_item") or {})
+    for key in ("cart_item", "all_total_quantity", "all_total_price"):
+        session.pop(key, None)
+    return removed
+
+
+def record_cart_change(ids):
+    """
+    Bumps the cart version and remembers which line items changed in it
+    """
+    return record_change(session, ids, CART_CHANGE_LOG)
+
+
+def cart_changes_since(version):
+    """
+    Returns the ids of line items changed after version, None when the change
+    log no longer reaches back that far
+    """
+    return changes_since(session, version)
+
+
+def cart_response(ids=None):
+    """
+    Returns the cart with the given line items only (all of them when ids is
+    None), the ids no longer in the cart, the totals and the cart version
+    """
+    items = session.get("cart_item") or {}
+    if ids is None:
+        ids = items.keys()
+    ids = sorted(ids)
+    return {
+        "email": session["email"],
+        "version": session.get("cart_version", 0),
+        "items": [(i, items[i]) for i in ids if i in items],
+        "removed": [i for i in ids if i not in items],
+        "all_total_quantity": session.get("all_total_quantity", 0),
+        "all_total_price": session.get("all_total_price", 0),
+    }
+
+
+def reserve_stock(product_id, quantity):
+    """
+    Reserves stock for a cart line, raises OutOfStock
+    """
+    reservation_id = inventory.reserve(product_id, quantity, session["email"])
+    if reservation_id is not None:
+        reservations = session.setdefault("reservations", {})
+        reservations.setdefault(product_id, []).append(reservation_id)
+        session.modified = True
+
+
+def release_stock(product_ids=None):
+    """
+    Cancels the reservations of the given cart lines, or of the whole cart
+    """
+    reservations = session.get("reservations") or {}
+    for product_id in list(reservations) if product_ids is None else product_ids:
+        for reservation_id in reservations.pop(product_id, []):
+            try:
+                inventory.release(reservation_id)
+            except Exception as e:
+                print(e)
+    session.modified = True
+
+
+def commit_stock():
+    """
+    Turns the cart's reservations into sold stock before its order is placed,
+    returns the stock taken for place_order, raises OutOfStock
+    """
+    quantities = {k: int(v["quantity"]) for k, v in session["cart_item"].items()}
+    reservation_ids = [
+        r for ids in (session.get("reservations") or {}).values() for r in ids
+    ]
+    stock = inventory.commit(quantities, reservation_ids)
+    session.pop("reservations", None)
+    return stock
+
+
+@app.before_request
+def check_catalog_version():
+    """
+    Invalidates cached catalog reads when another worker published changes
+    """
+    try:
+        follow_catalog_version()
+    except Exception as e:
+        print(e)
+
+
+@app.after_request
+def add_catalog_version(response):
+    """
+    Tags responses with the catalog version they were served at
+    """
+    if catalog_version is not None:
+        response.headers["X-Catalog-Version"] = str(catalog_version)
+    return response
+
+
+@app.before_request
+def start_profiling():
+    """
+    Starts sampling the request, and runs cProfile on it when an admin asks
+    for it with ?profile=1 or the X-Profile header
+    """
+    g.started_at = time.perf_counter()
+    if profiler is not None:
+        profiler.begin(threading.get_ident())
+    if (request.args.get("profile") or request.headers.get("X-Profile")) and is_admin():
+        g.profile = cProfile.Profile()
+        g.profile.enable()
+
+
+@app.after_request
+def finish_profiling(response):
+    """
+    Replaces the response of a profiled request with its pstats summary
+    """
+    profile = g.pop("profile", None)
+    if profile is None:
+        return response
+    profile.disable()
+    return Response(
+        profile_summary(profile),
+        status=200,
+        mimetype="text/plain",
+        headers={"X-Profiled-Status": str(response.status_code)},
+    )
+
+
+@app.teardown_request
+def save_slow_request_samples(exc):
+    """
+    Saves the stack samples of requests slower than the threshold
+    """
+    if profiler is None or "started_at" not in g:
+        return
+    samples = profiler.end(threading.get_ident())
+    duration = time.perf_counter() - g.started_at
+    if duration >= SLOW_REQUEST_THRESHOLD and samples:
+        try:
+            save_slow_request(
+                SLOW_REQUEST_DIR,
+                {
+                    "endpoint": request.endpoint,
+                    "path": request.path,
+                    "method": request.method,
+                    "duration": duration,
+                    "started_at": time.time() - duration,
+                },
+                samples,
+            )
+        except Exception as e:
+            print(e)
+
+
 # Login
 @app.route("/")
 def login():
@@ -207,19 +929,7 @@ def products():
         if request.method == "GET":
             if authenticated():
                 try:
-                    products = db.child("products").get()
-                    output = []
-                    for p in products.each():
-                        output.append(
-                            {
-                                "id": p.key(),
-                                "name": p.val()["name"],
-                                "price": p.val()["price"],
-                                "sku": p.val()["sku"],
-                                "image": p.val()["image"],
-                                "created_at": p.val()["created_at"]
-                            }
-                        )
+                    output, stale = product_list()
                     return render_template(
                         "welcome.html", email=session["email"], products=output
                     )
@@ -246,10 +956,13 @@ def product(id):
     """
     if authenticated():
         try:
-            products = client.collections["products"].documents[id].retrieve()
+            products, stale = find_product(id)
             try:
                 return render_template(
-                    "product.html", email=session["email"], product=products
+                    "product.html",
+                    email=session["email"],
+                    product=products,
+                    related=related_products(id, 4),
                 )
             except Exception as e:
                 return Response(
@@ -276,7 +989,12 @@ def add_to_cart():
         _id = request.form["name"]
 
         try:
-            products = client.collections["products"].documents[_id].retrieve()
+            products, stale = find_product(_id)
+            try:
+                reserve_stock(_id, _quantity)
+            except OutOfStock as e:
+                flash(str(e))
+                return redirect(url_for("products"))
             try:
                 itemArray = {
                     _id: {
@@ -324,6 +1042,7 @@ def add_to_cart():
 
                 session["all_total_quantity"] = all_total_quantity
                 session["all_total_price"] = all_total_price
+                record_cart_change([_id])
 
                 return redirect(url_for("products"))
             except Exception as e:
@@ -341,10 +1060,8 @@ def empty_cart():
     """
     if authenticated():
         try:
-            email = session["email"]
-            session.clear()
-
-            session["email"] = email
+            release_stock()
+            record_cart_change(clear_cart())
             return redirect(url_for("products"))
         except Exception as e:
             print(e)
@@ -382,13 +1099,12 @@ def delete_product(code):
                     break
 
             if all_total_quantity == 0:
-                email = session["email"]
-                session.clear()
-
-                session["email"] = email
+                clear_cart()
             else:
                 session["all_total_quantity"] = all_total_quantity
                 session["all_total_price"] = all_total_price
+            release_stock([code])
+            record_cart_change([code])
 
             return redirect(url_for("products"))
         except Exception as e:
@@ -429,16 +1145,18 @@ def checkout():
                         "total_price": session["all_total_price"]
                     }
                     try:
-                        rec = db.child("orders").push(order_data)
-                        email = session[
-                            "email"
-                        ]  # clear cart when order placed successfully
-                        session.clear()
-                        session["email"] = email
+                        stock = commit_stock()
+                    except OutOfStock as e:
+                        flash(str(e))
+                        return redirect(url_for("products"))
+                    try:
+                        order_id = place_order(order_data, stock)
+                        # clear cart when order placed successfully
+                        record_cart_change(clear_cart())
                         return render_template(
                             "order.html",
                             email=session["email"],
-                            order_number=rec["name"],
+                            order_number=order_id,
                         )
                     except Exception as e:
                         print(e)
@@ -460,22 +1178,20 @@ def vieworder():
         if request.method == "GET":
             if authenticated():
                 try:
-                    products = db.child("orders").get()
                     output = []
-                    for p in products.each():
-                        if p.val()['email'] == session['email']:
-                            output.append(
-                                {
-                                    "id": p.key(),
-                                    "name": p.val()["name"],
-                                    "phone": p.val()["phone"],
-                                    "address": p.val()["address"],
-                                    "total_price": p.val()["total_price"],
-                                    "total_quantity": p.val()["total_quantity"],
-                                    "items": p.val()["items"],
-                                    "created_at": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(p.val()["created_at"]))
-                                }
-                            )
+                    for key, order in storage.orders.for_user(session["email"]):
+                        output.append(
+                            {
+                                "id": key,
+                                "name": order["name"],
+                                "phone": order["phone"],
+                                "address": order["address"],
+                                "total_price": order["total_price"],
+                                "total_quantity": order["total_quantity"],
+                                "items": order["items"],
+                                "created_at": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(order["created_at"]))
+                            }
+                        )
                     return render_template(
                         "vieworder.html", email=session["email"], orders=output
                     )
@@ -602,18 +1318,24 @@ def api_addproduct():
                             "image": image,
                             "created_at": created_at,
                         }
-                        rec = db.child("products").push(
+                        product_id = storage.products.add(
                             data
-                        )  # push data to firebase realtime database
+                        )  # push data to the storage backend
                         data_typesense = {
-                            "id": rec["name"],
+                            "id": product_id,
                             "name": name,
                             "price": price,
                             "sku": sku,
                             "image": image,
                             "created_at": created_at
                         }
-                        client.collections["products"].documents.create(data_typesense)
+                        document = typesense_document(data_typesense)
+                        cluster.write(
+                            lambda c: c.collections["products"].documents.create(
+                                document
+                            )
+                        )
+                        publish_products([data_typesense])
                         return Response(
                             json.dumps({"success": True}),
                             status=200,
@@ -650,33 +1372,197 @@ def api_addproduct():
                 mimetype="application/json",
             )
 
-@app.route("/api/products", methods=["GET"])
-def api_products():
-    try:
-        if request.method == "GET":
-            if authenticated():
-                try:
-                    products = db.child("products").get()
-                    output = []
-                    for p in products.each():
-                        output.append(
-                            {
-                                "id": p.key(),
-                                "name": p.val()["name"],
-                                "price": p.val()["price"],
-                                "sku": p.val()["sku"],
-                                "image": p.val()["image"],
-                                "created_at": p.val()["created_at"]
-                            }
-                        )
-                    return Response(
-                        json.dumps({"success": output}),
-                        status=200,
-                        mimetype="application/json",
-                    )
-                except:
-                    return Response(
-                        json.dumps({"error": "No products found"}),
+# Bulk product updates, e.g. POST with an X-Admin-Token header and
+# {"products": [{"id": "...", "price": 9.99}, {"id": "...", "name": "..."}]}
+@app.route("/api/products/update", methods=["POST"])
+def api_update_products():
+    if is_admin():
+        try:
+            body = request.get_json(silent=True) or {}
+            changes, error = parse_product_changes(body.get("products"))
+            if error is None:
+                report, error = update_products(changes)
+            if error is not None:
+                return Response(
+                    json.dumps({"error": error}),
+                    status=400,
+                    mimetype="application/json",
+                )
+            return Response(
+                json.dumps({"success": report}),
+                status=200,
+                mimetype="application/json",
+            )
+        except Exception as e:
+            return Response(
+                json.dumps({"error": str(e)}), status=400, mimetype="application/json"
+            )
+    else:
+        return Response(
+            json.dumps({"error": "User not authenticated"}),
+            status=403,
+            mimetype="application/json",
+        )
+
+
+# Sets the stock of products, e.g. POST with an X-Admin-Token header and
+# {"stock": {"<product id>": 100}}
+@app.route("/api/products/stock", methods=["POST"])
+def api_set_stock():
+    if is_admin():
+        try:
+            stock = (request.get_json(silent=True) or {}).get("stock")
+            if not isinstance(stock, dict) or not stock or not all(
+                isinstance(v, int) and v >= 0 for v in stock.values()
+            ):
+                return Response(
+                    json.dumps({"error": "Missing data"}),
+                    status=400,
+                    mimetype="application/json",
+                )
+            for product_id, count in stock.items():
+                inventory.set_stock(product_id, count)
+            return Response(
+                json.dumps({"success": True}),
+                status=200,
+                mimetype="application/json",
+            )
+        except Exception as e:
+            return Response(
+                json.dumps({"error": str(e)}), status=400, mimetype="application/json"
+            )
+    else:
+        return Response(
+            json.dumps({"error": "User not authenticated"}),
+            status=403,
+            mimetype="application/json",
+        )
+
+
+# Stock that can still be reserved, null for products without stock tracking
+@app.route("/api/products/stock/<id>", methods=["GET"])
+def api_product_stock(id):
+    if authenticated():
+        try:
+            return Response(
+                json.dumps({"success": {"id": id, "available": inventory.available(id)}}),
+                status=200,
+                mimetype="application/json",
+            )
+        except Exception as e:
+            return Response(
+                json.dumps({"error": str(e)}), status=400, mimetype="application/json"
+            )
+    else:
+        return Response(
+            json.dumps({"error": "User not authenticated"}),
+            status=403,
+            mimetype="application/json",
+        )
+
+
+# Several read-only API calls in one round trip, e.g. POST with
+# {"requests": [{"path": "/api/products"}, {"path": "/api/products/cart"}]}
+# Results come back in request order with each call's status and body.
+@app.route("/api/batch", methods=["POST"])
+def api_batch():
+    if authenticated():
+        try:
+            items, error = parse_batch(
+                request.get_json(silent=True), BATCH_MAX_REQUESTS
+            )
+            if error is not None:
+                return Response(
+                    json.dumps({"error": error}),
+                    status=400,
+                    mimetype="application/json",
+                )
+            environ_base = {"REMOTE_ADDR": request.remote_addr}
+            # so admins can batch the report endpoints too
+            headers = {
+                name: request.headers[name]
+                for name in BATCH_HEADERS
+                if name in request.headers
+            }
+            futures = [
+                batch_executor.submit(
+                    run_subrequest,
+                    app,
+                    session._get_current_object(),
+                    item,
+                    BATCH_ENDPOINTS,
+                    environ_base,
+                    headers,
+                )
+                for item in items
+            ]
+            return Response(
+                json.dumps({"success": [f.result() for f in futures]}),
+                status=200,
+                mimetype="application/json",
+            )
+        except Exception as e:
+            return Response(
+                json.dumps({"error": str(e)}), status=400, mimetype="application/json"
+            )
+    else:
+        return Response(
+            json.dumps({"error": "User not authenticated"}),
+            status=403,
+            mimetype="application/json",
+        )
+
+
+# Server-Sent Events feed of product inserts and updates and of the signed in
+# user's own orders, replaces polling /api/products and /api/vieworder
+@app.route("/api/changes", methods=["GET"])
+def api_changes():
+    if authenticated():
+        try:
+            change_listener.start()
+        except Exception as e:
+            print(e)
+        subscriber = feed.subscribe(
+            session["email"],
+            request.headers.get("Last-Event-ID"),
+            CHANGE_FEED_MAX_SUBSCRIBERS,
+        )
+        if subscriber is None:
+            return Response(
+                json.dumps({"error": "Change feed is full"}),
+                status=503,
+                mimetype="application/json",
+                headers={"Retry-After": "30"},
+            )
+        return Response(
+            sse_stream(feed, subscriber, CHANGE_FEED_HEARTBEAT),
+            status=200,
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    else:
+        return Response(
+            json.dumps({"error": "User not authenticated"}),
+            status=403,
+            mimetype="application/json",
+        )
+
+
+@app.route("/api/products", methods=["GET"])
+def api_products():
+    try:
+        if request.method == "GET":
+            if authenticated():
+                try:
+                    output, stale = product_list()
+                    return Response(
+                        json.dumps({"success": output, "stale": stale}),
+                        status=200,
+                        mimetype="application/json",
+                    )
+                except:
+                    return Response(
+                        json.dumps({"error": "No products found"}),
                         status=200,
                         mimetype="application/json",
                     )
@@ -696,10 +1582,10 @@ def api_products():
 def api_product(id):
     if authenticated():
         try:
-            products = client.collections["products"].documents[id].retrieve()
+            products, stale = find_product(id)
             try:
                 return Response(
-                    json.dumps({"success": products}),
+                    json.dumps({"success": products, "stale": stale}),
                     status=200,
                     mimetype="application/json",
                 )
@@ -721,26 +1607,73 @@ def api_product(id):
         )
 
 
+# Products frequently bought together with a product, ?k= up to 50
+@app.route("/api/products/related/<id>", methods=["GET"])
+def api_related_products(id):
+    if authenticated():
+        try:
+            k = min(max(request.args.get("k", 10, type=int), 1), 50)
+            return Response(
+                json.dumps({"success": related_products(id, k)}),
+                status=200,
+                mimetype="application/json",
+            )
+        except Exception as e:
+            return Response(
+                json.dumps({"error": str(e)}), status=400, mimetype="application/json"
+            )
+    else:
+        return Response(
+            json.dumps({"error": "User not authenticated"}),
+            status=403,
+            mimetype="application/json",
+        )
+
+
 # Sorts products using the keys name, price
 @app.route("/api/products/sort/<method>", methods=["GET"])
 def api_products_sort(method):
     if authenticated():
         try:
-            products = db.child("products").order_by_child(method).get()
-            output = []
-            for p in products.each():
-                output.append(
-                    {
-                        "id": p.key(),
-                        "name": p.val()["name"],
-                        "price": p.val()["price"],
-                        "sku": p.val()["sku"],
-                        "image": p.val()["image"],
-                        "created_at": p.val()["created_at"]
-                    }
-                )
+            output, stale = product_list(method)
             return Response(
-                json.dumps({"success": output}), status=200, mimetype="application/json"
+                json.dumps({"success": output, "stale": stale}),
+                status=200,
+                mimetype="application/json",
+            )
+        except Exception as e:
+            print(e)
+            return Response(
+                json.dumps({"error": "No products found"}),
+                status=200,
+                mimetype="application/json",
+            )
+    else:
+        return Response(
+            json.dumps({"error": "User not authenticated"}),
+            status=403,
+            mimetype="application/json",
+        )
+
+
+# Filters products by price range and created_at window, e.g.
+# /api/products/filter?min_price=10&max_price=50&since=1638871189&limit=20
+@app.route("/api/products/filter", methods=["GET"])
+def api_products_filter():
+    if authenticated():
+        try:
+            count, output, stale = filter_products(
+                limit=min(max(request.args.get("limit", 100, type=int), 1), MAX_PER_PAGE),
+                offset=max(request.args.get("offset", 0, type=int), 0),
+                min_price=request.args.get("min_price", type=float),
+                max_price=request.args.get("max_price", type=float),
+                since=request.args.get("since", type=float),
+                until=request.args.get("until", type=float),
+            )
+            return Response(
+                json.dumps({"success": output, "count": count, "stale": stale}),
+                status=200,
+                mimetype="application/json",
             )
         except Exception as e:
             print(e)
@@ -762,7 +1695,7 @@ def api_products_sort(method):
 def api_search(query):
     if authenticated():
         try:
-            products = client.collections["products"].documents.search(
+            products, stale = search_products(
                 {"q": query, "query_by": "name", "sort_by": "created_at:desc"}
             )
             try:
@@ -780,7 +1713,7 @@ def api_search(query):
                         }
                     )
                 return Response(
-                    json.dumps({"success": output}),
+                    json.dumps({"success": output, "stale": stale}),
                     status=200,
                     mimetype="application/json",
                 )
@@ -802,6 +1735,65 @@ def api_search(query):
         )
 
 
+# Typeahead suggestions for product names and SKUs, e.g.
+# /api/products/autocomplete?q=hea&k=5
+@app.route("/api/products/autocomplete", methods=["GET"])
+def api_autocomplete():
+    if authenticated():
+        try:
+            output = suggest_products(
+                request.args.get("q", ""),
+                min(max(request.args.get("k", 10, type=int), 1), 50),
+            )
+            return Response(
+                json.dumps({"success": output}), status=200, mimetype="application/json"
+            )
+        except Exception as e:
+            print(e)
+            return Response(
+                json.dumps({"success": []}), status=200, mimetype="application/json"
+            )
+    else:
+        return Response(
+            json.dumps({"error": "User not authenticated"}),
+            status=403,
+            mimetype="application/json",
+        )
+
+
+# Search with server side filtering, facets and field projection, e.g.
+# /api/v2/products/search?q=shoe&min_price=10&sku_prefix=SH&facet_by=price&fields=id,name
+@app.route("/api/v2/products/search", methods=["GET"])
+def api_search_v2():
+    if authenticated():
+        try:
+            params = build_search_params(request.args)
+        except ValueError as e:
+            return Response(
+                json.dumps({"error": str(e)}), status=400, mimetype="application/json"
+            )
+        try:
+            result, stale = search_products(params)
+            return Response(
+                json.dumps(dict(search_response(result), stale=stale)),
+                status=200,
+                mimetype="application/json",
+            )
+        except Exception as e:
+            print(e)
+            return Response(
+                json.dumps({"error": "Error searching product"}),
+                status=400,
+                mimetype="application/json",
+            )
+    else:
+        return Response(
+            json.dumps({"error": "User not authenticated"}),
+            status=403,
+            mimetype="application/json",
+        )
+
+
 @app.route("/api/products/add", methods=["POST"])
 def api_add_to_cart():
     if authenticated():
@@ -809,7 +1801,15 @@ def api_add_to_cart():
         _id = request.form["name"]
 
         try:
-            products = client.collections["products"].documents[_id].retrieve()
+            products, stale = find_product(_id)
+            try:
+                reserve_stock(_id, _quantity)
+            except OutOfStock as e:
+                return Response(
+                    json.dumps({"error": str(e), "product_id": e.product_id}),
+                    status=409,
+                    mimetype="application/json",
+                )
             try:
                 itemArray = {
                     _id: {
@@ -823,53 +1823,30 @@ def api_add_to_cart():
                     }
                 }
 
-                all_total_price = 0
-                all_total_quantity = 0
-                total_items = []
-
                 session.modified = True
-                if "cart_item" in session:
-                    if _id in session["cart_item"]:
-                        for key, value in session["cart_item"].items():
-                            if _id == key:
-                                old_quantity = session["cart_item"][key]["quantity"]
-                                total_quantity = old_quantity + _quantity
-                                session["cart_item"][key]["quantity"] = total_quantity
-                                session["cart_item"][key]["total_price"] = (
-                                    total_quantity * products["price"]
-                                )
-                    else:
-                        session["cart_item"] = array_merge(
-                            session["cart_item"], itemArray
-                        )
-
-                    for key, value in session["cart_item"].items():
-                        individual_quantity = int(session["cart_item"][key]["quantity"])
-                        individual_price = float(
-                            session["cart_item"][key]["total_price"]
-                        )
-                        all_total_quantity = all_total_quantity + individual_quantity
-                        all_total_price = all_total_price + individual_price
-
+                # update the changed line and the totals without walking the cart
+                all_total_quantity = session.get("all_total_quantity", 0)
+                all_total_price = session.get("all_total_price", 0)
+                if "cart_item" in session and _id in session["cart_item"]:
+                    item = session["cart_item"][_id]
+                    all_total_price = all_total_price - float(item["total_price"])
+                    item["quantity"] = item["quantity"] + _quantity
+                    item["total_price"] = item["quantity"] * products["price"]
                 else:
-                    session["cart_item"] = itemArray
-                    all_total_quantity = all_total_quantity + _quantity
-                    all_total_price = all_total_price + _quantity * products["price"]
+                    session["cart_item"] = array_merge(
+                        session.get("cart_item") or {}, itemArray
+                    )
+                all_total_quantity = all_total_quantity + _quantity
+                all_total_price = (
+                    all_total_price + session["cart_item"][_id]["total_price"]
+                )
 
                 session["all_total_quantity"] = all_total_quantity
                 session["all_total_price"] = all_total_price
+                record_cart_change([_id])
 
-                for item in session["cart_item"].items():
-                    total_items.append(item)
-
-                order_data = {
-                    "email": session["email"],
-                    "items": total_items,
-                    "all_total_quantity": all_total_quantity,
-                    "all_total_price": all_total_price,
-                }
                 return Response(
-                    json.dumps({"success": order_data}),
+                    json.dumps({"success": cart_response([_id])}),
                     status=200,
                     mimetype="application/json",
                 )
@@ -893,9 +1870,8 @@ def api_add_to_cart():
 def api_empty_cart():
     if authenticated():
         try:
-            email = session["email"]
-            session.clear()
-            session["email"] = email
+            release_stock()
+            record_cart_change(clear_cart())
             return Response(
                 json.dumps({"success": "Successfully emptied cart"}),
                 status=200,
@@ -917,46 +1893,28 @@ def api_empty_cart():
 def api_delete_product(code):
     if authenticated():
         try:
-            all_total_price = 0
-            all_total_quantity = 0
             session.modified = True
-            total_items = []
 
-            if "cart_item" in session:
-
-                for item in session["cart_item"].items():
-                    if item[0] == code:
-                        session["cart_item"].pop(item[0], None)
-                        break
-                    else:
-                        continue
-
-                for item in session["cart_item"].items():
-                    total_items.append(item)
-
-                for key, value in session["cart_item"].items():
-                    individual_quantity = int(session["cart_item"][key]["quantity"])
-                    individual_price = float(session["cart_item"][key]["total_price"])
-                    all_total_quantity = all_total_quantity + individual_quantity
-                    all_total_price = all_total_price + individual_price
-
-                if all_total_quantity == 0:
-                    email = session["email"]
-                    session.clear()
+            if "cart_item" in session and code in session["cart_item"]:
+                # subtract the removed line from the totals
+                item = session["cart_item"].pop(code)
+                all_total_quantity = session["all_total_quantity"] - int(
+                    item["quantity"]
+                )
+                all_total_price = session["all_total_price"] - float(
+                    item["total_price"]
+                )
 
-                    session["email"] = email
+                if not session["cart_item"]:
+                    clear_cart()
                 else:
                     session["all_total_quantity"] = all_total_quantity
                     session["all_total_price"] = all_total_price
+                release_stock([code])
+                record_cart_change([code])
 
-            order_data = {
-                "email": session["email"],
-                "items": total_items,
-                "all_total_quantity": all_total_quantity,
-                "all_total_price": all_total_price,
-            }
             return Response(
-                json.dumps({"success": order_data}),
+                json.dumps({"success": cart_response([code])}),
                 status=200,
                 mimetype="application/json",
             )
@@ -976,28 +1934,14 @@ def api_delete_product(code):
 def api_cart():
     if authenticated():
         try:
-            all_total_price = 0
-            all_total_quantity = 0
-            session.modified = True
-
-            total_items = []
-
-            if "cart_item" in session:
-                for item in session["cart_item"].items():
-                    total_items.append(item)
-
-                for key, value in session["cart_item"].items():
-                    individual_quantity = int(session["cart_item"][key]["quantity"])
-                    individual_price = float(session["cart_item"][key]["total_price"])
-                    all_total_quantity = all_total_quantity + individual_quantity
-                    all_total_price = all_total_price + individual_price
-
-            order_data = {
-                "email": session["email"],
-                "items": total_items,
-                "all_total_quantity": all_total_quantity,
-                "all_total_price": all_total_price,
-            }
+            # ?since_version=N returns only the line items changed after N,
+            # or the whole cart with "full" set when N is too old
+            since_version = request.args.get("since_version", type=int)
+            changed = None
+            if since_version is not None:
+                changed = cart_changes_since(since_version)
+            order_data = cart_response(changed)
+            order_data["full"] = changed is None
             return Response(
                 json.dumps({"success": order_data}),
                 status=200,
@@ -1046,20 +1990,25 @@ def api_checkout():
                         "total_price": session["all_total_price"]
                     }
                     try:
-                        rec = db.child("orders").push(order_data)
-                        email = session[
-                            "email"
-                        ]  # clear cart when order placed successfully
-                        session.clear()
-                        session["email"] = email
+                        stock = commit_stock()
+                    except OutOfStock as e:
+                        return Response(
+                            json.dumps({"error": str(e), "product_id": e.product_id}),
+                            status=409,
+                            mimetype="application/json",
+                        )
+                    try:
+                        order_id = place_order(order_data, stock)
+                        # clear cart when order placed successfully
+                        record_cart_change(clear_cart())
                         return Response(
-                            json.dumps({"success": rec["name"]}),
+                            json.dumps({"success": order_id}),
                             status=200,
                             mimetype="application/json",
                         )
                     except Exception as e:
                         return Response(
-                            json.dumps({"error": e}),
+                            json.dumps({"error": str(e)}),
                             status=400,
                             mimetype="application/json",
                         )
@@ -1071,7 +2020,7 @@ def api_checkout():
                     )
             except Exception as e:
                 return Response(
-                    json.dumps({"error": e}), status=400, mimetype="application/json"
+                    json.dumps({"error": str(e)}), status=400, mimetype="application/json"
                 )
     else:
         return Response(
@@ -1087,22 +2036,20 @@ def api_vieworder():
         if request.method == "GET":
             if authenticated():
                 try:
-                    products = db.child("orders").get()
                     output = []
-                    for p in products.each():
-                        if p.val()['email'] == session['email']:
-                            output.append(
-                                {
-                                    "id": p.key(),
-                                    "name": p.val()["name"],
-                                    "phone": p.val()["phone"],
-                                    "address": p.val()["address"],
-                                    "total_price": p.val()["total_price"],
-                                    "total_quantity": p.val()["total_quantity"],
-                                    "items": p.val()["items"],
-                                    "created_at": p.val()["created_at"]
-                                }
-                            )
+                    for key, order in storage.orders.for_user(session["email"]):
+                        output.append(
+                            {
+                                "id": key,
+                                "name": order["name"],
+                                "phone": order["phone"],
+                                "address": order["address"],
+                                "total_price": order["total_price"],
+                                "total_quantity": order["total_quantity"],
+                                "items": order["items"],
+                                "created_at": order["created_at"]
+                            }
+                        )
                     return Response(
                             json.dumps({"success": output}),
                             status=200,
@@ -1125,6 +2072,208 @@ def api_vieworder():
             json.dumps({"error": e}), status=400, mimetype="application/json"
         )
 
+@app.route("/api/reports/products/<id>", methods=["GET"])
+def api_report_product(id):
+    if is_admin():
+        try:
+            totals = storage.reports.product(id)
+            return Response(
+                json.dumps({"success": totals or {"units": 0, "revenue": 0}}),
+                status=200,
+                mimetype="application/json",
+            )
+        except Exception as e:
+            return Response(
+                json.dumps({"error": str(e)}), status=400, mimetype="application/json"
+            )
+    else:
+        return Response(
+            json.dumps({"error": "User not authenticated"}),
+            status=403,
+            mimetype="application/json",
+        )
+
+
+# Daily totals between the optional "from" and "to" days (YYYY-MM-DD)
+@app.route("/api/reports/daily", methods=["GET"])
+def api_report_daily():
+    if is_admin():
+        try:
+            output = storage.reports.days(
+                request.args.get("from"), request.args.get("to")
+            )
+            return Response(
+                json.dumps({"success": output}), status=200, mimetype="application/json"
+            )
+        except Exception as e:
+            return Response(
+                json.dumps({"error": str(e)}), status=400, mimetype="application/json"
+            )
+    else:
+        return Response(
+            json.dumps({"error": "User not authenticated"}),
+            status=403,
+            mimetype="application/json",
+        )
+
+
+# Lifetime value of a user, users may only look up themselves unless admin
+@app.route("/api/reports/users/<email>", methods=["GET"])
+def api_report_user(email):
+    if authenticated() and (email == session["email"] or is_admin()):
+        try:
+            totals = storage.reports.user(email)
+            return Response(
+                json.dumps({"success": totals or {"orders": 0, "revenue": 0}}),
+                status=200,
+                mimetype="application/json",
+            )
+        except Exception as e:
+            return Response(
+                json.dumps({"error": str(e)}), status=400, mimetype="application/json"
+            )
+    else:
+        return Response(
+            json.dumps({"error": "User not authenticated"}),
+            status=403,
+            mimetype="application/json",
+        )
+
+
+# Streams all orders as CSV or JSONL, optionally limited to a created_at window
+@app.route("/api/admin/orders/export", methods=["GET"])
+def api_export_orders():
+    if is_admin():
+        try:
+            export_format = request.args.get("format", "jsonl")
+            since = request.args.get("since", type=float)
+            until = request.args.get("until", type=float)
+            orders = storage.orders.iter(since, until)
+            if export_format == "csv":
+                rows, mimetype = csv_rows(orders), "text/csv"
+            elif export_format == "jsonl":
+                rows, mimetype = jsonl_rows(orders), "application/x-ndjson"
+            else:
+                return Response(
+                    json.dumps({"error": "Unknown export format"}),
+                    status=400,
+                    mimetype="application/json",
+                )
+            return Response(
+                rows,
+                status=200,
+                mimetype=mimetype,
+                headers={
+                    "Content-Disposition": "attachment; filename=orders.%s"
+                    % export_format
+                },
+            )
+        except Exception as e:
+            return Response(
+                json.dumps({"error": str(e)}), status=400, mimetype="application/json"
+            )
+    else:
+        return Response(
+            json.dumps({"error": "User not authenticated"}),
+            status=403,
+            mimetype="application/json",
+        )
+
+
+@app.route("/api/metrics", methods=["GET"])
+def api_metrics():
+    if is_admin():
+        return Response(
+            json.dumps(
+                {
+                    "success": {
+                        "breakers": breaker_metrics(),
+                        "typesense_nodes": cluster.metrics(),
+                        "reconcile": last_reconcile,
+                        "catalog_version": catalog_version,
+                        "change_feed": feed.metrics(),
+                        "recommendations": co_purchases.metrics(),
+                    }
+                }
+            ),
+            status=200,
+            mimetype="application/json",
+        )
+    else:
+        return Response(
+            json.dumps({"error": "User not authenticated"}),
+            status=403,
+            mimetype="application/json",
+        )
+
+
+# Process wide folded stack samples, feed to flamegraph.pl or speedscope
+@app.route("/api/profile/samples", methods=["GET"])
+def api_profile_samples():
+    if is_admin():
+        if profiler is None:
+            return Response(
+                json.dumps({"error": "Profiler not enabled"}),
+                status=400,
+                mimetype="application/json",
+            )
+        return Response(profiler.folded(), status=200, mimetype="text/plain")
+    else:
+        return Response(
+            json.dumps({"error": "User not authenticated"}),
+            status=403,
+            mimetype="application/json",
+        )
+
+
+@app.cli.command("create-collection")
+def create_collection_command():
+    """
+    Drops and rebuilds the typesense collection from Firebase
+    """
+    create_collection()
+
+
+@app.cli.command("reconcile")
+@click.option("--dry-run", is_flag=True, help="Only report the drift.")
+def reconcile_command(dry_run):
+    """
+    Repairs drift between the products in storage and the Typesense index
+    """
+    run_reconcile(dry_run)
+
+
+@app.cli.command("rebuild-aggregates")
+def rebuild_aggregates_command():
+    """
+    Recomputes the sales aggregates from all existing orders
+    """
+    count = storage.reports.rebuild()
+    print("Rebuilt aggregates from %d orders" % count)
+
+
+@app.cli.command("build-recommendations")
+def build_recommendations_command():
+    """
+    Counts the co-purchase model from all existing orders and saves it for
+    the web processes to load
+    """
+    with publish_lock(RECOMMENDATIONS_PATH):
+        count = co_purchases.build(storage.orders.iter())
+        co_purchases.save(RECOMMENDATIONS_PATH)
+    print("Built recommendations from %d orders: %s" % (count, co_purchases.metrics()))
+
+
+@app.cli.command("build-assets")
+def build_assets_command():
+    """
+    Fingerprints and precompresses the static files, restart the web
+    processes to serve the new build
+    """
+    manifest = build_assets(app.static_folder)
+    print("Built %d static assets" % len(manifest))
+
+
 def array_merge(first_array, second_array):
     """
     Function used to merge two arrays together, supplementary function
@@ -0,0 +1,89 @@
+"""
+Streaming order export. Orders are fetched a page at a time and written out
+row by row, so memory use stays constant however large the orders tree is.
+"""
+import csv
+import io
+import json
+
+from sales_aggregates import iter_orders
+
+CSV_COLUMNS = (
+    "id",
+    "created_at",
+    "email",
+    "name",
+    "phone",
+    "address",
+    "total_quantity",
+    "total_price",
+    "items",
+)
+
+
+def iter_orders_between(db, since=None, until=None, page_size=500):
+    """
+    Yields (key, order) for orders with since <= created_at <= until, paging
+    on the created_at index so only matching orders are downloaded
+    """
+    if since is None and until is None:
+        yield from iter_orders(db, page_size)
+        return
+
+    start = since
+    boundary = set()  # keys already yielded at the current start value
+    while True:
+        query = db.child("orders").order_by_child("created_at")
+        if start is not None:
+            query = query.start_at(start)
+        if until is not None:
+            query = query.end_at(until)
+        page = query.limit_to_first(page_size + len(boundary)).get().each() or []
+        fetched = 0
+        for p in page:
+            if p.key() in boundary:
+                continue
+            fetched += 1
+            yield p.key(), p.val()
+        if fetched == 0 or len(page) < page_size + len(boundary):
+            return
+        last = page[-1].val()["created_at"]
+        if last != start:
+            boundary = set()
+        start = last
+        boundary.update(p.key() for p in page if p.val()["created_at"] == last)
+
+
+def csv_rows(orders):
+    """
+    Encodes orders as CSV lines, starting with the header
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for key, order in orders:
+        writer.writerow(
+            [
+                key,
+                order.get("created_at"),
+                order.get("email"),
+                order.get("name"),
+                order.get("phone"),
+                order.get("address"),
+                order.get("total_quantity"),
+                order.get("total_price"),
+                json.dumps(order.get("items")),
+            ]
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def jsonl_rows(orders):
+    """
+    Encodes orders as one JSON object per line
+    """
+    for key, order in orders:
+        yield json.dumps(dict(order, id=key)) + "\n"
@@ -0,0 +1,108 @@
+"""
+Builds Typesense search parameters for the v2 search endpoint from request
+arguments, so filtering, faceting and field projection happen server side
+and only the requested documents and fields cross the wire.
+"""
+import math
+import re
+
+QUERY_BY = "name,sku"
+QUERY_BY_WEIGHTS = "2,1"
+FACET_FIELDS = ("price", "sku")
+RESULT_FIELDS = ("id", "name", "price", "sku", "image", "created_at")
+SORT_FIELDS = ("name", "price", "created_at")
+MAX_PER_PAGE = 250
+SKU_PREFIX = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def field_list(value, allowed, name):
+    """
+    Splits a comma separated list and checks every entry is allowed
+    """
+    fields = [f.strip() for f in value.split(",") if f.strip()]
+    for f in fields:
+        if f not in allowed:
+            raise ValueError("Unknown %s field: %s" % (name, f))
+    return ",".join(fields)
+
+
+def number(args, name):
+    """
+    Reads an optional numeric argument, which must be a finite number: inf
+    and nan would end up verbatim in the filter expression
+    """
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        value = float(value)
+    except ValueError:
+        raise ValueError("Invalid %s" % name)
+    if not math.isfinite(value):
+        raise ValueError("Invalid %s" % name)
+    return value
+
+
+def build_search_params(args):
+    """
+    Translates request arguments into Typesense search parameters, raises
+    ValueError on arguments that cannot be expressed safely
+    """
+    params = {
+        "q": args.get("q") or "*",
+        "query_by": QUERY_BY,
+        "query_by_weights": QUERY_BY_WEIGHTS,
+        "sort_by": "created_at:desc",
+        "page": max(1, args.get("page", 1, type=int)),
+        "per_page": min(MAX_PER_PAGE, max(0, args.get("per_page", 20, type=int))),
+    }
+
+    filters = []
+    for arg, op in (("min_price", ">="), ("max_price", "<=")):
+        value = number(args, arg)
+        if value is not None:
+            filters.append("price:%s%r" % (op, value))
+    for arg, op in (("since", ">="), ("until", "<=")):
+        value = number(args, arg)
+        if value is not None:
+            filters.append("created_at:%s%r" % (op, value))
+    sku_prefix = args.get("sku_prefix")
+    if sku_prefix:
+        if not SKU_PREFIX.match(sku_prefix):
+            raise ValueError("Invalid sku prefix")
+        filters.append("sku:%s*" % sku_prefix)
+    if filters:
+        params["filter_by"] = " && ".join(filters)
+
+    if args.get("facet_by"):
+        params["facet_by"] = field_list(args["facet_by"], FACET_FIELDS, "facet")
+    # product fields only, documents also carry the reconcile content_hash
+    fields = field_list(args.get("fields") or "", RESULT_FIELDS, "result")
+    params["include_fields"] = fields or ",".join(RESULT_FIELDS)
+    if args.get("sort_by"):
+        field, _, direction = args["sort_by"].partition(":")
+        if field not in SORT_FIELDS or direction not in ("asc", "desc"):
+            raise ValueError("Invalid sort")
+        params["sort_by"] = "%s:%s" % (field, direction)
+    return params
+
+
+def search_response(result):
+    """
+    Reduces a Typesense search result to documents, hit count and facets
+    """
+    return {
+        "success": [hit["document"] for hit in result.get("hits", [])],
+        "found": result.get("found", 0),
+        "facets": [
+            {
+                "field": facet["field_name"],
+                "counts": [
+                    {"value": c["value"], "count": c["count"]}
+                    for c in facet.get("counts", [])
+                ],
+                "stats": facet.get("stats", {}),
+            }
+            for facet in result.get("facet_counts", [])
+        ],
+    }
@@ -0,0 +1,126 @@
+"""
+Compact, columnar product representation.
+
+Prices and created_at timestamps are kept as float64 columns so range filters
+run as vectorized comparisons (NumPy when installed, a plain loop otherwise),
+strings are interned so repeated names, skus and images are stored once, and
+single products are handed out as __slots__ records instead of dicts.
+"""
+import sys
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Product:
+    __slots__ = ("id", "name", "price", "sku", "image", "created_at")
+
+    def __init__(self, id, name, price, sku, image, created_at):
+        self.id = id
+        self.name = name
+        self.price = price
+        self.sku = sku
+        self.image = image
+        self.created_at = created_at
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "price": self.price,
+            "sku": self.sku,
+            "image": self.image,
+            "created_at": self.created_at,
+        }
+
+
+def as_column(values):
+    """
+    Wraps a float64 buffer as a column without copying it
+    """
+    if numpy is not None:
+        return numpy.frombuffer(values, dtype=numpy.float64)
+    return values
+
+
+def filter_indexes(
+    price, created_at, min_price=None, max_price=None, since=None, until=None
+):
+    """
+    Returns the indexes of the rows matching every given bound (inclusive)
+    """
+    if numpy is not None:
+        mask = numpy.ones(len(price), dtype=bool)
+        if min_price is not None:
+            mask &= price >= min_price
+        if max_price is not None:
+            mask &= price <= max_price
+        if since is not None:
+            mask &= created_at >= since
+        if until is not None:
+            mask &= created_at <= until
+        return numpy.flatnonzero(mask)
+
+    low_price = float("-inf") if min_price is None else min_price
+    high_price = float("inf") if max_price is None else max_price
+    low_time = float("-inf") if since is None else since
+    high_time = float("inf") if until is None else until
+    return [
+        i
+        for i in range(len(price))
+        if low_price <= price[i] <= high_price and low_time <= created_at[i] <= high_time
+    ]
+
+
+def drop_indexes(indexes, dropped):
+    """
+    Returns the indexes without the dropped ones, in the same order
+    """
+    if numpy is not None:
+        return indexes[~numpy.isin(indexes, list(dropped))]
+    dropped = set(dropped)
+    return [i for i in indexes if i not in dropped]
+
+
+class ProductStore:
+    """
+    In-memory columnar store built from product dicts
+    """
+
+    def __init__(self, products):
+        self.ids = [sys.intern(str(p["id"])) for p in products]
+        self.names = [sys.intern(str(p["name"])) for p in products]
+        self.skus = [sys.intern(str(p["sku"])) for p in products]
+        self.images = [sys.intern(str(p["image"])) for p in products]
+        self.price = as_column(array("d", (float(p["price"]) for p in products)))
+        self.created_at = as_column(
+            array("d", (float(p["created_at"]) for p in products))
+        )
+        self.index = {product_id: i for i, product_id in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def record(self, index):
+        return Product(
+            self.ids[index],
+            self.names[index],
+            float(self.price[index]),
+            self.skus[index],
+            self.images[index],
+            float(self.created_at[index]),
+        )
+
+    def get(self, product_id):
+        index = self.index.get(product_id)
+        return self.record(index) if index is not None else None
+
+    def filter(self, limit=100, offset=0, **bounds):
+        """
+        Returns (matching count, records for one page of matches)
+        """
+        indexes = filter_indexes(self.price, self.created_at, **bounds)
+        return len(indexes), [self.record(i) for i in indexes[offset : offset + limit]]
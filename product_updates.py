@@ -0,0 +1,80 @@
+"""
+Bulk product updates for the admin API.
+
+A batch of {"id": ..., field: value} updates is validated as a whole, then
+written to storage in one transaction, upserted into Typesense in batches
+and published to the catalog. Storage is the source of truth: documents
+Typesense rejects are only counted and left to the reconciliation job.
+"""
+import math
+
+from reconcile import typesense_document
+
+# Product fields the bulk update API may change
+UPDATABLE_FIELDS = ("name", "price", "sku", "image")
+UPDATE_BATCH = 500
+
+
+def parse_product_changes(items):
+    """
+    Validates a list of {"id": ..., field: value} updates, returns
+    ({id: {field: value}}, error)
+    """
+    if not isinstance(items, list) or not items:
+        return None, "Missing data"
+    changes = {}
+    for item in items:
+        if not isinstance(item, dict) or not item.get("id"):
+            return None, "Every update needs a product id"
+        fields = {}
+        for field, value in item.items():
+            if field == "id":
+                continue
+            if field not in UPDATABLE_FIELDS:
+                return None, "Field %s cannot be updated" % field
+            if field == "price":
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    value = 0
+                if not (value > 0 and math.isfinite(value)):
+                    return None, "Invalid price for %s" % item["id"]
+            elif not isinstance(value, str) or not value:
+                return None, "Invalid %s for %s" % (field, item["id"])
+            fields[field] = value
+        if not fields:
+            return None, "Nothing to update for %s" % item["id"]
+        changes.setdefault(item["id"], {}).update(fields)
+    return changes, None
+
+
+def apply_product_changes(changes, find, products, index, publish, batch=UPDATE_BATCH):
+    """
+    Applies {id: {field: value}} to the products storage in one write, hands
+    the changed documents to index(documents) -> import results in batches
+    and the changed products to publish(products). find(id) returns the
+    current product or None. Returns (report, error); unknown ids reject the
+    whole batch before anything is written.
+    """
+    current = {}
+    for product_id in changes:
+        product = find(product_id)
+        if product is None:
+            return None, "Unknown product %s" % product_id
+        current[product_id] = product
+    updated = [dict(current[k], **fields) for k, fields in changes.items()]
+
+    products.update_many(changes)
+
+    failed = 0
+    for i in range(0, len(updated), batch):
+        documents = [typesense_document(p) for p in updated[i : i + batch]]
+        try:
+            results = index(documents)
+            failed += sum(1 for r in results if not r.get("success"))
+        except Exception as e:
+            print(e)
+            failed += len(documents)
+
+    publish(updated)
+    return {"updated": len(updated), "search_failed": failed}, None
@@ -0,0 +1,106 @@
+"""
+Opt-in profiling.
+
+profile_summary() formats a cProfile run of a single request as pstats text.
+SamplingProfiler is a low overhead stack sampler: a background thread reads
+the stacks of the threads currently serving requests every interval seconds,
+keeps process wide folded-stack counts (flamegraph.pl / speedscope format) and
+hands each request its own samples so slow requests can be saved with them.
+"""
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def profile_summary(profile, limit=40):
+    """
+    Returns the pstats report of a finished cProfile run, by cumulative time
+    """
+    out = io.StringIO()
+    stats = pstats.Stats(profile, stream=out)
+    stats.strip_dirs().sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
+
+
+def fold(frame):
+    """
+    Folds a stack into a single "outer;...;inner" line
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append("%s (%s)" % (code.co_name, os.path.basename(code.co_filename)))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def folded_text(counts):
+    """
+    Formats folded stack counts, one "stack count" line each
+    """
+    return "".join("%s %d\n" % (stack, n) for stack, n in counts.most_common())
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.01, max_stacks=20000):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.counts = Counter()
+        self._active = {}  # thread id -> samples of the request it is serving
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def begin(self, thread_id):
+        with self._lock:
+            self._active[thread_id] = []
+
+    def end(self, thread_id):
+        """
+        Stops sampling a thread and returns the stacks sampled from it
+        """
+        with self._lock:
+            return self._active.pop(thread_id, [])
+
+    def folded(self):
+        with self._lock:
+            return folded_text(self.counts)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, samples in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is None:
+                        continue
+                    stack = fold(frame)
+                    samples.append(stack)
+                    if stack in self.counts or len(self.counts) < self.max_stacks:
+                        self.counts[stack] += 1
+            del frames
+
+
+def save_slow_request(directory, info, samples):
+    """
+    Writes a slow request's details and folded samples for offline inspection,
+    returns the file path
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(
+        directory, "%d-%s.folded" % (time.time() * 1000, info.get("endpoint"))
+    )
+    with open(path, "w") as f:
+        f.write("# %s\n" % json.dumps(info))
+        f.write(folded_text(Counter(samples)))
+    return path
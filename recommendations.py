@@ -0,0 +1,155 @@
+"""
+"Frequently bought together" recommendations.
+
+CoPurchases keeps, for every product, how often each other product was
+bought in the same order: a sparse co-occurrence map updated at checkout
+from the order's items. Memory is bounded by keeping at most max_neighbors
+partners per product; when a product collects twice that many, its rarest
+pairs are pruned. The top related products are sorted once and cached until
+the product's counts change, so serving them is a dictionary lookup.
+
+The model counted from storage is shared between processes through a file
+that also records its created_at high-water mark, so it is caught up with
+the newer orders instead of counted again from the whole history.
+"""
+import json
+import os
+import threading
+
+from sales_aggregates import order_totals
+
+
+class CoPurchases:
+    def __init__(self, max_neighbors=50, max_items=20):
+        self.max_neighbors = max_neighbors
+        self.max_items = max_items
+        self.orders = 0
+        self.high_water = None  # largest created_at counted by catch_up
+        self._boundary = set()  # ids of the orders counted at high_water
+        self._loaded = None  # inode and mtime of the file last loaded
+        self._pairs = {}  # product id -> {other product id: orders together}
+        self._top = {}  # product id -> cached [(other product id, count)]
+        self._lock = threading.Lock()
+
+    def add_order(self, order):
+        """
+        Counts every pair of distinct products in an order
+        """
+        ids = sorted({product_id for product_id, _, _ in order_totals(order)})
+        # a huge order says little about any one pair and costs len(ids)**2
+        ids = ids[: self.max_items]
+        with self._lock:
+            self.orders += 1
+            for a in ids:
+                partners = self._pairs.setdefault(a, {})
+                for b in ids:
+                    if a != b:
+                        partners[b] = partners.get(b, 0) + 1
+                if len(partners) > 2 * self.max_neighbors:
+                    self._prune(partners)
+                self._top.pop(a, None)
+
+    def build(self, orders):
+        """
+        Replaces the model with one counted from (id, order) pairs, streamed
+        """
+        fresh = CoPurchases(self.max_neighbors, self.max_items)
+        fresh.catch_up(orders)
+        with self._lock:
+            self.orders = fresh.orders
+            self.high_water = fresh.high_water
+            self._boundary = fresh._boundary
+            self._pairs = fresh._pairs
+            self._top = {}
+        return self.orders
+
+    def catch_up(self, orders):
+        """
+        Counts (id, order) pairs created since the high-water mark, skipping
+        the ones already counted at the mark, returns how many were new
+        """
+        counted = set(self._boundary)
+        new = 0
+        for order_id, order in orders:
+            if order_id in counted:
+                continue
+            try:
+                self.add_order(order)
+            except (KeyError, TypeError, ValueError) as e:
+                # one malformed order must not stall the shared model
+                print(order_id, e)
+            new += 1
+            created_at = order.get("created_at")
+            if created_at is None:
+                continue
+            if self.high_water is None or created_at > self.high_water:
+                self.high_water = created_at
+                self._boundary = {order_id}
+            elif created_at == self.high_water:
+                self._boundary.add(order_id)
+        return new
+
+    def related(self, product_id, k=10):
+        """
+        Returns up to k (product id, orders together) bought with a product,
+        most frequent first
+        """
+        top = self._top.get(product_id)
+        if top is None:
+            with self._lock:
+                partners = self._pairs.get(product_id) or {}
+                top = sorted(partners.items(), key=lambda kv: (-kv[1], kv[0]))
+                top = top[: self.max_neighbors]
+                self._top[product_id] = top
+        return top[:k]
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "orders": self.orders,
+                "products": len(self._pairs),
+                "pairs": sum(len(p) for p in self._pairs.values()),
+            }
+
+    def save(self, path):
+        """
+        Writes the model to a file that other processes can load at startup
+        """
+        with self._lock:
+            data = json.dumps(
+                {
+                    "orders": self.orders,
+                    "high_water": self.high_water,
+                    "boundary": sorted(self._boundary),
+                    "pairs": self._pairs,
+                }
+            )
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "w") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def load(self, path):
+        """
+        Replaces the model with the one saved at path, unless that file was
+        already loaded. Returns True if it was loaded.
+        """
+        st = os.stat(path)
+        ident = (st.st_ino, st.st_mtime_ns)
+        if ident == self._loaded:
+            return False
+        with open(path) as f:
+            data = json.load(f)
+        with self._lock:
+            self.orders = data["orders"]
+            self.high_water = data.get("high_water")
+            self._boundary = set(data.get("boundary") or [])
+            self._pairs = data["pairs"]
+            self._top = {}
+            self._loaded = ident
+        return True
+
+    def _prune(self, partners):
+        keep = sorted(partners.items(), key=lambda kv: -kv[1])[: self.max_neighbors]
+        partners.clear()
+        partners.update(keep)
@@ -0,0 +1,135 @@
+"""
+Reconciliation between the product store and the Typesense index.
+
+Every Typesense document carries a content_hash of its product fields. The
+job pulls only (id, content_hash) pairs from Typesense, groups both sides into
+buckets by id, compares one digest per bucket and only walks the buckets that
+differ, then upserts or deletes the divergent documents. Writes therefore
+scale with the amount of drift, not with the size of the catalog.
+"""
+import hashlib
+import json
+import time
+
+PRODUCT_KEYS = ("id", "name", "price", "sku", "image", "created_at")
+BUCKETS = 256
+IMPORT_BATCH = 500
+
+
+def content_hash(product):
+    """
+    Hashes the indexed fields of a product
+    """
+    data = json.dumps(
+        [
+            float(product[k]) if k in ("price", "created_at") else str(product[k])
+            for k in PRODUCT_KEYS
+        ]
+    )
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def typesense_document(product):
+    """
+    Returns the Typesense document for a product, including its content hash
+    """
+    document = {k: product[k] for k in PRODUCT_KEYS}
+    document["content_hash"] = content_hash(product)
+    return document
+
+
+def product_fields(document):
+    """
+    Returns the product fields of a Typesense document, without the hash
+    """
+    return {k: document[k] for k in PRODUCT_KEYS if k in document}
+
+
+def bucket_of(product_id):
+    return hashlib.md5(product_id.encode("utf-8")).digest()[0] % BUCKETS
+
+
+def bucketize(hashes):
+    """
+    Groups {id: hash} into buckets and returns (buckets, digest per bucket)
+    """
+    buckets = [{} for _ in range(BUCKETS)]
+    for product_id, h in hashes.items():
+        buckets[bucket_of(product_id)][product_id] = h
+    digests = [
+        hashlib.sha1(
+            "".join("%s:%s\n" % kv for kv in sorted(b.items())).encode("utf-8")
+        ).digest()
+        for b in buckets
+    ]
+    return buckets, digests
+
+
+def index_hashes(collection):
+    """
+    Reads (id, content_hash) for every document in the index
+    """
+    exported = collection.documents.export({"include_fields": "id,content_hash"})
+    hashes = {}
+    for line in exported.splitlines():
+        if line:
+            document = json.loads(line)
+            hashes[document["id"]] = document.get("content_hash") or ""
+    return hashes
+
+
+def diff(source, index):
+    """
+    Returns (ids to upsert, ids to delete, buckets compared in detail)
+    """
+    source_buckets, source_digests = bucketize(source)
+    index_buckets, index_digests = bucketize(index)
+    upserts = []
+    deletes = []
+    walked = 0
+    for i in range(BUCKETS):
+        if source_digests[i] == index_digests[i]:
+            continue
+        walked += 1
+        expected = source_buckets[i]
+        actual = index_buckets[i]
+        upserts.extend(k for k, v in expected.items() if actual.get(k) != v)
+        deletes.extend(k for k in actual if k not in expected)
+    return upserts, deletes, walked
+
+
+def reconcile(products, collection, dry_run=False):
+    """
+    Brings the index in line with products, returns a report of the drift
+    found and repaired
+    """
+    started = time.perf_counter()
+    by_id = {p["id"]: p for p in products}
+    source = {k: content_hash(p) for k, p in by_id.items()}
+    upserts, deletes, walked = diff(source, index_hashes(collection))
+
+    failed = 0
+    if not dry_run:
+        for i in range(0, len(upserts), IMPORT_BATCH):
+            batch = [
+                typesense_document(by_id[k]) for k in upserts[i : i + IMPORT_BATCH]
+            ]
+            results = collection.documents.import_(batch, {"action": "upsert"})
+            failed += sum(1 for r in results if not r.get("success"))
+        for product_id in deletes:
+            try:
+                collection.documents[product_id].delete()
+            except Exception as e:
+                print(e)
+                failed += 1
+
+    return {
+        "products": len(source),
+        "upserted": len(upserts),
+        "deleted": len(deletes),
+        "failed": failed,
+        "buckets_walked": walked,
+        "dry_run": dry_run,
+        "duration": time.perf_counter() - started,
+        "finished_at": time.time(),
+    }
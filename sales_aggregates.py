@@ -0,0 +1,144 @@
+"""
+Sales aggregates maintained at checkout time under the "aggregates" node:
+
+    aggregates/products/<product id>  units, revenue
+    aggregates/days/<YYYY-MM-DD>      orders, units, revenue
+    aggregates/users/<email key>      orders, revenue
+
+Checkout applies its increments with one multi-path update using the Realtime
+Database server-side increment, so concurrent orders never lose updates and
+no order has to be read back.
+"""
+import time
+
+# Characters Firebase does not allow in keys
+KEY_ESCAPES = {".": "%2E", "#": "%23", "$": "%24", "[": "%5B", "]": "%5D", "/": "%2F"}
+
+
+def aggregate_key(value):
+    """
+    Escapes a value such as an email so it can be used as a Firebase key
+    """
+    value = value.replace("%", "%25")
+    for char, escaped in KEY_ESCAPES.items():
+        value = value.replace(char, escaped)
+    return value
+
+
+def day_key(created_at):
+    """
+    Returns the UTC day an order timestamp falls on
+    """
+    return time.strftime("%Y-%m-%d", time.gmtime(created_at))
+
+
+def order_totals(order):
+    """
+    Returns (product id, units, revenue) for every item in an order
+    """
+    items = order.get("items") or {}
+    if isinstance(items, dict):
+        items = items.values()
+    return [
+        (item["id"], int(item["quantity"]), float(item["total_price"]))
+        for item in items
+        if item
+    ]
+
+
+def increment(value):
+    return {".sv": {"increment": value}}
+
+
+def order_increments(order):
+    """
+    Builds the multi-path update applying one order to the aggregates
+    """
+    updates = {}
+    units = 0
+    revenue = 0.0
+    for product_id, quantity, total_price in order_totals(order):
+        path = "aggregates/products/%s" % product_id
+        updates[path + "/units"] = increment(quantity)
+        updates[path + "/revenue"] = increment(total_price)
+        units += quantity
+        revenue += total_price
+
+    day = "aggregates/days/%s" % day_key(order["created_at"])
+    updates[day + "/orders"] = increment(1)
+    updates[day + "/units"] = increment(units)
+    updates[day + "/revenue"] = increment(revenue)
+
+    user = "aggregates/users/%s" % aggregate_key(order["email"])
+    updates[user + "/orders"] = increment(1)
+    updates[user + "/revenue"] = increment(revenue)
+    return updates
+
+
+def record_order(db, order):
+    """
+    Applies a newly placed order to the aggregates
+    """
+    db.update(order_increments(order))
+
+
+def iter_orders(db, page_size=500, start_key=None):
+    """
+    Yields (key, order) for every order in key order, one page at a time so
+    memory use does not grow with the number of orders
+    """
+    last = start_key
+    while True:
+        query = db.child("orders").order_by_key()
+        if last is not None:
+            query = query.start_at(last)
+        page = query.limit_to_first(page_size + 1).get().each() or []
+        fetched = 0
+        for p in page:
+            if p.key() == last:
+                continue
+            fetched += 1
+            yield p.key(), p.val()
+        if fetched < page_size or not page:
+            return
+        last = page[-1].key()
+
+
+def rebuild_aggregates(db, orders=None):
+    """
+    Recomputes all aggregates from the existing orders in a single streaming
+    pass and replaces the stored ones. Orders placed while this runs may be
+    counted twice, so run it while checkout is quiet.
+    """
+    if orders is None:
+        orders = iter_orders(db)
+    products = {}
+    days = {}
+    users = {}
+    count = 0
+    for key, order in orders:
+        units = 0
+        revenue = 0.0
+        for product_id, quantity, total_price in order_totals(order):
+            totals = products.setdefault(product_id, {"units": 0, "revenue": 0.0})
+            totals["units"] += quantity
+            totals["revenue"] += total_price
+            units += quantity
+            revenue += total_price
+
+        totals = days.setdefault(
+            day_key(order["created_at"]), {"orders": 0, "units": 0, "revenue": 0.0}
+        )
+        totals["orders"] += 1
+        totals["units"] += units
+        totals["revenue"] += revenue
+
+        totals = users.setdefault(
+            aggregate_key(order["email"]), {"orders": 0, "revenue": 0.0}
+        )
+        totals["orders"] += 1
+        totals["revenue"] += revenue
+        count += 1
+
+    db.child("aggregates").set({"products": products, "days": days, "users": users})
+    return count
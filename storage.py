@@ -0,0 +1,773 @@
+"""
+Storage backends for products, orders, stock and sales reports.
+
+FirebaseStorage keeps today's Realtime Database layout, SqliteStorage stores
+the same records in a local SQLite file with indexes on the columns the shop
+queries by (email, created_at, price), so the shop can run and be benchmarked
+without a live database. Pick one with the storage_backend setting.
+
+Sales reports read totals kept up to date at checkout: the Firebase
+aggregates tree, or on SQLite the product, daily and user sales tables
+written in the same transaction as the order.
+
+Product and order events for the change feed are appended to an events
+table on SQLite, which every process polls; Firebase needs none, each
+process streams the database itself.
+
+Stock is kept as a few counters (shards) per product. Taking stock is a
+conditional write on one shard, an ETag compare-and-set on Firebase and an
+immediate transaction on SQLite, so concurrent checkouts never lose updates
+and only contend when they hit the same shard.
+"""
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import requests
+
+from sales_aggregates import (
+    aggregate_key,
+    day_key,
+    increment,
+    iter_orders,
+    order_totals,
+    rebuild_aggregates,
+    record_order,
+)
+from order_export import iter_orders_between
+
+# Alphabet of Firebase push ids, ordered so ids sort by creation time
+PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+
+def push_id(created_at=None, rng=random):
+    """
+    Generates a time ordered id in the same format as a Firebase push id
+    """
+    now = int((time.time() if created_at is None else created_at) * 1000)
+    stamp = ""
+    for _ in range(8):
+        stamp = PUSH_CHARS[now % 64] + stamp
+        now //= 64
+    return stamp + "".join(rng.choice(PUSH_CHARS) for _ in range(12))
+
+
+class ThreadLocalDatabase:
+    """
+    Stands in for a pyrebase database, giving each thread its own handle.
+    pyrebase keeps the path and query being built on the database object
+    (child(), order_by_child(), ...), so one handle shared by request,
+    batch and background threads would mix their URLs.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = self.factory()
+        return getattr(db, name)
+
+
+def product_dict(key, val):
+    """
+    Converts a stored product record into the dict used by the routes
+    """
+    return {
+        "id": key,
+        "name": val["name"],
+        "price": val["price"],
+        "sku": val["sku"],
+        "image": val["image"],
+        "created_at": val["created_at"],
+    }
+
+
+class FirebaseProducts:
+    def __init__(self, db):
+        self.db = db
+
+    def all(self, sort_key=None):
+        query = self.db.child("products")
+        if sort_key is not None:
+            query = query.order_by_child(sort_key)
+        products = query.get()
+        return [product_dict(p.key(), p.val()) for p in products.each()]
+
+    def since(self, created_at):
+        products = (
+            self.db.child("products")
+            .order_by_child("created_at")
+            .start_at(created_at)
+            .get()
+        )
+        return [product_dict(p.key(), p.val()) for p in products.each() or []]
+
+    def get(self, product_id):
+        val = self.db.child("products").child(product_id).get().val()
+        return product_dict(product_id, val) if val else None
+
+    def add(self, product):
+        return self.db.child("products").push(product)["name"]
+
+    def add_many(self, products):
+        """
+        Writes products that already carry an id in one multi-path update
+        """
+        self.db.child("products").update(
+            {p["id"]: {k: v for k, v in p.items() if k != "id"} for p in products}
+        )
+
+    def update_many(self, changes):
+        """
+        Applies {id: {field: value}} to existing products in one multi-path
+        update, so either every change lands or none does
+        """
+        self.db.child("products").update(
+            {
+                "%s/%s" % (product_id, field): value
+                for product_id, fields in changes.items()
+                for field, value in fields.items()
+            }
+        )
+
+
+class FirebaseOrders:
+    def __init__(self, db):
+        self.db = db
+
+    def add(self, order):
+        return self.db.child("orders").push(order)["name"]
+
+    def add_many(self, orders):
+        """
+        Writes (id, order) pairs in one multi-path update
+        """
+        self.db.child("orders").update(dict(orders))
+
+    def for_user(self, email):
+        orders = self.db.child("orders").order_by_child("email").equal_to(email).get()
+        return [(p.key(), p.val()) for p in orders.each() or []]
+
+    def iter(self, since=None, until=None, page_size=500):
+        if since is None and until is None:
+            return iter_orders(self.db, page_size)
+        return iter_orders_between(self.db, since, until, page_size)
+
+
+class FirebaseReports:
+    """
+    Reads the sales aggregates kept up to date at checkout
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def record(self, order):
+        """
+        Applies a newly saved order to the aggregates
+        """
+        record_order(self.db, order)
+
+    def rebuild(self):
+        return rebuild_aggregates(self.db)
+
+    def product(self, product_id):
+        return (
+            self.db.child("aggregates").child("products").child(product_id).get().val()
+        )
+
+    def days(self, start=None, end=None):
+        query = self.db.child("aggregates").child("days").order_by_key()
+        if start:
+            query = query.start_at(start)
+        if end:
+            query = query.end_at(end)
+        return [dict(day=d.key(), **d.val()) for d in query.get().each() or []]
+
+    def user(self, email):
+        key = aggregate_key(email)
+        return self.db.child("aggregates").child("users").child(key).get().val()
+
+
+class FirebaseStock:
+    """
+    Stock shards under stock/<product id>/s<shard> and reservations under
+    reservations/<id>. Conditional writes go straight to the REST API, which
+    pyrebase does not expose, with If-Match on the ETag of the value read.
+    """
+
+    def __init__(self, db, max_attempts=50):
+        self.db = db
+        self.max_attempts = max_attempts
+
+    def _url(self, *path):
+        return "%s%s.json" % (self.db.database_url, "/".join(path))
+
+    def _get(self, url):
+        response = self.db.requests.get(url, headers={"X-Firebase-ETag": "true"})
+        response.raise_for_status()
+        return response.json(), response.headers["ETag"]
+
+    def shards(self, product_id):
+        val = self.db.child("stock").child(product_id).get().val()
+        if not val:
+            return None
+        return {int(k[1:]): v for k, v in val.items()}
+
+    def set(self, product_id, shards):
+        self.db.child("stock").child(product_id).set(
+            {"s%d" % shard: count for shard, count in shards.items()}
+        )
+
+    def take(self, product_id, shard, quantity):
+        """
+        Takes up to quantity from a shard, returns how much was taken
+        """
+        url = self._url("stock", product_id, "s%d" % shard)
+        count, etag = self._get(url)
+        for _ in range(self.max_attempts):
+            taken = min(count or 0, quantity)
+            if taken <= 0:
+                return 0
+            response = self.db.requests.put(
+                url,
+                data=json.dumps(count - taken),
+                headers={"if-match": etag, "X-Firebase-ETag": "true"},
+            )
+            if response.status_code != 412:
+                response.raise_for_status()
+                return taken
+            # another checkout won, retry on the value it left
+            count, etag = response.json(), response.headers["ETag"]
+        raise requests.exceptions.RetryError("Stock shard too contended")
+
+    def put_back(self, product_id, shard, quantity):
+        self.db.child("stock").child(product_id).update(
+            {"s%d" % shard: increment(quantity)}
+        )
+
+    def add_reservation(self, reservation_id, reservation):
+        self.db.child("reservations").child(reservation_id).set(reservation)
+
+    def claim_reservation(self, reservation_id):
+        """
+        Deletes a reservation and returns it, or None when it is already gone,
+        so only one of commit, release and expiry gets it
+        """
+        url = self._url("reservations", reservation_id)
+        reservation, etag = self._get(url)
+        while reservation is not None:
+            response = self.db.requests.delete(
+                url, headers={"if-match": etag, "X-Firebase-ETag": "true"}
+            )
+            if response.status_code != 412:
+                response.raise_for_status()
+                return reservation
+            reservation, etag = response.json(), response.headers["ETag"]
+        return None
+
+    def expired_reservations(self, now):
+        reservations = (
+            self.db.child("reservations")
+            .order_by_child("expires_at")
+            .end_at(now)
+            .get()
+        )
+        return [r.key() for r in reservations.each() or []]
+
+
+class FirebaseStorage:
+    name = "firebase"
+
+    def __init__(self, db):
+        self.products = FirebaseProducts(db)
+        self.orders = FirebaseOrders(db)
+        self.reports = FirebaseReports(db)
+        self.stock = FirebaseStock(db)
+        # every process streams the changes from the database itself
+        self.events = None
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    price REAL NOT NULL,
+    sku TEXT NOT NULL,
+    image TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS products_name ON products (name);
+CREATE INDEX IF NOT EXISTS products_price ON products (price);
+CREATE INDEX IF NOT EXISTS products_sku ON products (sku);
+CREATE INDEX IF NOT EXISTS products_created_at ON products (created_at);
+
+CREATE TABLE IF NOT EXISTS orders (
+    id TEXT PRIMARY KEY,
+    email TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_email ON orders (email, created_at);
+CREATE INDEX IF NOT EXISTS orders_created_at ON orders (created_at, id);
+
+CREATE TABLE IF NOT EXISTS product_sales (
+    product_id TEXT PRIMARY KEY,
+    units INTEGER NOT NULL,
+    revenue REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS daily_sales (
+    day TEXT PRIMARY KEY,
+    orders INTEGER NOT NULL,
+    units INTEGER NOT NULL,
+    revenue REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_sales (
+    email TEXT PRIMARY KEY,
+    orders INTEGER NOT NULL,
+    revenue REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS stock (
+    product_id TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (product_id, shard)
+);
+
+CREATE TABLE IF NOT EXISTS reservations (
+    id TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reservations_expires_at ON reservations (expires_at);
+
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_created_at ON events (created_at);
+"""
+
+# Seconds change feed events stay in the events table, listeners poll far more
+# often
+EVENT_RETENTION = 3600
+
+PRODUCT_COLUMNS = ("name", "price", "sku", "image", "created_at")
+
+
+def sales_deltas(orders, sign=1, deltas=None):
+    """
+    Adds up what orders contribute to the sales tables, or take away from
+    them with sign -1. Returns ({product id: [units, revenue]},
+    {day: [orders, units, revenue]}, {email: [orders, revenue]}).
+    """
+    products, days, users = deltas or ({}, {}, {})
+    for order in orders:
+        units = 0
+        revenue = 0.0
+        for product_id, quantity, total_price in order_totals(order):
+            totals = products.setdefault(product_id, [0, 0.0])
+            totals[0] += sign * quantity
+            totals[1] += sign * total_price
+            units += quantity
+            revenue += total_price
+        totals = days.setdefault(day_key(order["created_at"]), [0, 0, 0.0])
+        totals[0] += sign
+        totals[1] += sign * units
+        totals[2] += sign * revenue
+        totals = users.setdefault(order["email"], [0, 0.0])
+        totals[0] += sign
+        totals[1] += sign * revenue
+    return products, days, users
+
+
+def write_sales(conn, deltas):
+    """
+    Applies sales_deltas() to the sales tables, in the caller's transaction
+    """
+    products, days, users = deltas
+    conn.executemany(
+        "INSERT INTO product_sales (product_id, units, revenue) VALUES (?, ?, ?) "
+        "ON CONFLICT (product_id) DO UPDATE SET units = units + excluded.units, "
+        "revenue = revenue + excluded.revenue",
+        ((k, v[0], v[1]) for k, v in products.items()),
+    )
+    conn.executemany(
+        "INSERT INTO daily_sales (day, orders, units, revenue) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (day) DO UPDATE SET orders = orders + excluded.orders, "
+        "units = units + excluded.units, revenue = revenue + excluded.revenue",
+        ((k, v[0], v[1], v[2]) for k, v in days.items()),
+    )
+    conn.executemany(
+        "INSERT INTO user_sales (email, orders, revenue) VALUES (?, ?, ?) "
+        "ON CONFLICT (email) DO UPDATE SET orders = orders + excluded.orders, "
+        "revenue = revenue + excluded.revenue",
+        ((k, v[0], v[1]) for k, v in users.items()),
+    )
+
+
+class SqliteStorage:
+    """
+    Local SQLite storage, one connection per thread
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self.connection()
+        counted = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'daily_sales'"
+        ).fetchone()
+        conn.executescript(SCHEMA)
+        self.products = SqliteProducts(self)
+        self.orders = SqliteOrders(self)
+        self.reports = SqliteReports(self)
+        self.stock = SqliteStock(self)
+        self.events = SqliteEvents(self)
+        if not counted:
+            # a database from before the sales tables
+            self.reports.rebuild()
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+
+class SqliteProducts:
+    def __init__(self, storage):
+        self.storage = storage
+
+    def _select(self, where="", params=(), order="id"):
+        rows = self.storage.connection().execute(
+            "SELECT id, name, price, sku, image, created_at FROM products %s "
+            "ORDER BY %s" % (where, order),
+            params,
+        )
+        return [dict(zip(("id",) + PRODUCT_COLUMNS, row)) for row in rows]
+
+    def all(self, sort_key=None):
+        if sort_key is None:
+            return self._select()
+        if sort_key not in PRODUCT_COLUMNS:
+            raise KeyError(sort_key)
+        return self._select(order="%s, id" % sort_key)
+
+    def since(self, created_at):
+        return self._select("WHERE created_at >= ?", (created_at,), "created_at, id")
+
+    def get(self, product_id):
+        rows = self._select("WHERE id = ?", (product_id,))
+        return rows[0] if rows else None
+
+    def add(self, product):
+        product_id = product.get("id") or push_id()
+        with self.storage.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO products (id, name, price, sku, image, "
+                "created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (product_id,) + tuple(product[c] for c in PRODUCT_COLUMNS),
+            )
+        return product_id
+
+    def add_many(self, products):
+        """
+        Writes products that already carry an id in one transaction
+        """
+        with self.storage.connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO products (id, name, price, sku, image, "
+                "created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (tuple(p[c] for c in ("id",) + PRODUCT_COLUMNS) for p in products),
+            )
+
+    def update_many(self, changes):
+        """
+        Applies {id: {field: value}} to existing products in one transaction
+        """
+        with self.storage.connection() as conn:
+            for product_id, fields in changes.items():
+                columns = [c for c in PRODUCT_COLUMNS if c in fields]
+                conn.execute(
+                    "UPDATE products SET %s WHERE id = ?"
+                    % ", ".join("%s = ?" % c for c in columns),
+                    tuple(fields[c] for c in columns) + (product_id,),
+                )
+
+
+class SqliteOrders:
+    def __init__(self, storage):
+        self.storage = storage
+
+    def add(self, order):
+        """
+        Saves an order and counts it in the sales tables, in one transaction
+        """
+        order_id = push_id()
+        with self.storage.connection() as conn:
+            conn.execute(
+                "INSERT INTO orders (id, email, created_at, data) VALUES (?, ?, ?, ?)",
+                (order_id, order["email"], order["created_at"], json.dumps(order)),
+            )
+            write_sales(conn, sales_deltas([order]))
+        return order_id
+
+    def add_many(self, orders):
+        """
+        Writes (id, order) pairs in one transaction, replacing existing ones,
+        and updates the sales tables to match
+        """
+        orders = list(dict(orders).items())
+        conn = self.storage.connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            replaced = []
+            for i in range(0, len(orders), 500):
+                ids = [order_id for order_id, _ in orders[i : i + 500]]
+                rows = conn.execute(
+                    "SELECT data FROM orders WHERE id IN (%s)"
+                    % ", ".join("?" * len(ids)),
+                    ids,
+                )
+                replaced.extend(json.loads(data) for data, in rows)
+            deltas = sales_deltas(replaced, -1)
+            sales_deltas((o for _, o in orders), 1, deltas)
+            conn.executemany(
+                "INSERT OR REPLACE INTO orders (id, email, created_at, data) "
+                "VALUES (?, ?, ?, ?)",
+                (
+                    (order_id, o["email"], o["created_at"], json.dumps(o))
+                    for order_id, o in orders
+                ),
+            )
+            write_sales(conn, deltas)
+
+    def for_user(self, email):
+        rows = self.storage.connection().execute(
+            "SELECT id, data FROM orders WHERE email = ? ORDER BY created_at", (email,)
+        )
+        return [(order_id, json.loads(data)) for order_id, data in rows]
+
+    def iter(self, since=None, until=None, page_size=500):
+        """
+        Yields (id, order) in created_at order using keyset pagination
+        """
+        conn = self.storage.connection()
+        last = (float("-inf") if since is None else since, "")
+        high = float("inf") if until is None else until
+        while True:
+            rows = conn.execute(
+                "SELECT id, created_at, data FROM orders "
+                "WHERE (created_at, id) > (?, ?) AND created_at >= ? "
+                "AND created_at <= ? ORDER BY created_at, id LIMIT ?",
+                (last[0], last[1], last[0], high, page_size),
+            ).fetchall()
+            for order_id, created_at, data in rows:
+                yield order_id, json.loads(data)
+            if len(rows) < page_size:
+                return
+            last = (rows[-1][1], rows[-1][0])
+
+
+class SqliteReports:
+    """
+    The sales tables, counted in the same transaction that saves an order
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def record(self, order):
+        # already counted by SqliteOrders.add
+        pass
+
+    def rebuild(self):
+        """
+        Recounts the sales tables from all orders, returns how many there are
+        """
+        conn = self.storage.connection()
+        count = 0
+        deltas = ({}, {}, {})
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for (data,) in conn.execute("SELECT data FROM orders"):
+                sales_deltas([json.loads(data)], 1, deltas)
+                count += 1
+            for table in ("product_sales", "daily_sales", "user_sales"):
+                conn.execute("DELETE FROM %s" % table)
+            write_sales(conn, deltas)
+        return count
+
+    def product(self, product_id):
+        row = (
+            self.storage.connection()
+            .execute(
+                "SELECT units, revenue FROM product_sales WHERE product_id = ?",
+                (product_id,),
+            )
+            .fetchone()
+        )
+        return {"units": row[0], "revenue": row[1]} if row else None
+
+    def days(self, start=None, end=None):
+        rows = self.storage.connection().execute(
+            "SELECT day, orders, units, revenue FROM daily_sales "
+            "WHERE day >= ? AND day <= ? ORDER BY day",
+            (start or "", end or "9999-12-31"),
+        )
+        return [
+            {"day": day, "orders": orders, "units": units, "revenue": revenue}
+            for day, orders, units, revenue in rows
+        ]
+
+    def user(self, email):
+        row = (
+            self.storage.connection()
+            .execute("SELECT orders, revenue FROM user_sales WHERE email = ?", (email,))
+            .fetchone()
+        )
+        return {"orders": row[0], "revenue": row[1]} if row else None
+
+
+class SqliteStock:
+    def __init__(self, storage):
+        self.storage = storage
+
+    def shards(self, product_id):
+        rows = self.storage.connection().execute(
+            "SELECT shard, count FROM stock WHERE product_id = ?", (product_id,)
+        )
+        return dict(rows.fetchall()) or None
+
+    def set(self, product_id, shards):
+        with self.storage.connection() as conn:
+            conn.execute("DELETE FROM stock WHERE product_id = ?", (product_id,))
+            conn.executemany(
+                "INSERT INTO stock (product_id, shard, count) VALUES (?, ?, ?)",
+                ((product_id, shard, count) for shard, count in shards.items()),
+            )
+
+    def take(self, product_id, shard, quantity):
+        """
+        Takes up to quantity from a shard, returns how much was taken
+        """
+        conn = self.storage.connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT count FROM stock WHERE product_id = ? AND shard = ?",
+                (product_id, shard),
+            ).fetchone()
+            taken = min(row[0], quantity) if row else 0
+            if taken > 0:
+                conn.execute(
+                    "UPDATE stock SET count = count - ? "
+                    "WHERE product_id = ? AND shard = ?",
+                    (taken, product_id, shard),
+                )
+        return max(taken, 0)
+
+    def put_back(self, product_id, shard, quantity):
+        with self.storage.connection() as conn:
+            conn.execute(
+                "UPDATE stock SET count = count + ? WHERE product_id = ? AND shard = ?",
+                (quantity, product_id, shard),
+            )
+
+    def add_reservation(self, reservation_id, reservation):
+        with self.storage.connection() as conn:
+            conn.execute(
+                "INSERT INTO reservations (id, expires_at, data) VALUES (?, ?, ?)",
+                (reservation_id, reservation["expires_at"], json.dumps(reservation)),
+            )
+
+    def claim_reservation(self, reservation_id):
+        """
+        Deletes a reservation and returns it, or None when it is already gone
+        """
+        conn = self.storage.connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT data FROM reservations WHERE id = ?", (reservation_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM reservations WHERE id = ?", (reservation_id,))
+        return json.loads(row[0])
+
+    def expired_reservations(self, now):
+        rows = self.storage.connection().execute(
+            "SELECT id FROM reservations WHERE expires_at <= ?", (now,)
+        )
+        return [r[0] for r in rows]
+
+
+class SqliteEvents:
+    """
+    Append-only log of change feed events shared by all processes using the
+    database, read by id
+    """
+
+    def __init__(self, storage, retention=EVENT_RETENTION):
+        self.storage = storage
+        self.retention = retention
+
+    def add(self, event):
+        self.add_many([event])
+
+    def add_many(self, events):
+        now = time.time()
+        with self.storage.connection() as conn:
+            conn.executemany(
+                "INSERT INTO events (created_at, data) VALUES (?, ?)",
+                ((now, json.dumps(event)) for event in events),
+            )
+            last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            # trim old events about every thousand inserts
+            if last_id % 1000 < len(events):
+                conn.execute(
+                    "DELETE FROM events WHERE created_at < ?", (now - self.retention,)
+                )
+
+    def last_id(self):
+        row = self.storage.connection().execute("SELECT MAX(id) FROM events")
+        return row.fetchone()[0] or 0
+
+    def since(self, last_id, limit=500):
+        """
+        Returns up to limit (id, event) pairs added after last_id
+        """
+        rows = self.storage.connection().execute(
+            "SELECT id, data FROM events WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, limit),
+        )
+        return [(event_id, json.loads(data)) for event_id, data in rows]
+
+
+def open_storage(db):
+    """
+    Returns the storage backend selected by the storage_backend setting
+    """
+    backend = os.getenv("storage_backend") or "firebase"
+    if backend == "sqlite":
+        return SqliteStorage(os.getenv("sqlite_path") or "shop.db")
+    if backend == "firebase":
+        return FirebaseStorage(db)
+    raise ValueError("Unknown storage backend: %s" % backend)
@@ -0,0 +1,131 @@
+import gzip
+import os
+
+import pytest
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+import assets
+from assets import StaticAssets, build_assets, fingerprint, load_manifest, negotiate
+
+CSS = b"body { background: url('img/bg.png') } .x { background: url(missing.png) }"
+CSS += b" " * 400
+
+
+@pytest.fixture
+def static_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(assets, "brotli", None)
+    (tmp_path / "img").mkdir()
+    (tmp_path / "img" / "bg.png").write_bytes(b"\x89PNG not really")
+    (tmp_path / "style.css").write_bytes(CSS)
+    return str(tmp_path)
+
+
+def fallback(environ, start_response):
+    return Response("from app", status=404)(environ, start_response)
+
+
+def test_fingerprint_depends_on_content():
+    assert fingerprint("css/main.css", b"a") == fingerprint("css/main.css", b"a")
+    assert fingerprint("css/main.css", b"a") != fingerprint("css/main.css", b"b")
+    assert fingerprint("css/main.css", b"a").startswith("css/main.")
+    assert fingerprint("css/main.css", b"a").endswith(".css")
+
+
+def test_build_writes_manifest_and_variants(static_dir):
+    manifest = build_assets(static_dir)
+    assert set(manifest) == {"img/bg.png", "style.css"}
+    assert load_manifest(static_dir) == manifest
+    css = os.path.join(static_dir, manifest["style.css"])
+    with open(css, "rb") as f:
+        data = f.read()
+    # the image reference follows the image, unknown files are left alone
+    image = os.path.relpath(manifest["img/bg.png"], "dist").replace(os.sep, "/")
+    assert b"url('%s')" % image.encode() in data
+    assert b"url(missing.png)" in data
+    with open(css + ".gz", "rb") as f:
+        assert gzip.decompress(f.read()) == data
+    assert not os.path.exists(css + ".br")
+    # binary files are not compressed
+    assert not os.path.exists(os.path.join(static_dir, manifest["img/bg.png"]) + ".gz")
+
+
+def test_rebuild_is_stable_and_dist_is_not_fingerprinted(static_dir):
+    assert build_assets(static_dir) == build_assets(static_dir)
+
+
+def test_manifest_is_empty_before_a_build(tmp_path):
+    assert load_manifest(str(tmp_path)) == {}
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("", None),
+        ("gzip, deflate, br", "br"),
+        ("gzip", "gzip"),
+        ("GZIP", "gzip"),
+        ("gzip;q=0", None),
+        ("br;q=0, gzip", "gzip"),
+        ("br;q=0, gzip;q=0.5", None),
+        ("identity, *;q=0", None),
+        ("gzip;q=0.5, identity", None),
+        ("*", "br"),
+        ("*;q=0", None),
+    ],
+)
+def test_negotiate(header, expected):
+    assert negotiate(header, ["br", "gzip", None]) == expected
+
+
+def test_negotiate_only_picks_available_encodings():
+    assert negotiate("br", ["gzip", None]) is None
+
+
+@pytest.fixture
+def client(static_dir):
+    manifest = build_assets(static_dir)
+    url = "/static/" + manifest["style.css"]
+    app = StaticAssets(fallback, static_dir, manifest)
+    return Client(app), url
+
+
+def test_middleware_serves_encodings(client):
+    client, url = client
+    plain = client.get(url)
+    assert plain.status_code == 200
+    assert plain.headers["Content-Type"] == "text/css; charset=utf-8"
+    assert "immutable" in plain.headers["Cache-Control"]
+    assert plain.headers["Vary"] == "Accept-Encoding"
+    assert "Content-Encoding" not in plain.headers
+    assert plain.get_data().startswith(b"body")
+
+    zipped = client.get(url, headers={"Accept-Encoding": "br, gzip"})
+    assert zipped.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(zipped.get_data()) == plain.get_data()
+    assert zipped.headers["ETag"] == plain.headers["ETag"]
+
+    refused = client.get(url, headers={"Accept-Encoding": "gzip;q=0"})
+    assert "Content-Encoding" not in refused.headers
+    refused = client.get(url, headers={"Accept-Encoding": "identity, *;q=0"})
+    assert "Content-Encoding" not in refused.headers
+
+
+def test_middleware_conditional_and_head_requests(client):
+    client, url = client
+    etag = client.get(url).headers["ETag"]
+    cached = client.get(url, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.get_data() == b""
+    assert cached.headers["Vary"] == "Accept-Encoding"
+
+    head = client.head(url)
+    assert head.status_code == 200
+    assert head.get_data() == b""
+    assert int(head.headers["Content-Length"]) > 0
+
+
+def test_middleware_passes_other_requests_on(client):
+    client, url = client
+    assert client.get("/static/style.css").get_data() == b"from app"
+    assert client.post(url).get_data() == b"from app"
@@ -0,0 +1,81 @@
+from autocomplete import Autocomplete
+
+
+def product(id, name, sku):
+    return {"id": id, "name": name, "sku": sku}
+
+
+CATALOG = [
+    product("p1", "Slim Backpack", "SB1"),
+    product("p2", "Slim Backpack", "SB2"),
+    product("p3", "Travel Backpack", "TB1"),
+    product("p4", "Slim Wallet", "SW1"),
+]
+
+
+def built(products=CATALOG, overlay=None):
+    index = Autocomplete()
+    index.rebuild(products, 1, 1, overlay)
+    return index
+
+
+def texts(suggestions):
+    return [(s["text"], s["kind"]) for s in suggestions]
+
+
+def test_matches_names_words_and_skus():
+    index = built()
+    assert texts(index.suggest("slim")) == [
+        ("Slim Backpack", "name"),
+        ("Slim Wallet", "name"),
+    ]
+    assert texts(index.suggest("back")) == [
+        ("Slim Backpack", "name"),
+        ("Travel Backpack", "name"),
+    ]
+    assert texts(index.suggest("sb")) == [("SB1", "sku"), ("SB2", "sku")]
+
+
+def test_each_text_is_suggested_once():
+    index = built()
+    suggestions = index.suggest("slim b", k=5)
+    assert len(suggestions) == 1
+    assert suggestions[0]["id"] in ("p1", "p2")
+
+
+def test_k_bounds_the_suggestions():
+    index = built()
+    assert len(index.suggest("s", k=2)) == 2
+    assert index.suggest("s", k=0) == []
+    assert index.suggest("s", k=-3) == []
+    assert index.suggest("  ") == []
+
+
+def test_update_patches_changed_products():
+    index = built()
+    published = {p["id"]: p for p in CATALOG}.get
+    overlay = {
+        "p4": product("p4", "Leather Wallet", "SW1"),
+        "p5": product("p5", "Slim Phone Case", "PC1"),
+    }
+    index.update(overlay, published, 2)
+    assert index.generation == 2
+    assert texts(index.suggest("slim")) == [
+        ("Slim Backpack", "name"),
+        ("Slim Phone Case", "name"),
+    ]
+    assert texts(index.suggest("leather")) == [("Leather Wallet", "name")]
+
+    # a later overlay change replaces the previous overlay version
+    overlay = dict(overlay, p4=product("p4", "Canvas Wallet", "SW1"))
+    index.update(overlay, published, 3)
+    assert index.suggest("leather") == []
+    assert texts(index.suggest("wallet")) == [("Canvas Wallet", "name")]
+
+
+def test_update_is_idempotent_after_a_rebuild_that_saw_newer_products():
+    overlay = {"p5": product("p5", "Slim Phone Case", "PC1")}
+    index = built(CATALOG + list(overlay.values()))
+    index.update(overlay, {p["id"]: p for p in CATALOG}.get, 2)
+    assert len(index.suggest("slim phone")) == 1
+    assert len(index._entries) == len(set(index._entries))
@@ -0,0 +1,100 @@
+import json
+
+import pytest
+from flask import Flask, Response, request, session
+from flask.sessions import SecureCookieSession
+
+from batch_requests import BatchSessionInterface, parse_batch, run_subrequest
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.secret_key = "test"
+    app.session_interface = BatchSessionInterface()
+
+    @app.route("/api/whoami")
+    def whoami():
+        return Response(
+            json.dumps({"email": session.get("email"), "q": request.args.get("q")}),
+            mimetype="application/json",
+        )
+
+    @app.route("/api/admin")
+    def admin():
+        if request.headers.get("X-Admin-Token") != "tok":
+            return Response(
+                json.dumps({"error": "User not authenticated"}),
+                status=403,
+                mimetype="application/json",
+            )
+        return "ok"
+
+    @app.route("/api/broken")
+    def broken():
+        raise ValueError("boom")
+
+    @app.route("/api/delete", methods=["GET"])
+    def delete():
+        session.clear()
+        return "deleted"
+
+    return app
+
+
+ENDPOINTS = {"whoami", "admin", "broken"}
+
+
+def run(app, path, headers=None):
+    shared = SecureCookieSession({"email": "a@b.c"})
+    return run_subrequest(app, shared, {"path": path}, ENDPOINTS, headers=headers)
+
+
+@pytest.mark.parametrize(
+    "body, error",
+    [
+        (None, "Missing data"),
+        ({"requests": []}, "Missing data"),
+        ({"requests": "/api/whoami"}, "Missing data"),
+        ({"requests": [{"path": "/a"}] * 4}, "At most 3 requests per batch"),
+        ({"requests": [{"method": "GET"}]}, "Every request needs a path"),
+        ({"requests": ["/api/whoami"]}, "Every request needs a path"),
+        (
+            {"requests": [{"path": "/a"}, {"path": "/b", "method": "POST"}]},
+            "Only GET requests can be batched",
+        ),
+    ],
+)
+def test_parse_batch_rejects(body, error):
+    assert parse_batch(body, 3) == (None, error)
+
+
+def test_parse_batch_accepts_gets():
+    items = [{"path": "/a"}, {"path": "/b", "method": "get"}, {"path": "/c"}]
+    assert parse_batch({"requests": items}, 3) == (items, None)
+
+
+def test_subrequest_shares_the_session(app):
+    assert run(app, "/api/whoami?q=mug") == {
+        "path": "/api/whoami?q=mug",
+        "status": 200,
+        "body": {"email": "a@b.c", "q": "mug"},
+    }
+
+
+@pytest.mark.parametrize("path", ["/api/delete", "/api/missing", "/"])
+def test_endpoints_outside_the_allowlist_are_rejected(app, path):
+    result = run(app, path)
+    assert result["status"] == 400
+    assert result["body"] == {"error": "Request cannot be batched"}
+
+
+def test_errors_stay_with_their_item(app):
+    assert run(app, "/api/admin")["status"] == 403
+    assert run(app, "/api/broken")["status"] == 500
+    assert run(app, "/api/whoami")["status"] == 200
+
+
+def test_forwarded_headers_reach_the_subrequest(app):
+    result = run(app, "/api/admin", headers={"X-Admin-Token": "tok"})
+    assert (result["status"], result["body"]) == (200, "ok")
@@ -0,0 +1,34 @@
+from cart_versions import changes_since, record_change
+
+
+def test_new_cart_has_no_changes():
+    assert changes_since({}, 0) == set()
+
+
+def test_changes_since_each_version():
+    cart = {}
+    assert record_change(cart, ["a"]) == 1
+    assert record_change(cart, ["b", "a"]) == 2
+    assert record_change(cart, ["c"]) == 3
+    assert changes_since(cart, 0) == {"a", "b", "c"}
+    assert changes_since(cart, 1) == {"a", "b", "c"}
+    assert changes_since(cart, 2) == {"c"}
+    assert changes_since(cart, 3) == set()
+
+
+def test_version_from_the_future_needs_full_cart():
+    cart = {}
+    record_change(cart, ["a"])
+    assert changes_since(cart, 5) is None
+
+
+def test_log_is_bounded():
+    cart = {}
+    for i in range(10):
+        record_change(cart, [str(i)], log_size=3)
+    assert len(cart["cart_changes"]) == 3
+    # the log holds versions 8 to 10
+    assert changes_since(cart, 8) == {"8", "9"}
+    assert changes_since(cart, 7) == {"7", "8", "9"}
+    # older versions can only get the whole cart
+    assert changes_since(cart, 6) is None
@@ -0,0 +1,150 @@
+import os
+
+import pytest
+
+from catalog_snapshot import (
+    HEADER,
+    CatalogSnapshot,
+    build_snapshot,
+    fold_overlay,
+    publish_overlay,
+    publish_snapshot,
+    read_generation,
+    read_overlay,
+)
+
+def product(id, name, price, sku, image, created_at):
+    return {
+        "id": id,
+        "name": name,
+        "price": price,
+        "sku": sku,
+        "image": image,
+        "created_at": created_at,
+    }
+
+
+PRODUCTS = [
+    product("c", "Pen", 2.5, "P1", "x", 30),
+    product("a", "Mug", 9.0, "M1", "x", 10),
+    product("b", "Café", 4.0, "C1", "", 20),
+]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "catalog.snap")
+
+
+def open_snapshot(path):
+    catalog = CatalogSnapshot(path)
+    assert catalog.refresh(force=True)
+    return catalog
+
+
+def test_round_trip(path):
+    publish_snapshot(path, PRODUCTS)
+    catalog = open_snapshot(path)
+    assert catalog.generation == 1
+    assert catalog.high_water == 30
+    assert [p["id"] for p in catalog.products()] == ["a", "b", "c"]
+    assert catalog.get("b") == dict(PRODUCTS[2], price=4.0, created_at=20.0)
+    assert catalog.get("missing") is None
+
+
+def test_sort_orders(path):
+    publish_snapshot(path, PRODUCTS)
+    catalog = open_snapshot(path)
+    assert [p["price"] for p in catalog.sorted_by("price")] == [2.5, 4.0, 9.0]
+    assert [p["name"] for p in catalog.sorted_by("name")] == ["Café", "Mug", "Pen"]
+    with pytest.raises(KeyError):
+        catalog.sorted_by("image")
+
+
+def test_filter(path):
+    publish_snapshot(path, PRODUCTS)
+    catalog = open_snapshot(path)
+    count, page = catalog.filter(limit=1, offset=1, min_price=3)
+    assert count == 2
+    assert [p["id"] for p in page] == ["b"]
+
+
+def test_generation_increments(path):
+    assert read_generation(path) == 0
+    publish_snapshot(path, PRODUCTS)
+    publish_snapshot(path, PRODUCTS[:1])
+    assert read_generation(path) == 2
+    assert len(open_snapshot(path).products()) == 1
+
+
+def test_empty_catalog(path):
+    publish_snapshot(path, [])
+    catalog = open_snapshot(path)
+    assert catalog.products() == []
+    assert catalog.high_water == 0
+
+
+def test_corrupt_snapshot_is_not_mapped(path):
+    data = bytearray(build_snapshot(PRODUCTS, 1))
+    data[HEADER.size + 3] ^= 0xFF
+    with open(path, "wb") as f:
+        f.write(data)
+    assert not CatalogSnapshot(path).refresh(force=True)
+
+
+def test_corrupt_snapshot_keeps_previous_view(path):
+    publish_snapshot(path, PRODUCTS)
+    catalog = open_snapshot(path)
+    data = bytearray(build_snapshot(PRODUCTS[:1], 2))
+    data[-1] ^= 0xFF
+    with open(path + ".new", "wb") as f:
+        f.write(data)
+    os.replace(path + ".new", path)
+    assert catalog.refresh(force=True)
+    assert catalog.generation == 1
+    assert len(catalog.products()) == 3
+
+
+def test_overlay_is_merged_by_id(path):
+    publish_snapshot(path, PRODUCTS)
+    catalog = open_snapshot(path)
+    version = catalog.version
+    publish_overlay(
+        path, [dict(PRODUCTS[1], price=1), product("bb", "Ink", 7, "I1", "", 40)]
+    )
+    assert catalog.refresh(force=True)
+    assert catalog.version == version + 1
+    assert catalog.generation == 1
+    assert [p["id"] for p in catalog.products()] == ["a", "b", "bb", "c"]
+    assert [p["id"] for p in catalog.sorted_by("price")] == ["a", "c", "b", "bb"]
+    assert catalog.get("a")["price"] == 1.0
+    assert catalog.get_published("a")["price"] == 9.0
+    assert catalog.get("bb")["name"] == "Ink"
+
+
+@pytest.mark.parametrize("offset", [0, 1, 2, 3])
+def test_filter_pages_through_the_overlay(path, offset):
+    publish_snapshot(path, PRODUCTS)
+    catalog = open_snapshot(path)
+    publish_overlay(
+        path,
+        [
+            dict(PRODUCTS[0], price=20),  # c drops out of the price range
+            product("0", "Cup", 5, "C0", "", 1),
+            product("bb", "Ink", 7, "I1", "", 40),
+        ],
+    )
+    catalog.refresh(force=True)
+    count, page = catalog.filter(limit=2, offset=offset, max_price=10)
+    assert count == 4
+    assert [p["id"] for p in page] == ["0", "a", "b", "bb"][offset : offset + 2]
+
+
+def test_fold_keeps_later_overlay_entries(path):
+    publish_snapshot(path, PRODUCTS)
+    first = publish_overlay(path, [product("d", "Cap", 3, "C2", "", 50)])
+    publish_overlay(path, [product("e", "Hat", 3, "H1", "", 60)])
+    fold_overlay(path, first)
+    sequence, entries = read_overlay(path)
+    assert sequence == 2
+    assert list(entries) == ["e"]
@@ -0,0 +1,127 @@
+from change_feed import (
+    RESYNC,
+    ChangeFeed,
+    EventLogListener,
+    order_events,
+    product_events,
+    sse_stream,
+)
+from storage import SqliteStorage
+
+
+def drain(subscriber):
+    messages = []
+    while not subscriber.queue.empty():
+        messages.append(subscriber.queue.get_nowait())
+    return messages
+
+
+def product(n):
+    return {"type": "product", "action": "changed", "id": "p%d" % n}
+
+
+def test_replays_events_after_last_event_id():
+    feed = ChangeFeed()
+    listener = feed.subscribe("a@b.c")
+    for n in range(5):
+        feed.publish(product(n))
+    ids = [event_id for event_id, _ in drain(listener)]
+
+    late = feed.subscribe("a@b.c", ids[2])
+    assert [event["id"] for _, event in drain(late)] == ["p3", "p4"]
+    assert drain(feed.subscribe("a@b.c", ids[-1])) == []
+
+
+def test_unknown_last_event_id_resyncs():
+    feed = ChangeFeed()
+    feed.publish(product(1))
+    for last_event_id in ("other-1", "%s-x" % feed.token):
+        assert drain(feed.subscribe("a@b.c", last_event_id)) == [(None, RESYNC)]
+
+
+def test_last_event_id_older_than_replay_buffer_resyncs():
+    feed = ChangeFeed(replay_size=3)
+    for n in range(5):
+        feed.publish(product(n))
+    assert feed._since("%s-1" % feed.token) is None
+    assert [e["id"] for _, e in feed._since("%s-2" % feed.token)] == ["p2", "p3", "p4"]
+
+
+def test_slow_subscriber_gets_one_resync():
+    feed = ChangeFeed(max_queue=3)
+    slow = feed.subscribe("a@b.c")
+    for n in range(10):
+        feed.publish(product(n))
+    messages = drain(slow)
+    assert messages[0] == (None, RESYNC)
+    assert RESYNC not in [event for _, event in messages[1:]]
+    assert feed.metrics()["overflows"] > 0
+
+
+def test_order_events_only_reach_their_user():
+    feed = ChangeFeed()
+    mine = feed.subscribe("a@b.c")
+    other = feed.subscribe("x@y.z")
+    feed.publish({"type": "order", "id": "o1", "email": "a@b.c"})
+    feed.publish(product(1))
+    assert [e["type"] for _, e in drain(mine)] == ["order", "product"]
+    assert [e["type"] for _, e in drain(other)] == ["product"]
+
+
+def test_subscriber_limit():
+    feed = ChangeFeed()
+    first = feed.subscribe("a@b.c", limit=1)
+    assert feed.subscribe("x@y.z", limit=1) is None
+    feed.unsubscribe(first)
+    assert feed.subscribe("x@y.z", limit=1) is not None
+
+
+def test_stream_frames_and_unsubscribes():
+    feed = ChangeFeed()
+    subscriber = feed.subscribe("a@b.c")
+    feed.publish(product(1))
+    stream = sse_stream(feed, subscriber, heartbeat=0.01)
+    assert next(stream) == "retry: 3000\n\n"
+    frame = next(stream)
+    assert frame.startswith("id: %s-1\nevent: product\ndata: " % feed.token)
+    assert next(stream) == ": keepalive\n\n"
+    stream.close()
+    assert feed.metrics()["subscribers"] == 0
+
+
+def test_translates_stream_messages():
+    assert product_events("/p1", None) == [
+        {"type": "product", "action": "deleted", "id": "p1"}
+    ]
+    assert product_events("/p1/price", 5) == [
+        {"type": "product", "action": "changed", "id": "p1", "data": {"price": 5}}
+    ]
+    changes = product_events("/", {"p1/price": 5, "p1/name": "Mug"})
+    assert changes[0]["data"] == {"price": 5, "name": "Mug"}
+    assert order_events("/o1", {"email": "a@b.c"})[0]["email"] == "a@b.c"
+    assert order_events("/o1/status", "sent") == []
+
+
+def test_event_log_carries_events_between_processes(tmp_path):
+    path = str(tmp_path / "shop.db")
+    writer = SqliteStorage(path)  # e.g. the main server
+    feed = ChangeFeed()  # e.g. feed_server.py
+    listener = EventLogListener(SqliteStorage(path).events, feed)
+    writer.events.add(product(0))
+    listener.last_id = listener.events.last_id()  # what start() does
+    subscriber = feed.subscribe("a@b.c")
+    writer.events.add_many([product(1), product(2)])
+    writer.events.add({"type": "order", "id": "o1", "email": "x@y.z"})
+    assert listener.poll() == 3
+    assert [event["id"] for _, event in drain(subscriber)] == ["p1", "p2"]
+    assert listener.poll() == 0
+
+
+def test_event_log_pages_and_trims(tmp_path):
+    events = SqliteStorage(str(tmp_path / "shop.db")).events
+    events.retention = -1
+    events.add_many([product(n) for n in range(999)])
+    assert [e["id"] for _, e in events.since(997)] == ["p997", "p998"]
+    assert len(events.since(0, limit=10)) == 10
+    events.add(product(999))
+    assert [e["id"] for _, e in events.since(0)] == []
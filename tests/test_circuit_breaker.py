@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+def fail():
+    raise ValueError("backend down")
+
+
+def slow(result, seconds=0.1):
+    time.sleep(seconds)
+    return result
+
+
+def settle(breaker):
+    """
+    Waits for the background probe to finish
+    """
+    deadline = time.monotonic() + 2
+    while breaker.state == HALF_OPEN and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return breaker.state
+
+
+def opened(name, **kwargs):
+    breaker = CircuitBreaker(name, failure_threshold=2, **kwargs)
+    assert breaker.call("k", lambda: "good") == ("good", False)
+    for _ in range(2):
+        assert breaker.call("k", fail) == ("good", True)
+    assert breaker.state == OPEN
+    return breaker
+
+
+def test_consecutive_errors_open_the_breaker():
+    breaker = CircuitBreaker("test-errors", failure_threshold=3)
+    breaker.call("k", lambda: 1)
+    for _ in range(2):
+        breaker.call("k", fail)
+    breaker.call("k", lambda: 2)
+    assert (breaker.state, breaker.failures) == (CLOSED, 0)
+    for _ in range(3):
+        breaker.call("k", fail)
+    assert breaker.state == OPEN
+    assert breaker.metrics()["errors"] == 5
+
+
+def test_open_breaker_serves_stale_or_fails_fast():
+    breaker = opened("test-open", reset_timeout=60)
+    calls = []
+    assert breaker.call("k", calls.append, 1) == ("good", True)
+    with pytest.raises(CircuitOpenError):
+        breaker.call("other", calls.append, 1)
+    assert calls == []
+    assert breaker.metrics()["short_circuits"] == 2
+
+
+def test_slow_calls_open_the_breaker():
+    breaker = CircuitBreaker("test-slow", failure_threshold=2, latency_threshold=0.05)
+    assert breaker.call("k", slow, "late") == ("late", False)
+    breaker.call("k", slow, "late")
+    assert breaker.state == OPEN
+    assert breaker.metrics()["slow_calls"] == 2
+
+
+def test_successful_probe_closes_the_breaker():
+    breaker = opened("test-probe", reset_timeout=0)
+    assert breaker.call("k", lambda: "fresh") == ("good", True)
+    assert settle(breaker) == CLOSED
+    assert breaker.metrics()["probes"] == 1
+    assert breaker.call("k", lambda: "next") == ("next", False)
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = opened("test-probe-error", reset_timeout=0)
+    breaker.call("k", fail)
+    assert settle(breaker) == OPEN
+
+
+def test_slow_probe_counts_as_a_failure():
+    breaker = opened("test-probe-slow", reset_timeout=0, latency_threshold=0.05)
+    assert breaker.call("k", slow, "fresh") == ("good", True)
+    assert settle(breaker) == OPEN
+    assert breaker.metrics()["slow_calls"] == 1
+    # the slow answer is still the freshest result to serve
+    breaker.reset_timeout = 60
+    assert breaker.call("k", fail) == ("fresh", True)
+
+
+def test_only_one_probe_at_a_time():
+    breaker = opened("test-probe-once", reset_timeout=0)
+    breaker.call("k", slow, "fresh", 0.1)
+    assert breaker.state == HALF_OPEN
+    breaker.call("k", slow, "fresh", 0.1)
+    assert settle(breaker) == CLOSED
+    assert breaker.metrics()["probes"] == 1
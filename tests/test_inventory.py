@@ -0,0 +1,74 @@
+import pytest
+
+from inventory import Inventory, OutOfStock
+from storage import SqliteStorage
+
+
+@pytest.fixture
+def inventory(tmp_path):
+    storage = SqliteStorage(str(tmp_path / "shop.db"))
+    return Inventory(storage.stock, shards=4, ttl=60)
+
+
+def test_stock_is_spread_over_shards(inventory):
+    inventory.set_stock("p1", 10)
+    assert sorted(inventory.stock.shards("p1").values()) == [2, 2, 3, 3]
+    assert inventory.available("p1") == 10
+    assert inventory.available("untracked") is None
+
+
+def test_reserve_and_release(inventory):
+    inventory.set_stock("p1", 5)
+    reservation_id = inventory.reserve("p1", 4, "a@b.c")
+    assert inventory.available("p1") == 1
+    with pytest.raises(OutOfStock):
+        inventory.reserve("p1", 2, "a@b.c")
+    assert inventory.available("p1") == 1
+    inventory.release(reservation_id)
+    inventory.release(reservation_id)
+    assert inventory.available("p1") == 5
+
+
+def test_untracked_products_never_run_out(inventory):
+    assert inventory.reserve("untracked", 100, "a@b.c") is None
+    assert inventory.commit({"untracked": 100}, []) == [("untracked", [])]
+
+
+def test_commit_covers_the_rest_of_the_cart(inventory):
+    inventory.set_stock("p1", 10)
+    reservation_id = inventory.reserve("p1", 2, "a@b.c")
+    taken = inventory.commit({"p1": 5}, [reservation_id])
+    assert inventory.available("p1") == 5
+    assert sum(n for _, pieces in taken for _, n in pieces) == 5
+    # the reservation was used up by the checkout
+    inventory.release(reservation_id)
+    assert inventory.available("p1") == 5
+
+
+def test_failed_commit_puts_everything_back(inventory):
+    inventory.set_stock("p1", 10)
+    inventory.set_stock("p2", 1)
+    reservation_id = inventory.reserve("p1", 3, "a@b.c")
+    with pytest.raises(OutOfStock) as error:
+        inventory.commit({"p1": 6, "p2": 2}, [reservation_id])
+    assert error.value.product_id == "p2"
+    assert inventory.available("p1") == 10
+    assert inventory.available("p2") == 1
+    assert inventory.stock.claim_reservation(reservation_id) is None
+
+
+def test_refund_returns_committed_stock(inventory):
+    inventory.set_stock("p1", 10)
+    reservation_id = inventory.reserve("p1", 3, "a@b.c")
+    taken = inventory.commit({"p1": 4}, [reservation_id])
+    assert inventory.available("p1") == 6
+    inventory.refund(taken)
+    assert inventory.available("p1") == 10
+
+
+def test_expired_reservations_are_released(inventory):
+    inventory.set_stock("p1", 5)
+    inventory.reserve("p1", 2, "a@b.c")
+    assert inventory.release_expired() == 0
+    assert inventory.release_expired(now=10**10) == 1
+    assert inventory.available("p1") == 5
@@ -0,0 +1,127 @@
+import json
+
+from order_export import csv_rows, iter_orders_between, jsonl_rows
+
+
+class Snapshot:
+    def __init__(self, key, value):
+        self._key = key
+        self._value = value
+
+    def key(self):
+        return self._key
+
+    def val(self):
+        return self._value
+
+
+class FakeDatabase:
+    """
+    The part of the pyrebase query API the export uses, sorted like the
+    Realtime Database: by the child value, ties by key. Every get() is logged.
+    """
+
+    def __init__(self, tree, gets=None, path=()):
+        self.tree = tree
+        self.gets = [] if gets is None else gets
+        self.path = path
+        self.field = self.start = self.end = self.limit = None
+
+    def child(self, name):
+        return FakeDatabase(self.tree, self.gets, self.path + (name,))
+
+    def order_by_key(self):
+        return self
+
+    def order_by_child(self, field):
+        self.field = field
+        return self
+
+    def start_at(self, value):
+        self.start = value
+        return self
+
+    def end_at(self, value):
+        self.end = value
+        return self
+
+    def limit_to_first(self, limit):
+        self.limit = limit
+        return self
+
+    def get(self):
+        self.gets.append((self.start, self.end, self.limit))
+        node = self.tree
+        for name in self.path:
+            node = node[name]
+        if self.field is None:
+            rows = sorted((k, v, k) for k, v in node.items())
+        else:
+            rows = sorted((v[self.field], k, v) for k, v in node.items())
+            rows = [(k, v, sort) for sort, k, v in rows]
+        if self.start is not None:
+            rows = [r for r in rows if r[2] >= self.start]
+        if self.end is not None:
+            rows = [r for r in rows if r[2] <= self.end]
+        self.page = [Snapshot(k, v) for k, v, _ in rows[: self.limit]]
+        return self
+
+    def each(self):
+        return self.page or None
+
+
+def orders(created_at):
+    return {
+        "o%02d" % i: {"email": "a@b.c", "created_at": t}
+        for i, t in enumerate(created_at)
+    }
+
+
+def test_pages_through_ties_on_created_at():
+    # more orders share a created_at than fit in one page
+    tree = {"orders": orders([1, 2, 2, 2, 2, 2, 3, 3, 4])}
+    db = FakeDatabase(tree)
+    keys = [k for k, _ in iter_orders_between(db, since=0, page_size=2)]
+    assert sorted(keys) == sorted(tree["orders"])
+    assert len(keys) == len(set(keys))
+    created_at = [tree["orders"][k]["created_at"] for k in keys]
+    assert created_at == [1, 2, 2, 2, 2, 2, 3, 3, 4]
+
+
+def test_window_is_inclusive():
+    tree = {"orders": orders([1, 2, 3, 3, 4, 5])}
+    db = FakeDatabase(tree)
+    found = [o["created_at"] for _, o in iter_orders_between(db, 2, 4, page_size=1)]
+    assert found == [2, 3, 3, 4]
+
+
+def test_stops_after_a_short_page():
+    tree = {"orders": orders([1, 2, 3])}
+    db = FakeDatabase(tree)
+    assert len(list(iter_orders_between(db, since=0, page_size=10))) == 3
+    assert len(db.gets) == 1
+
+
+def test_without_window_pages_by_key():
+    tree = {"orders": orders([5, 1, 4, 2])}
+    db = FakeDatabase(tree)
+    keys = [k for k, _ in iter_orders_between(db, page_size=1)]
+    assert keys == ["o00", "o01", "o02", "o03"]
+
+
+def test_csv_and_jsonl_rows():
+    order = {
+        "email": "a@b.c",
+        "created_at": 1.5,
+        "name": "A",
+        "phone": "1",
+        "address": "Street 1",
+        "total_quantity": 2,
+        "total_price": 5.0,
+        "items": {"p1": {"id": "p1", "quantity": 2, "total_price": 5.0}},
+    }
+    lines = "".join(csv_rows([("o1", order)])).splitlines()
+    assert lines[0].startswith("id,created_at,email")
+    assert lines[1].startswith("o1,1.5,a@b.c,A,1,Street 1,2,5.0,")
+    record = json.loads(next(iter(jsonl_rows([("o1", order)]))))
+    assert record["id"] == "o1" and record["items"] == order["items"]
@@ -0,0 +1,97 @@
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from product_search import (
+    MAX_PER_PAGE,
+    RESULT_FIELDS,
+    build_search_params,
+    search_response,
+)
+
+
+def params(**args):
+    return build_search_params(MultiDict(args))
+
+
+def test_results_are_projected_to_product_fields():
+    assert params()["include_fields"] == ",".join(RESULT_FIELDS)
+    assert params(fields=",")["include_fields"] == ",".join(RESULT_FIELDS)
+    assert params(fields="id, name")["include_fields"] == "id,name"
+
+
+def test_defaults():
+    assert params() == {
+        "q": "*",
+        "query_by": "name,sku",
+        "query_by_weights": "2,1",
+        "sort_by": "created_at:desc",
+        "page": 1,
+        "per_page": 20,
+        "include_fields": ",".join(RESULT_FIELDS),
+    }
+    assert params(page="0", per_page="1000")["page"] == 1
+    assert params(per_page="1000")["per_page"] == MAX_PER_PAGE
+
+
+def test_filter_by():
+    assert params(min_price="10", max_price="20.5")["filter_by"] == (
+        "price:>=10.0 && price:<=20.5"
+    )
+    assert params(since="100", until="200", sku_prefix="SH-1")["filter_by"] == (
+        "created_at:>=100.0 && created_at:<=200.0 && sku:SH-1*"
+    )
+    assert "filter_by" not in params(q="shoe", min_price="")
+
+
+@pytest.mark.parametrize("arg", ["min_price", "max_price", "since", "until"])
+@pytest.mark.parametrize("value", ["inf", "-inf", "nan", "Infinity", "ten"])
+def test_bounds_must_be_finite_numbers(arg, value):
+    with pytest.raises(ValueError, match="Invalid %s" % arg):
+        params(**{arg: value})
+
+
+@pytest.mark.parametrize("prefix", ["SH*", "a b", "x && price:>0", "é"])
+def test_sku_prefix_cannot_inject_filters(prefix):
+    with pytest.raises(ValueError):
+        params(sku_prefix=prefix)
+
+
+def test_facets_fields_and_sort():
+    p = params(facet_by="price, sku", fields="id,price", sort_by="price:asc")
+    assert (p["facet_by"], p["include_fields"], p["sort_by"]) == (
+        "price,sku",
+        "id,price",
+        "price:asc",
+    )
+    for bad in ({"facet_by": "name"}, {"fields": "content_hash"}):
+        with pytest.raises(ValueError):
+            params(**bad)
+    for sort in ("price", "price:up", "stock:asc"):
+        with pytest.raises(ValueError):
+            params(sort_by=sort)
+
+
+def test_search_response():
+    result = {
+        "found": 2,
+        "hits": [{"document": {"id": "a"}}, {"document": {"id": "b"}}],
+        "facet_counts": [
+            {
+                "field_name": "sku",
+                "counts": [{"value": "SH1", "count": 2, "highlighted": "SH1"}],
+                "stats": {"total_values": 1},
+            }
+        ],
+    }
+    assert search_response(result) == {
+        "success": [{"id": "a"}, {"id": "b"}],
+        "found": 2,
+        "facets": [
+            {
+                "field": "sku",
+                "counts": [{"value": "SH1", "count": 2}],
+                "stats": {"total_values": 1},
+            }
+        ],
+    }
+    assert search_response({}) == {"success": [], "found": 0, "facets": []}
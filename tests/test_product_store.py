@@ -0,0 +1,104 @@
+from array import array
+
+import pytest
+
+import product_store
+from catalog_snapshot import CatalogSnapshot, publish_snapshot
+from product_store import ProductStore, drop_indexes, filter_indexes
+
+
+@pytest.fixture(params=["numpy", "python"])
+def engine(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(product_store, "numpy", None)
+    elif product_store.numpy is None:
+        pytest.skip("numpy is not installed")
+    return request.param
+
+
+def product(n):
+    return {
+        "id": "p%02d" % n,
+        "name": "Product %d" % (n % 7),
+        "price": float(n % 5),
+        "sku": "SKU%d" % n,
+        "image": "%d.jpg" % (n % 2),
+        "created_at": 1000 + 10 * n,
+    }
+
+
+PRODUCTS = [product(n) for n in range(20)]
+
+
+def ids(records):
+    return [r.id for r in records]
+
+
+def test_columns_match_the_engine(engine):
+    store = ProductStore(PRODUCTS)
+    if engine == "python":
+        assert isinstance(store.price, array)
+    else:
+        assert store.price.dtype == product_store.numpy.float64
+
+
+def test_get_and_records(engine):
+    store = ProductStore(PRODUCTS)
+    assert len(store) == 20
+    assert store.get("p07").to_dict() == dict(product(7), created_at=1070.0)
+    assert store.get("missing") is None
+    # repeated strings are stored once
+    assert store.images[0] is store.images[2]
+
+
+@pytest.mark.parametrize(
+    "bounds, expected",
+    [
+        ({}, 20),
+        ({"min_price": 3}, 8),
+        ({"max_price": 0}, 4),
+        ({"min_price": 1, "max_price": 2}, 8),
+        ({"since": 1100, "until": 1150}, 6),
+        ({"min_price": 4, "since": 1100}, 2),
+        ({"min_price": 5}, 0),
+    ],
+)
+def test_filter_bounds_are_inclusive(engine, bounds, expected):
+    store = ProductStore(PRODUCTS)
+    count, records = store.filter(**bounds)
+    assert count == expected
+    for r in records:
+        assert bounds.get("min_price", 0) <= r.price <= bounds.get("max_price", 4)
+        assert bounds.get("since", 0) <= r.created_at <= bounds.get("until", 9999)
+
+
+def test_filter_pages(engine):
+    store = ProductStore(PRODUCTS)
+    pages = [store.filter(limit=3, offset=o, min_price=2) for o in range(0, 15, 3)]
+    assert {count for count, _ in pages} == {12}
+    assert sum((ids(page) for _, page in pages), []) == [
+        p["id"] for p in PRODUCTS if p["price"] >= 2
+    ]
+    assert store.filter(limit=3, offset=12, min_price=2) == (12, [])
+
+
+def test_index_helpers(engine):
+    store = ProductStore(PRODUCTS)
+    indexes = filter_indexes(store.price, store.created_at, max_price=1)
+    assert list(indexes) == [0, 1, 5, 6, 10, 11, 15, 16]
+    assert list(drop_indexes(indexes, {1, 10, 19})) == [0, 5, 6, 11, 15, 16]
+    assert list(drop_indexes(indexes, set())) == list(indexes)
+
+
+def test_snapshot_sorts_and_filters(engine, tmp_path):
+    path = str(tmp_path / "catalog.snap")
+    publish_snapshot(path, PRODUCTS)
+    catalog = CatalogSnapshot(path)
+    assert catalog.refresh(force=True)
+    by_price = catalog.sorted_by("price")
+    assert [p["price"] for p in by_price] == sorted(p["price"] for p in PRODUCTS)
+    # ties are broken by id
+    assert [p["id"] for p in by_price[:4]] == ["p00", "p05", "p10", "p15"]
+    count, page = catalog.filter(2, 2, since=1050, until=1120)
+    assert count == 8
+    assert [p["id"] for p in page] == ["p07", "p08"]
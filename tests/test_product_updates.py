@@ -0,0 +1,127 @@
+import pytest
+
+from product_updates import apply_product_changes, parse_product_changes
+from reconcile import content_hash
+from storage import SqliteStorage
+
+
+def product(n):
+    return {
+        "id": "p%d" % n,
+        "name": "Product %d" % n,
+        "price": 10.0,
+        "sku": "SKU%d" % n,
+        "image": "%d.jpg" % n,
+        "created_at": 100.0 + n,
+    }
+
+
+def test_parse_merges_updates_per_product():
+    changes, error = parse_product_changes(
+        [
+            {"id": "p1", "price": "9.5"},
+            {"id": "p2", "name": "Mug", "sku": "M1"},
+            {"id": "p1", "image": "new.jpg"},
+        ]
+    )
+    assert error is None
+    assert changes == {
+        "p1": {"price": 9.5, "image": "new.jpg"},
+        "p2": {"name": "Mug", "sku": "M1"},
+    }
+
+
+@pytest.mark.parametrize(
+    "items, error",
+    [
+        (None, "Missing data"),
+        ([], "Missing data"),
+        ({"id": "p1", "price": 1}, "Missing data"),
+        ([{"price": 1}], "Every update needs a product id"),
+        (["p1"], "Every update needs a product id"),
+        ([{"id": "p1"}], "Nothing to update for p1"),
+        ([{"id": "p1", "created_at": 5}], "Field created_at cannot be updated"),
+        ([{"id": "p1", "stock": 5}], "Field stock cannot be updated"),
+        ([{"id": "p1", "price": 0}], "Invalid price for p1"),
+        ([{"id": "p1", "price": "-3"}], "Invalid price for p1"),
+        ([{"id": "p1", "price": "free"}], "Invalid price for p1"),
+        ([{"id": "p1", "price": "inf"}], "Invalid price for p1"),
+        ([{"id": "p1", "price": "nan"}], "Invalid price for p1"),
+        ([{"id": "p1", "price": None}], "Invalid price for p1"),
+        ([{"id": "p1", "name": ""}], "Invalid name for p1"),
+        ([{"id": "p1", "sku": 12}], "Invalid sku for p1"),
+    ],
+)
+def test_parse_rejects(items, error):
+    assert parse_product_changes(items) == (None, error)
+
+
+def test_one_invalid_item_rejects_the_batch():
+    items = [{"id": "p1", "price": 5}, {"id": "p2", "price": -1}]
+    assert parse_product_changes(items) == (None, "Invalid price for p2")
+
+
+class Updates:
+    def __init__(self, tmp_path, count=5, batch=2):
+        self.storage = SqliteStorage(str(tmp_path / "shop.db"))
+        self.storage.products.add_many([product(n) for n in range(count)])
+        self.batch = batch
+        self.indexed = []
+        self.published = []
+        self.reject = set()
+        self.down = False
+
+    def index(self, documents):
+        if self.down:
+            raise ConnectionError("typesense down")
+        self.indexed.append(documents)
+        return [{"success": d["id"] not in self.reject} for d in documents]
+
+    def apply(self, changes):
+        return apply_product_changes(
+            changes,
+            self.storage.products.get,
+            self.storage.products,
+            self.index,
+            self.published.extend,
+            self.batch,
+        )
+
+
+def test_apply_writes_indexes_and_publishes(tmp_path):
+    updates = Updates(tmp_path)
+    changes = {"p%d" % n: {"price": 20.0 + n} for n in range(3)}
+    changes["p4"] = {"name": "Renamed"}
+    report, error = updates.apply(changes)
+    assert (report, error) == ({"updated": 4, "search_failed": 0}, None)
+    assert updates.storage.products.get("p1")["price"] == 21.0
+    assert updates.storage.products.get("p4")["name"] == "Renamed"
+    assert updates.storage.products.get("p3") == product(3)
+    # in batches, with the hash of the new content
+    assert [len(documents) for documents in updates.indexed] == [2, 2]
+    document = updates.indexed[1][1]
+    assert document["id"] == "p4"
+    assert document["content_hash"] == content_hash(dict(product(4), name="Renamed"))
+    assert [p["id"] for p in updates.published] == ["p0", "p1", "p2", "p4"]
+
+
+def test_unknown_product_rejects_everything(tmp_path):
+    updates = Updates(tmp_path)
+    report, error = updates.apply({"p1": {"price": 1.0}, "nope": {"price": 1.0}})
+    assert (report, error) == (None, "Unknown product nope")
+    assert updates.storage.products.get("p1") == product(1)
+    assert updates.indexed == updates.published == []
+
+
+def test_search_failures_are_counted_not_fatal(tmp_path):
+    updates = Updates(tmp_path)
+    updates.reject = {"p0"}
+    report, _ = updates.apply({"p0": {"price": 1.0}, "p1": {"price": 2.0}})
+    assert report["search_failed"] == 1
+
+    updates.down = True
+    report, _ = updates.apply({"p2": {"price": 3.0}, "p3": {"price": 4.0}})
+    assert report == {"updated": 2, "search_failed": 2}
+    # storage and the catalog still take the change, reconcile repairs the index
+    assert updates.storage.products.get("p3")["price"] == 4.0
+    assert [p["id"] for p in updates.published] == ["p0", "p1", "p2", "p3"]
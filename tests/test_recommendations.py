@@ -0,0 +1,78 @@
+from recommendations import CoPurchases
+
+
+def order(created_at, *product_ids):
+    return {
+        "created_at": created_at,
+        "items": {i: {"id": i, "quantity": 1, "total_price": 1.0} for i in product_ids},
+    }
+
+
+def test_related_most_frequent_first():
+    model = CoPurchases()
+    model.add_order(order(1, "a", "b", "c"))
+    model.add_order(order(2, "a", "c"))
+    model.add_order(order(3, "a", "c", "d"))
+    assert model.related("a") == [("c", 3), ("b", 1), ("d", 1)]
+    assert model.related("a", k=1) == [("c", 3)]
+    assert model.related("unknown") == []
+
+
+def test_cached_top_follows_new_orders():
+    model = CoPurchases()
+    model.add_order(order(1, "a", "b"))
+    assert model.related("a") == [("b", 1)]
+    model.add_order(order(2, "a", "c"))
+    model.add_order(order(3, "a", "c"))
+    assert model.related("a") == [("c", 2), ("b", 1)]
+
+
+def test_partners_are_pruned_to_the_most_frequent():
+    model = CoPurchases(max_neighbors=2)
+    for _ in range(3):
+        model.add_order(order(1, "a", "keep"))
+    for n in range(5):
+        model.add_order(order(1, "a", "rare%d" % n))
+    partners = model._pairs["a"]
+    assert len(partners) <= 2 * model.max_neighbors
+    assert partners["keep"] == 3
+    assert model.related("a")[0] == ("keep", 3)
+    assert len(model.related("a")) == 2
+
+
+def test_huge_orders_only_count_their_first_items():
+    model = CoPurchases(max_items=3)
+    model.add_order(order(1, "a", "b", "c", "d", "e"))
+    assert model.metrics() == {"orders": 1, "products": 3, "pairs": 6}
+
+
+def test_catch_up_skips_orders_counted_at_the_high_water_mark():
+    orders = [("o1", order(1, "a", "b")), ("o2", order(2, "a", "c"))]
+    model = CoPurchases()
+    assert model.catch_up(orders) == 2
+    assert model.high_water == 2
+    # storage returns created_at >= high_water, o2 is already counted
+    orders.append(("o3", order(2, "a", "c")))
+    assert model.catch_up(orders[1:]) == 1
+    assert model.related("a") == [("c", 2), ("b", 1)]
+
+
+def test_malformed_orders_do_not_stop_catch_up():
+    model = CoPurchases()
+    orders = [("o1", {"created_at": 1, "items": [{}]}), ("o2", order(2, "a", "b"))]
+    assert model.catch_up(orders) == 2
+    assert model.related("a") == [("b", 1)]
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "recommendations.json")
+    model = CoPurchases()
+    model.build([("o1", order(5, "a", "b")), ("o2", order(5, "b", "c"))])
+    model.save(path)
+
+    loaded = CoPurchases()
+    assert loaded.load(path)
+    assert not loaded.load(path)
+    assert loaded.related("b") == [("a", 1), ("c", 1)]
+    assert loaded.high_water == 5
+    assert loaded.catch_up([("o2", order(5, "b", "c"))]) == 0
@@ -0,0 +1,111 @@
+import json
+
+from reconcile import (
+    bucket_of,
+    content_hash,
+    diff,
+    product_fields,
+    reconcile,
+    typesense_document,
+)
+
+
+def product(n, price=10.0):
+    return {
+        "id": "p%d" % n,
+        "name": "Product %d" % n,
+        "price": price,
+        "sku": "SKU%d" % n,
+        "image": "https://example.com/%d.jpg" % n,
+        "created_at": 1000.0 + n,
+    }
+
+
+class Documents:
+    """
+    The parts of a Typesense collection's documents reconcile uses
+    """
+
+    def __init__(self, products):
+        self.stored = {p["id"]: typesense_document(p) for p in products}
+        self.imported = []
+        self.deleted = []
+
+    def export(self, params):
+        fields = params["include_fields"].split(",")
+        return "\n".join(
+            json.dumps({k: d[k] for k in fields}) for d in self.stored.values()
+        )
+
+    def import_(self, documents, params):
+        assert params == {"action": "upsert"}
+        self.imported.extend(d["id"] for d in documents)
+        for d in documents:
+            self.stored[d["id"]] = d
+        return [{"success": True} for _ in documents]
+
+    def __getitem__(self, product_id):
+        documents = self
+
+        class Document:
+            def delete(self):
+                documents.deleted.append(product_id)
+                del documents.stored[product_id]
+
+        return Document()
+
+
+class Collection:
+    def __init__(self, products):
+        self.documents = Documents(products)
+
+
+def hashes(products):
+    return {p["id"]: content_hash(p) for p in products}
+
+
+CATALOG = [product(n) for n in range(500)]
+
+
+def test_hash_follows_indexed_fields_only():
+    assert content_hash(product(1)) == content_hash(dict(product(1), stock=3))
+    assert content_hash(product(1)) != content_hash(product(1, price=11))
+    # Firebase may hand back integral prices as ints
+    assert content_hash(product(1, price=10)) == content_hash(product(1))
+
+
+def test_in_sync_index_walks_no_buckets():
+    assert diff(hashes(CATALOG), hashes(CATALOG)) == ([], [], 0)
+
+
+def test_diff_finds_insert_update_and_delete_drift():
+    index = hashes(CATALOG[:-1] + [product(500)])  # p499 missing, p500 extra
+    index["p7"] = content_hash(product(7, price=99))  # stale price
+    upserts, deletes, walked = diff(hashes(CATALOG), index)
+    assert sorted(upserts) == ["p499", "p7"]
+    assert deletes == ["p500"]
+    buckets = {bucket_of(k) for k in ("p7", "p499", "p500")}
+    assert walked == len(buckets)
+
+
+def test_reconcile_repairs_the_index():
+    collection = Collection(CATALOG[:-1] + [product(500), product(7, price=99)])
+    report = reconcile(CATALOG, collection)
+    assert (report["upserted"], report["deleted"], report["failed"]) == (2, 1, 0)
+    assert sorted(collection.documents.imported) == ["p499", "p7"]
+    assert collection.documents.deleted == ["p500"]
+    assert collection.documents.stored["p7"]["price"] == 10.0
+    assert reconcile(CATALOG, collection)["buckets_walked"] == 0
+
+
+def test_dry_run_only_reports():
+    collection = Collection(CATALOG[1:])
+    report = reconcile(CATALOG, collection, dry_run=True)
+    assert (report["upserted"], report["dry_run"]) == (1, True)
+    assert collection.documents.imported == []
+
+
+def test_product_fields_drop_the_hash():
+    document = typesense_document(product(1))
+    assert "content_hash" in document
+    assert product_fields(document) == product(1)
@@ -0,0 +1,129 @@
+import sqlite3
+
+import pytest
+
+from storage import SqliteStorage
+
+DAY = 86400
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return SqliteStorage(str(tmp_path / "shop.db"))
+
+
+def order(email, created_at, **items):
+    return {
+        "email": email,
+        "created_at": created_at,
+        "items": {
+            key: {"id": key, "quantity": units, "total_price": units * 2.0}
+            for key, units in items.items()
+        },
+    }
+
+
+def test_orders_are_counted_in_the_sales_tables(storage):
+    storage.orders.add(order("a@b.c", 3 * DAY + 5, p1=1, p2=2))
+    storage.orders.add(order("a@b.c", 4 * DAY + 5, p2=1))
+    storage.orders.add(order("x@y.z", 4 * DAY + 9, p1=3))
+    assert storage.reports.product("p1") == {"units": 4, "revenue": 8.0}
+    assert storage.reports.product("p2") == {"units": 3, "revenue": 6.0}
+    assert storage.reports.product("p3") is None
+    assert storage.reports.user("a@b.c") == {"orders": 2, "revenue": 8.0}
+    assert storage.reports.user("q@q") is None
+    assert storage.reports.days() == [
+        {"day": "1970-01-04", "orders": 1, "units": 3, "revenue": 6.0},
+        {"day": "1970-01-05", "orders": 2, "units": 4, "revenue": 8.0},
+    ]
+    assert [d["day"] for d in storage.reports.days("1970-01-05")] == ["1970-01-05"]
+    assert [d["day"] for d in storage.reports.days(end="1970-01-04")] == [
+        "1970-01-04"
+    ]
+
+
+def test_replacing_orders_does_not_count_them_twice(storage):
+    storage.orders.add_many([("o1", order("a@b.c", DAY, p1=1))])
+    storage.orders.add_many(
+        [("o1", order("a@b.c", DAY, p1=5)), ("o2", order("x@y.z", DAY, p1=1))]
+    )
+    assert storage.reports.product("p1") == {"units": 6, "revenue": 12.0}
+    assert storage.reports.days()[0]["orders"] == 2
+    assert storage.reports.user("a@b.c") == {"orders": 1, "revenue": 10.0}
+
+
+def test_rebuild_matches_the_counted_tables(storage):
+    storage.orders.add(order("a@b.c", DAY, p1=1, p2=2))
+    storage.orders.add(order("x@y.z", 2 * DAY, p2=1))
+    before = (storage.reports.product("p2"), storage.reports.days())
+    assert storage.reports.rebuild() == 2
+    assert (storage.reports.product("p2"), storage.reports.days()) == before
+
+
+def test_existing_database_is_counted_on_open(tmp_path):
+    path = str(tmp_path / "shop.db")
+    SqliteStorage(path).orders.add(order("a@b.c", DAY, p1=2))
+    with sqlite3.connect(path) as conn:
+        conn.execute("DROP TABLE daily_sales")
+        conn.execute("DELETE FROM product_sales")
+    assert SqliteStorage(path).reports.product("p1") == {"units": 2, "revenue": 4.0}
+
+
+def product(n, **fields):
+    return dict(
+        {
+            "id": "p%d" % n,
+            "name": "Product %d" % (9 - n),
+            "price": float(n % 3),
+            "sku": "SKU%d" % n,
+            "image": "%d.jpg" % n,
+            "created_at": 100.0 + n,
+        },
+        **fields,
+    )
+
+
+def test_product_crud(storage):
+    for n in range(5):
+        storage.products.add(product(n))
+    assert storage.products.get("p3") == product(3)
+    assert storage.products.get("nope") is None
+    assert [p["id"] for p in storage.products.all()] == ["p0", "p1", "p2", "p3", "p4"]
+    assert [p["id"] for p in storage.products.all("name")][:2] == ["p4", "p3"]
+    # ties on the sort column are broken by id
+    assert [p["id"] for p in storage.products.all("price")] == [
+        "p0", "p3", "p1", "p4", "p2"
+    ]
+    with pytest.raises(KeyError):
+        storage.products.all("id; DROP TABLE products")
+    assert [p["id"] for p in storage.products.since(103)] == ["p3", "p4"]
+
+    storage.products.update_many({"p1": {"price": 9.5, "stock": 3}})
+    assert storage.products.get("p1") == product(1, price=9.5)
+    storage.products.add(product(1, name="Renamed"))
+    assert storage.products.get("p1")["name"] == "Renamed"
+    storage.products.add_many([product(2, sku="NEW"), product(7)])
+    assert storage.products.get("p2")["sku"] == "NEW"
+    assert len(storage.products.all()) == 6
+
+    new_id = storage.products.add({k: v for k, v in product(8).items() if k != "id"})
+    assert storage.products.get(new_id)["sku"] == "SKU8"
+
+
+def test_orders_for_user_oldest_first(storage):
+    storage.orders.add(order("a@b.c", 30, p1=1))
+    storage.orders.add(order("x@y.z", 20, p1=1))
+    storage.orders.add(order("a@b.c", 10, p2=1))
+    assert [o["created_at"] for _, o in storage.orders.for_user("a@b.c")] == [10, 30]
+    assert storage.orders.for_user("nobody") == []
+
+
+def test_iter_pages_through_created_at_ties(storage):
+    orders = [("o%02d" % n, order("a@b.c", 10 * (n // 4), p1=1)) for n in range(13)]
+    storage.orders.add_many(orders[::-1])
+    for page_size in (1, 3, 4, 5, 500):
+        assert list(storage.orders.iter(page_size=page_size)) == orders
+    assert [k for k, _ in storage.orders.iter(since=10, until=20, page_size=3)] == [
+        "o04", "o05", "o06", "o07", "o08", "o09", "o10", "o11"
+    ]
+    assert list(storage.orders.iter(since=31)) == []
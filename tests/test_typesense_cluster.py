@@ -0,0 +1,133 @@
+import random
+
+import pytest
+import requests
+from typesense.exceptions import ObjectNotFound, ServiceUnavailable
+
+from typesense_cluster import EWMA_WEIGHT, NODE_ERRORS, TypesenseCluster, parse_nodes
+
+
+class FakeClient:
+    def __init__(self, name, calls):
+        self.name = name
+        self.calls = calls
+        self.error = None
+
+    def search(self):
+        self.calls.append(self.name)
+        if self.error is not None:
+            raise self.error
+        return self.name
+
+
+def cluster(count=3, latencies=None, nearest=False, leader=0):
+    nodes = parse_nodes(",".join("n%d:8108:http" % i for i in range(count)))
+    cluster = TypesenseCluster(
+        "key",
+        nodes,
+        nearest_node={"host": "near", "port": "8108", "protocol": "http"}
+        if nearest
+        else None,
+        leader=leader,
+        health_interval=0,
+    )
+    cluster.calls = []
+    for node in cluster.nodes + ([cluster.nearest] if nearest else []):
+        node.client = FakeClient(node.config["host"], cluster.calls)
+    for node, latency in zip(cluster.nodes, latencies or []):
+        node.latency = latency
+    return cluster
+
+
+def search(client):
+    return client.search()
+
+
+def test_parse_nodes():
+    assert parse_nodes("a, b:8108, c:80:http,") == [
+        {"host": "a", "port": "443", "protocol": "https"},
+        {"host": "b", "port": "8108", "protocol": "https"},
+        {"host": "c", "port": "80", "protocol": "http"},
+    ]
+
+
+def test_latency_is_an_ewma():
+    node = cluster(1).nodes[0]
+    node.observe(1.0)
+    assert node.latency == 1.0
+    node.observe(2.0)
+    assert node.latency == pytest.approx(1.0 + EWMA_WEIGHT)
+    for _ in range(100):
+        node.observe(0.1)
+    assert node.latency == pytest.approx(0.1)
+
+
+def test_reads_pick_the_faster_of_two_random_nodes():
+    random.seed(1)
+    c = cluster(3, latencies=[0.3, 0.1, 0.2])
+    first = [c._read_order()[0].name for _ in range(300)]
+    # the slowest node loses every pair, the fastest wins every pair it is in
+    assert "http://n0:8108" not in first
+    assert 150 < first.count("http://n1:8108") < 250
+
+
+def test_reads_skip_unhealthy_nodes():
+    c = cluster(3, latencies=[0.1, 0.2, 0.3])
+    c.nodes[0].healthy = False
+    order = c._read_order()
+    assert [n.name for n in order[:2]] == ["http://n1:8108", "http://n2:8108"]
+    # unhealthy nodes remain the last resort
+    assert order[-1] is c.nodes[0]
+    c.nodes[1].healthy = c.nodes[2].healthy = False
+    assert c._read_order()[0] is c.nodes[0]
+
+
+def test_nearest_node_is_tried_first():
+    c = cluster(3, nearest=True)
+    assert c.read(search) == "near"
+    c.nearest.healthy = False
+    assert c.read(search) != "near"
+
+
+def test_node_errors_fail_over_and_mark_the_node():
+    c = cluster(2, latencies=[0.1, 0.1])
+    c.nodes[0].client.error = requests.exceptions.ConnectionError("down")
+    c.nodes[1].client.error = ServiceUnavailable(503, "busy")
+    with pytest.raises(NODE_ERRORS):
+        c.read(search)
+    assert sorted(c.calls) == ["n0", "n1"]
+    assert [n.healthy for n in c.nodes] == [False, False]
+    assert [n.errors for n in c.nodes] == [1, 1]
+
+    c.nodes[1].client.error = None
+    assert c.read(search) == "n1"
+    assert c.nodes[1].healthy
+    assert c.nodes[1].latency > 0
+
+
+def test_request_errors_do_not_fail_over():
+    c = cluster(2)
+    for node in c.nodes:
+        node.client.error = ObjectNotFound(404, "no such document")
+    with pytest.raises(ObjectNotFound):
+        c.read(search)
+    assert len(c.calls) == 1
+    assert all(n.healthy for n in c.nodes)
+
+
+def test_writes_go_to_the_leader_then_the_fastest_followers():
+    c = cluster(3, latencies=[0.3, 0.1, 0.2], leader=1)
+    assert c.write(search) == "n1"
+    c.nodes[1].client.error = requests.exceptions.Timeout()
+    c.nodes[2].client.error = requests.exceptions.Timeout()
+    assert c.write(search) == "n0"
+    assert c.calls == ["n1", "n1", "n2", "n0"]
+    assert [m["leader"] for m in c.metrics()] == [False, True, False]
+
+
+def test_no_nodes():
+    c = TypesenseCluster("key", [], health_interval=0)
+    with pytest.raises(Exception, match="No Typesense nodes"):
+        c.write(search)
+    c.start()
+    assert c._thread is None
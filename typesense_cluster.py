@@ -0,0 +1,173 @@
+"""
+Health and latency aware routing over a multi-node Typesense cluster.
+
+Each node gets its own single-node client. A background thread probes every
+node's /health endpoint, and every call feeds an exponentially weighted
+moving average of the node's latency. Reads go to the better of two randomly
+picked healthy nodes (power of two choices), which spreads load over the
+replicas while steering away from slow ones; writes go to the leader. A call
+that fails marks its node unhealthy and is retried on the next candidate.
+"""
+import random
+import threading
+import time
+
+import requests
+import typesense
+from typesense.exceptions import ServerError, ServiceUnavailable
+
+EWMA_WEIGHT = 0.2
+# Errors that say something about the node rather than about the request
+NODE_ERRORS = (requests.exceptions.RequestException, ServerError, ServiceUnavailable)
+
+
+def parse_nodes(value, default_port="443", default_protocol="https"):
+    """
+    Parses "host[:port[:protocol]],..." into Typesense node dicts
+    """
+    nodes = []
+    for entry in value.split(","):
+        parts = entry.strip().split(":")
+        if not parts[0]:
+            continue
+        nodes.append(
+            {
+                "host": parts[0],
+                "port": parts[1] if len(parts) > 1 else default_port,
+                "protocol": parts[2] if len(parts) > 2 else default_protocol,
+            }
+        )
+    return nodes
+
+
+class Node:
+    def __init__(self, config, api_key, timeout):
+        self.config = config
+        self.name = "%(protocol)s://%(host)s:%(port)s" % config
+        self.client = typesense.Client(
+            {
+                "api_key": api_key,
+                "nodes": [config],
+                "connection_timeout_seconds": timeout,
+                "num_retries": 0,
+            }
+        )
+        self.healthy = True
+        self.latency = 0.0
+        self.errors = 0
+
+    def observe(self, seconds):
+        if self.latency == 0.0:
+            self.latency = seconds
+        else:
+            self.latency += EWMA_WEIGHT * (seconds - self.latency)
+
+    def metrics(self):
+        return {
+            "node": self.name,
+            "healthy": self.healthy,
+            "latency": self.latency,
+            "errors": self.errors,
+        }
+
+
+class TypesenseCluster:
+    def __init__(
+        self,
+        api_key,
+        nodes,
+        nearest_node=None,
+        leader=0,
+        timeout=2.0,
+        health_interval=5.0,
+    ):
+        self.api_key = api_key
+        self.timeout = timeout
+        self.nodes = [Node(n, api_key, timeout) for n in nodes]
+        self.nearest = Node(nearest_node, api_key, timeout) if nearest_node else None
+        self.leader = self.nodes[leader] if self.nodes else None
+        self.health_interval = health_interval
+        self._thread = None
+
+    def start(self):
+        """
+        Starts the background health checks
+        """
+        if self._thread is None and self.health_interval > 0:
+            self._thread = threading.Thread(target=self._check_health, daemon=True)
+            self._thread.start()
+
+    def read(self, fn):
+        """
+        Runs fn(client) on the best healthy node, failing over on errors
+        """
+        return self._call(self._read_order(), fn)
+
+    def write(self, fn):
+        """
+        Runs fn(client) on the leader, failing over to the other nodes, which
+        forward writes to the leader, when it is unreachable
+        """
+        leader = [self.leader] if self.leader is not None else []
+        others = [n for n in self.nodes if n is not self.leader]
+        return self._call(leader + self._by_latency(others), fn)
+
+    def metrics(self):
+        nodes = self.nodes + ([self.nearest] if self.nearest else [])
+        return [dict(n.metrics(), leader=n is self.leader) for n in nodes]
+
+    def _by_latency(self, nodes):
+        return sorted(nodes, key=lambda n: (not n.healthy, n.latency))
+
+    def _read_order(self):
+        healthy = [n for n in self.nodes if n.healthy]
+        if len(healthy) >= 2:
+            first, second = random.sample(healthy, 2)
+            best = first if first.latency <= second.latency else second
+        else:
+            best = healthy[0] if healthy else None
+        order = []
+        if self.nearest is not None and self.nearest.healthy:
+            order.append(self.nearest)
+        if best is not None:
+            order.append(best)
+        candidates = self.nodes + ([self.nearest] if self.nearest else [])
+        order.extend(n for n in self._by_latency(candidates) if n not in order)
+        return order
+
+    def _call(self, order, fn):
+        error = None
+        for node in order:
+            started = time.perf_counter()
+            try:
+                result = fn(node.client)
+            except NODE_ERRORS as e:
+                node.errors += 1
+                node.healthy = False
+                error = e
+                continue
+            except Exception:
+                # the node answered, the request itself was rejected
+                node.observe(time.perf_counter() - started)
+                raise
+            node.observe(time.perf_counter() - started)
+            node.healthy = True
+            return result
+        raise error or Exception("No Typesense nodes configured")
+
+    def _check_health(self):
+        while True:
+            for node in self.nodes + ([self.nearest] if self.nearest else []):
+                started = time.perf_counter()
+                try:
+                    response = requests.get(
+                        node.name + "/health",
+                        headers={"X-TYPESENSE-API-KEY": self.api_key},
+                        timeout=self.timeout,
+                    )
+                    node.healthy = response.ok and response.json().get("ok", False)
+                except Exception:
+                    node.healthy = False
+                if node.healthy:
+                    node.observe(time.perf_counter() - started)
+            time.sleep(self.health_interval)